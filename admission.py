@@ -0,0 +1,57 @@
+import math
+import os
+import subprocess
+import wave
+
+#Processing seconds per audio second; music goes through Demucs and possibly the whole cascade
+SPEECH_COST = float(os.environ.get("WHISPERHALLU_COST_SPEECH", "0.15"))
+MUSIC_COST = float(os.environ.get("WHISPERHALLU_COST_MUSIC", "0.6"))
+#Fixed per request cost: conversion, VAD, model warm path
+REQUEST_COST = 2.0
+#Estimated seconds of queued work above which new requests get a 429
+MAX_BACKLOG = float(os.environ.get("WHISPERHALLU_MAX_BACKLOG", "1800"))
+#Cost seconds forgiven per second of waiting, so long jobs still reach the front
+AGING_RATE = float(os.environ.get("WHISPERHALLU_AGING_RATE", "0.5"))
+
+#Upload bytes per audio second assumed before decoding, a 128 kb/s MP3
+UPLOAD_BYTES_PER_SECOND = 16000
+
+#(upper bound in audio seconds, name)
+SIZE_CLASSES = ((30, "short"), (180, "medium"), (float("inf"), "long"))
+
+class Overloaded(Exception):
+    def __init__(self, retryAfter, backlog):
+        super().__init__("Estimated backlog "+str(int(backlog))+"s, retry in "+str(retryAfter)+"s")
+        self.retryAfter = retryAfter
+        self.backlog = backlog
+
+def probeDuration(path):
+    """Audio duration in seconds from the WAV header, or ffprobe for anything else (0 if unknown)."""
+    try:
+        with wave.open(path) as f:
+            return f.getnframes() / float(f.getframerate())
+    except (wave.Error, EOFError, OSError):
+        pass
+    try:
+        out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+                             capture_output=True, text=True, timeout=10).stdout
+        return float(out.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return 0.0
+
+def estimateCost(duration, isMusic):
+    return REQUEST_COST + duration * (MUSIC_COST if isMusic else SPEECH_COST)
+
+def uploadCost(contentLength):
+    """Cost of a request that is not decoded yet, from its size: priced as music, the expensive case."""
+    return estimateCost(contentLength / UPLOAD_BYTES_PER_SECOND, isMusic=True)
+
+def sizeClass(duration):
+    for bound, name in SIZE_CLASSES:
+        if duration < bound:
+            return name
+
+def admit(cost, backlog, workers=1, maxBacklog=MAX_BACKLOG):
+    """Raise Overloaded with a Retry-After estimate if this request would push the backlog over the limit."""
+    if backlog > 0 and backlog + cost > maxBacklog:
+        raise Overloaded(max(1, math.ceil((backlog + cost - maxBacklog) / max(workers, 1))), backlog)
@@ -0,0 +1,23 @@
+import unittest
+
+from admission import UPLOAD_BYTES_PER_SECOND, Overloaded, admit, estimateCost, probeDuration, sizeClass, uploadCost
+
+class TestAdmission(unittest.TestCase):
+    def test_cost_and_size_class(self):
+        self.assertGreater(estimateCost(60, isMusic=True), estimateCost(60, isMusic=False))
+        self.assertEqual([sizeClass(d) for d in (5, 60, 600)], ["short", "medium", "long"])
+        self.assertEqual(uploadCost(60 * UPLOAD_BYTES_PER_SECOND), estimateCost(60, isMusic=True))
+
+    def test_probe_duration(self):
+        self.assertGreater(probeDuration("markers/WOK-MRK-en.wav"), 0)
+        self.assertEqual(probeDuration("does-not-exist.mp3"), 0.0)
+
+    def test_admit(self):
+        admit(5000, 0, maxBacklog=100)  #an idle server takes anything
+        admit(10, 80, maxBacklog=100)
+        with self.assertRaises(Overloaded) as e:
+            admit(50, 80, workers=2, maxBacklog=100)
+        self.assertEqual(e.exception.retryAfter, 15)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import wave
+
+import numpy as np
+
+#Classifier input: mono at 16 kHz, an excerpt from the middle of the file
+RATE = 16000
+EXCERPT_SECONDS = float(os.environ.get("WHISPERHALLU_CLASSIFY_SECONDS", "20"))
+FRAME = 512
+HOP = 256
+#Frames per ~1 s analysis window
+WINDOW = RATE // HOP
+#Speech score under which the audio is treated as music
+MUSIC_THRESHOLD = float(os.environ.get("WHISPERHALLU_MUSIC_THRESHOLD", "1.0"))
+#RMS under which the excerpt is silence: no separation either
+SILENCE_RMS = 1e-3
+#Frames of a vocals stem louder than this (dBFS) count as vocal activity
+ACTIVITY_DB = float(os.environ.get("WHISPERHALLU_ACTIVITY_DB", "-40"))
+
+def readExcerpt(path, duration=None, seconds=EXCERPT_SECONDS):
+    """Float32 mono samples at RATE, `seconds` long, centred in the file."""
+    offset = max(0.0, (duration - seconds) / 2) if duration else 0.0
+    try:
+        with wave.open(path) as w:
+            if w.getsampwidth() != 2:
+                raise wave.Error("not 16-bit PCM")
+            rate = w.getframerate()
+            channels = w.getnchannels()
+            if not duration:
+                offset = max(0.0, (w.getnframes() / float(rate) - seconds) / 2)
+            w.setpos(int(offset * rate))
+            data = w.readframes(int(seconds * rate))
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+        if rate != RATE and len(samples):
+            samples = np.interp(np.arange(0, len(samples) / rate, 1.0 / RATE), np.arange(len(samples)) / rate, samples).astype(np.float32)
+        return samples
+    except (wave.Error, EOFError):
+        pass
+    cmd = ["ffmpeg", "-v", "error", "-ss", str(offset), "-t", str(seconds), "-i", path, "-ac", "1", "-ar", str(RATE), "-f", "s16le", "-"]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise IOError("Can't decode "+path+": "+result.stderr.decode("utf-8", "replace").strip()[-300:])
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768
+
+def features(samples):
+    """Low short-time energy ratio and high zero-crossing rate ratio, per ~1 s window then averaged.
+
+    Speech alternates syllables and pauses (many quiet frames) and voiced and
+    unvoiced sounds (ZCR bursts); music keeps a steadier energy and ZCR.
+    """
+    count = 1 + (len(samples) - FRAME) // HOP
+    if count < WINDOW // 2:
+        return {"rms": float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0, "low_energy": 0.0, "high_zcr": 0.0}
+    frames = samples[np.arange(FRAME)[None, :] + HOP * np.arange(count)[:, None]]
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    zcr = np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1)
+    lowEnergy = []
+    highZcr = []
+    for start in range(0, count - WINDOW // 2 + 1, WINDOW):
+        r = rms[start:start + WINDOW]
+        z = zcr[start:start + WINDOW]
+        lowEnergy.append(np.mean(r < 0.5 * r.mean()))
+        highZcr.append(np.mean(z > 1.5 * z.mean()))
+    return {"rms": float(np.sqrt(np.mean(samples ** 2))), "low_energy": float(np.mean(lowEnergy)), "high_zcr": float(np.mean(highZcr))}
+
+def speechScore(feats):
+    #Typical speech is around 0.5 low energy / 0.25 high ZCR, music near 0 / 0.05-0.15
+    return feats["low_energy"] / 0.3 + feats["high_zcr"] / 0.3
+
+def classify(path, duration=None, threshold=MUSIC_THRESHOLD):
+    """("music" | "speech" | "silence", speech score) for the audio at `path`."""
+    feats = features(readExcerpt(path, duration))
+    if feats["rms"] < SILENCE_RMS:
+        return "silence", 0.0
+    score = speechScore(feats)
+    return ("speech" if score >= threshold else "music"), score
+
+def vocalActivity(path, thresholdDb=ACTIVITY_DB, maxSeconds=3600):
+    """Seconds of frames above `thresholdDb` in a separated vocals stem, silent where nobody sings or speaks."""
+    samples = readExcerpt(path, seconds=maxSeconds)
+    count = 1 + (len(samples) - FRAME) // HOP
+    if count <= 0:
+        return 0.0
+    frames = samples[np.arange(FRAME)[None, :] + HOP * np.arange(count)[:, None]]
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return float(np.sum(rms > 10 ** (thresholdDb / 20.0)) * HOP / RATE)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from audio_classifier import RATE, classify, readExcerpt, vocalActivity
+
+def writeWav(samples, rate, channels=1):
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    data = (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.repeat(data, channels).tobytes())
+    return path
+
+def synthMusic(seconds, rate):
+    """Chords changing every half second over a noisy beat: steady energy, no pauses."""
+    t = np.arange(int(seconds * rate)) / rate
+    notes = [220.0, 261.6, 329.6, 392.0, 440.0, 523.3]
+    chords = np.zeros_like(t)
+    for i in range(int(seconds * 2)):
+        span = (t >= i * 0.5) & (t < (i + 1) * 0.5)
+        for f0 in (notes[i % 6], notes[(i + 2) % 6]):
+            for h in range(1, 6):
+                chords[span] += np.sin(2 * np.pi * f0 * h * t[span]) / h
+    beat = np.exp(-(t % 0.5) * 30) * np.random.default_rng(0).normal(0, 1, len(t))
+    return 0.1 * chords + 0.3 * beat
+
+class TestAudioClassifier(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+        self.addCleanup(lambda: [os.unlink(p) for p in self.paths])
+
+    def wav(self, samples, rate, channels=1):
+        self.paths.append(writeWav(samples, rate, channels))
+        return self.paths[-1]
+
+    def test_speech(self):
+        for lng in ("en", "de", "fr"):
+            label, score = classify("markers/OKW-MRK-"+lng+".wav")
+            self.assertEqual(label, "speech", lng+" score "+str(score))
+
+    def test_music_resampled_from_stereo(self):
+        label, score = classify(self.wav(synthMusic(12, 44100), 44100, channels=2))
+        self.assertEqual(label, "music", "score "+str(score))
+
+    def test_silence(self):
+        self.assertEqual(classify(self.wav(np.zeros(RATE * 3), RATE))[0], "silence")
+
+    def test_excerpt_is_centred(self):
+        #Ramp: the excerpt of a 10 s file starts around 4 s
+        path = self.wav(np.arange(RATE * 10) / (RATE * 10.0), RATE)
+        samples = readExcerpt(path, seconds=2)
+        self.assertEqual(len(samples), RATE * 2)
+        self.assertAlmostEqual(float(samples[0]), 0.4, places=3)
+
+    def test_vocal_activity(self):
+        #2 s of tone between 3 s of near silence
+        quiet = np.full(RATE * 3, 1e-4)
+        tone = 0.1 * np.sin(2 * np.pi * 440 * np.arange(RATE * 2) / RATE)
+        active = vocalActivity(self.wav(np.concatenate([quiet, tone, quiet]), RATE))
+        self.assertAlmostEqual(active, 2.0, delta=0.05)
+        self.assertEqual(vocalActivity(self.wav(quiet, RATE)), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import io
+import os
+import struct
+import subprocess
+import tempfile
+import wave
+
+#What each server consumes: Whisper 16 kHz mono, htdemucs 44.1 kHz stereo
+TARGETS = {
+    "whisper": {"rate": 16000, "channels": 1},
+    "demucs": {"rate": 44100, "channels": 2},
+}
+#Codec options per pre-encode format; Opus is lossy but much smaller than FLAC for speech,
+#16-bit WAV is the largest but skips the server-side conversion (readyWavDuration)
+CODECS = {
+    "wav": (".wav", ["-c:a", "pcm_s16le"]),
+    "flac": (".flac", ["-c:a", "flac", "-compression_level", "8"]),
+    "opus": (".opus", ["-c:a", "libopus", "-b:a", "32k", "-application", "voip"]),
+}
+
+def sniff(path):
+    """(container, sample rate, channels) from the file header; rate/channels are None when not read."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+    except OSError:
+        return None, None, None
+    return _sniffHead(head, lambda: wave.open(path))
+
+def sniffBytes(data):
+    """sniff() for audio already in memory."""
+    return _sniffHead(data[:64], lambda: wave.open(io.BytesIO(data)))
+
+def _sniffHead(head, openWav):
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        try:
+            with openWav() as w:
+                return "wav", w.getframerate(), w.getnchannels()
+        except (wave.Error, EOFError):
+            #Not PCM (e.g. float or extensible WAV)
+            return "wav", None, None
+    if head[:4] == b"fLaC" and len(head) >= 26:
+        #STREAMINFO: 20 bits sample rate, 3 bits channels-1, right after the block sizes
+        bits = struct.unpack(">Q", head[18:26])[0]
+        return "flac", bits >> 44, ((bits >> 41) & 0x7) + 1
+    if head[:4] == b"OggS" and b"OpusHead" in head:
+        i = head.index(b"OpusHead")
+        #Opus always decodes at 48 kHz, the header keeps the original input rate
+        channels = head[i+9] if len(head) > i+9 else None
+        rate = struct.unpack("<I", head[i+12:i+16])[0] if len(head) >= i+16 else None
+        return "opus", rate, channels
+    if head[:3] == b"ID3" or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "mp3", None, None
+    return None, None, None
+
+def isPreencoded(path, target="whisper"):
+    """True if the file is already lossless PCM/FLAC at the rate and channel count the target consumes."""
+    container, rate, channels = sniff(path)
+    wanted = TARGETS[target]
+    return container in ("wav", "flac") and rate == wanted["rate"] and channels == wanted["channels"]
+
+def readyWavDuration(path, target="whisper"):
+    """Duration of a 16-bit PCM WAV already at the target rate and channel count, else None."""
+    wanted = TARGETS[target]
+    try:
+        with wave.open(path) as w:
+            if w.getsampwidth() == 2 and w.getframerate() == wanted["rate"] and w.getnchannels() == wanted["channels"]:
+                return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError, OSError):
+        pass
+    return None
+
+def preencode(path, target="whisper", codec="flac", outPath=None):
+    """Transcode `path` to what the target server consumes, returns the new file (caller removes it)."""
+    suffix, codecArgs = CODECS[codec]
+    wanted = TARGETS[target]
+    if outPath is None:
+        fd, outPath = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+    cmd = (["ffmpeg", "-y", "-v", "error", "-i", path, "-vn", "-ac", str(wanted["channels"]), "-ar", str(wanted["rate"])]
+           + codecArgs + [outPath])
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        error = result.stderr.strip()[-500:] if result.returncode != 0 else None
+    except OSError as e:
+        error = str(e)
+    if error is not None:
+        os.unlink(outPath)
+        raise IOError("Can't pre-encode "+path+": "+error)
+    return outPath
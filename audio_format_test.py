@@ -0,0 +1,57 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import wave
+
+from audio_format import isPreencoded, preencode, readyWavDuration, sniff, sniffBytes
+
+def writeWav(path, rate, channels, seconds=1.0):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0\0" * channels * int(rate * seconds))
+
+class TestAudioFormat(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_wav(self):
+        ready = os.path.join(self.tmp, "ready.wav")
+        writeWav(ready, 16000, 1, seconds=2.5)
+        self.assertEqual(sniff(ready), ("wav", 16000, 1))
+        self.assertTrue(isPreencoded(ready))
+        self.assertEqual(readyWavDuration(ready), 2.5)
+        with open(ready, "rb") as f:
+            self.assertEqual(sniffBytes(f.read()), ("wav", 16000, 1))
+
+        self.assertEqual(sniff("markers/WOK-MRK-en.wav"), ("wav", 44100, 1))
+        self.assertIsNone(readyWavDuration("markers/WOK-MRK-en.wav"))
+
+    def test_flac_and_opus_headers(self):
+        #STREAMINFO for 44.1 kHz stereo 16 bits
+        bits = (44100 << 44) | (1 << 41) | (15 << 36) | 1000
+        flac = b"fLaC" + b"\x00\x00\x00\x22" + b"\x10\x00\x10\x00" + b"\x00" * 6 + struct.pack(">Q", bits) + b"\x00" * 16
+        self.assertEqual(sniffBytes(flac), ("flac", 44100, 2))
+        opus = b"OggS" + b"\x00" * 24 + b"OpusHead" + bytes([1, 1]) + b"\x38\x01" + struct.pack("<I", 16000) + b"\x00" * 8
+        self.assertEqual(sniffBytes(opus), ("opus", 16000, 1))
+        self.assertEqual(sniffBytes(b"ID3\x04" + b"\x00" * 60)[0], "mp3")
+
+    @unittest.skipUnless(shutil.which("ffmpeg"), "ffmpeg not installed")
+    def test_preencode(self):
+        path = preencode("markers/WOK-MRK-en.wav", codec="flac")
+        self.addCleanup(os.unlink, path)
+        self.assertEqual(sniff(path), ("flac", 16000, 1))
+        path = preencode("markers/WOK-MRK-en.wav", target="demucs", codec="flac")
+        self.addCleanup(os.unlink, path)
+        self.assertTrue(isPreencoded(path, "demucs"))
+        #What the server can use without converting
+        path = preencode("markers/WOK-MRK-en.wav", codec="wav")
+        self.addCleanup(os.unlink, path)
+        self.assertIsNotNone(readyWavDuration(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import argparse
+import time
+
+import torch
+from demucs import pretrained
+from demucs.apply import apply_model
+
+from demucs_batching import separateBatch
+from separation_engine import SeparationEngine
+
+def unbatched(model, wavs):
+    #What DemucsAPI.predict did before batching: one apply_model call per request
+    return [apply_model(model, wav[None], shifts=0, split=True, overlap=.25, device="cpu")[0] for wav in wavs]
+
+def batched(engine, wavs, maxSegments):
+    return separateBatch(engine.model, wavs, engine.forward, maxSegments=maxSegments)
+
+def bench(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare one apply_model call per request with packed segments on CPU")
+    parser.add_argument("--requests", type=int, nargs="+", default=[1, 4, 8], help="Requests per batch")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each request")
+    parser.add_argument("--max_segments", type=int, default=16, help="Segments per forward pass")
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--engine", default="eager", choices=["eager", "torchscript", "onnx"], help="Engine of the batched path")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = pretrained.get_model(name="htdemucs").cpu().eval()
+    engine = SeparationEngine(model, engine=args.engine, threads=args.threads)
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for nbRequests in args.requests:
+            wavs = [torch.randn(2, int(args.seconds * model.samplerate), generator=generator) * 0.1 for _ in range(nbRequests)]
+            audio = nbRequests * args.seconds
+            tOld = bench(lambda: unbatched(model, wavs), args.repeat)
+            tNew = bench(lambda: batched(engine, wavs, args.max_segments), args.repeat)
+            print("REQUESTS=%d x %.1fs threads=%d engine=%s unbatched=%.2fs (x%.2f realtime) batched=%.2fs (x%.2f realtime) speedup=%.2fx"
+                  % (nbRequests, args.seconds, args.threads, engine.engine, tOld, audio / tOld, tNew, audio / tNew, tOld / tNew))
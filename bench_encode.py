@@ -0,0 +1,67 @@
+import argparse
+import json
+import random
+import time
+
+from json_util import split_transcription
+from transcription_result import SegmentTable, TranscriptionResult
+
+def synthetic_segments(nbSegments, wordsPerSegment, seed=0):
+    """Yield (start, end, sentence, words) tuples shaped like faster-whisper output."""
+    rnd = random.Random(seed)
+    vocab = ["hello", "world", "this", "is", "a", "test", "ok", "whisper", "xin", "chào", "bạn"]
+    t = 0.0
+    for _ in range(nbSegments):
+        words = []
+        for w in range(wordsPerSegment):
+            aWord = rnd.choice(vocab)
+            if w == wordsPerSegment - 1 or rnd.random() < 0.1:
+                aWord += rnd.choice([",", "."])
+            words.append((round(t, 2), round(t + 0.3, 2), aWord))
+            t += 0.35
+        yield words[0][0], words[-1][1], " ".join(w[2] for w in words), words
+
+def old_path(segments):
+    #transcribeMARK dicts -> split_transcription -> dumps -> encode_response loads/dumps
+    result = {"srt": "", "text": "", "json": []}
+    for start, end, sentence, words in segments:
+        result["text"] += sentence
+        result["json"].append({"start": start, "end": end, "sentence": sentence,
+                               "words": [{"start": s, "end": e, "text": t} for s, e, t in words]})
+    result["json"] = split_transcription(result["json"])
+    transcription = json.dumps(result)
+    return json.dumps(json.loads(transcription)).encode()
+
+def new_path(segments, compression=None):
+    table = SegmentTable()
+    text = []
+    for start, end, sentence, words in segments:
+        text.append(sentence)
+        table.append(start, end, sentence, words)
+    #The old path carried an empty srt, so skip subtitle rendering here
+    result = TranscriptionResult("".join(text), "", table.split_sentences(), outputs=frozenset(("text", "json", "words")))
+    return result.encode(compression)[0]
+
+def bench(fn, segments, repeat):
+    best = None
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        body = fn(segments)
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the old triple-JSON encode path with TranscriptionResult")
+    parser.add_argument("--segments", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--words", type=int, default=12, help="Words per segment")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for nbSegments in args.segments:
+        segments = list(synthetic_segments(nbSegments, args.words))
+        tOld, sOld = bench(old_path, segments, args.repeat)
+        tNew, sNew = bench(new_path, segments, args.repeat)
+        tGz, sGz = bench(lambda s: new_path(s, "gzip"), segments, args.repeat)
+        print("SEGMENTS=%d WORDS=%d old=%.1fms (%dB) new=%.1fms (%dB) new+gzip=%.1fms (%dB) speedup=%.2fx"
+              % (nbSegments, nbSegments * args.words, tOld * 1000, sOld, tNew * 1000, sNew, tGz * 1000, sGz, tOld / tNew))
@@ -1,15 +1,22 @@
 import argparse
+import os
 import requests
 from datetime import datetime
+from audio_format import preencode
 
 # Update this URL to your server's URL if hosted remotely
 API_URL = "https://demucs.singmesong.com/predict"
 
-def send_request(path):
+def send_request(path, preencode_codec=None):
 
+    if preencode_codec:
+        # Upload exactly what Demucs consumes: 44.1 kHz stereo
+        path = encoded = preencode(path, target="demucs", codec=preencode_codec)
     inputFile = open(path, 'rb')
     inputData = inputFile.read()
     inputFile.close()
+    if preencode_codec:
+        os.unlink(encoded)
 
     response = requests.post(API_URL, files={"prompt": (None, ""), "content": inputData})
     if response.status_code == 200:
@@ -25,6 +32,7 @@ def send_request(path):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sends a file to the deep filter net server and receives the enhanced audio")
     parser.add_argument("--path", required=True, help="Path of the audio file to convert")
+    parser.add_argument("--preencode", choices=["flac"], default=None, help="Transcode to 44.1 kHz stereo FLAC before upload")
     args = parser.parse_args()
     
-    send_request(args.path)
\ No newline at end of file
+    send_request(args.path, args.preencode)
\ No newline at end of file
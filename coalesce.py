@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import json
+from threading import Event, Lock
+
+from metrics import metrics
+
+def requestKey(audioDigest, **options):
+    """Identity of a transcription: audio content plus every option that changes the result."""
+    payload = json.dumps(options, sort_keys=True, default=sorted)
+    return hashlib.sha1((audioDigest+"|"+payload).encode("utf-8")).hexdigest()
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class InFlight:
+    """Concurrent calls with the same key share one computation and its result (or exception).
+
+    Nothing is kept once the call returns: later identical requests run again.
+    Per process only: it joins the job worker threads' runs. /predict requests,
+    handled one at a time by separate LitServe workers, are joined by AsyncInFlight
+    in the server process instead.
+    """
+
+    def __init__(self, counter="coalesced_requests_total"):
+        self.counter = counter
+        self.lock = Lock()
+        self.calls = {}
+
+    def run(self, key, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.followers += 1
+        if not leader:
+            print("COALESCED with in-flight request "+key[:12], flush=True)
+            metrics.inc(self.counter)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+class AsyncInFlight:
+    """InFlight for coroutines of one event loop: concurrent calls with the same key await one run."""
+
+    def __init__(self, counter="coalesced_requests_total"):
+        self.counter = counter
+        self.calls = {}
+
+    async def run(self, key, fn, *args):
+        call = self.calls.get(key)
+        if call is not None:
+            print("COALESCED with in-flight request "+key[:12], flush=True)
+            metrics.inc(self.counter)
+            #A follower going away must not cancel the leader's run
+            return await asyncio.shield(call)
+        call = self.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args)
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            #Retrieved so an error nobody else waited for is not logged again
+            call.exception()
+            raise
+        finally:
+            del self.calls[key]
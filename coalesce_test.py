@@ -0,0 +1,81 @@
+import asyncio
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest.mock import patch
+
+import metrics
+from coalesce import AsyncInFlight, InFlight, requestKey
+
+class TestInFlight(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_request_key(self):
+        self.assertEqual(requestKey("abc", lng="vi", outputs=frozenset({"srt", "text"})),
+                         requestKey("abc", outputs=["srt", "text"], lng="vi"))
+        self.assertNotEqual(requestKey("abc", lng="vi"), requestKey("abc", lng="en"))
+        self.assertNotEqual(requestKey("abc", lng="vi"), requestKey("abd", lng="vi"))
+
+    def test_duplicates_share_one_run(self):
+        inFlight = InFlight()
+        release = Event()
+        runs = []
+        def work(name):
+            runs.append(name)
+            release.wait(5)
+            return {"text": "shared"}
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(inFlight.run, "key", work, i) for i in range(3)]
+            while sum(c.followers for c in list(inFlight.calls.values())) < 2:
+                release.wait(0.01)
+            release.set()
+            results = [f.result() for f in futures]
+        self.assertEqual(len(runs), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(metrics.metrics.counters["coalesced_requests_total"], 2)
+        self.assertEqual(inFlight.calls, {})
+
+    def test_errors_are_shared_and_not_kept(self):
+        inFlight = InFlight()
+        def fail():
+            raise RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            inFlight.run("key", fail)
+        self.assertEqual(inFlight.run("key", lambda: 42), 42)
+
+    def test_async_duplicates_share_one_run(self):
+        inFlight = AsyncInFlight(counter="predict_coalesced_total")
+        runs = []
+        async def work(name):
+            runs.append(name)
+            await asyncio.sleep(0.05)
+            return {"text": "shared"}
+        async def main():
+            return await asyncio.gather(*(inFlight.run("key", work, i) for i in range(3)))
+        before = metrics.metrics.counters.get("predict_coalesced_total", 0)
+        results = asyncio.run(main())
+        self.assertEqual(len(runs), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(metrics.metrics.counters["predict_coalesced_total"] - before, 2)
+        self.assertEqual(inFlight.calls, {})
+
+    def test_async_errors_are_shared_and_not_kept(self):
+        inFlight = AsyncInFlight(counter="predict_coalesced_total")
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+        async def answer():
+            return 42
+        async def main():
+            results = await asyncio.gather(inFlight.run("key", fail), inFlight.run("key", fail), return_exceptions=True)
+            return results, await inFlight.run("key", answer)
+        results, later = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(later, 42)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+#Short speech clip shipped with the repo, override with WHISPERHALLU_TUNE_CLIP
+REFERENCE_CLIP = os.environ.get("WHISPERHALLU_TUNE_CLIP", "markers/WOK-MRK-en.wav")
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "whisperhallu", "cpu_tuning.json")
+
+def hostCores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def candidateConfigs(cores):
+    """(cpu_threads, num_workers) pairs that keep threads * workers close to the core count."""
+    configs = []
+    for threads in sorted({cores, cores // 2, cores // 4, cores // 8} - {0}, reverse=True):
+        configs.append((threads, max(cores // threads, 1)))
+    return configs
+
+def clipDuration(path):
+    with wave.open(path) as f:
+        return f.getnframes() / float(f.getframerate())
+
+def measureThroughput(model, clip, workers, repeat=2, options=None):
+    """Audio seconds transcribed per wall-clock second with `workers` concurrent passes.
+
+    With one pass this is the inverse of single-request latency.
+    """
+    options = options or dict(beam_size=5)
+    def run(_):
+        segments, info = model.transcribe(clip, **options)
+        for _segment in segments:
+            pass
+    run(0) #warm-up
+    jobs = workers * repeat
+    startTime = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, range(jobs)))
+    return jobs * clipDuration(clip) / (time.time() - startTime)
+
+def autotune(modelPath, computeType="int8", clip=REFERENCE_CLIP, cores=None, repeat=2, cachePath=CACHE_PATH, loader=None, concurrency=1):
+    """Pick the fastest cpu_threads/num_workers for this host, cached per model, compute type, core count and concurrency.
+
+    Each config is measured with as many concurrent passes as the process really runs
+    (`concurrency`): a LitServe worker serves one request at a time, so there the
+    lowest single-request latency wins, not the best aggregate throughput.
+    """
+    cores = cores or hostCores()
+    cacheKey = modelPath+"|"+computeType+"|"+str(cores)+"|"+str(concurrency)
+    cache = {}
+    if cachePath and os.path.exists(cachePath):
+        try:
+            with open(cachePath) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        if cacheKey in cache:
+            print("CPU TUNING (cached): "+str(cache[cacheKey]))
+            return cache[cacheKey]
+
+    if loader is None:
+        from faster_whisper import WhisperModel
+        def loader(threads, workers):
+            return WhisperModel(modelPath, device="cpu", compute_type=computeType, cpu_threads=threads, num_workers=workers)
+
+    results = []
+    for threads, workers in candidateConfigs(cores):
+        model = loader(threads, workers)
+        throughput = measureThroughput(model, clip, min(workers, concurrency), repeat=repeat)
+        del model
+        print("CPU TUNING: cpu_threads="+str(threads)+" num_workers="+str(workers)+" x"+str(round(throughput, 2))+" realtime", flush=True)
+        results.append({"cpu_threads": threads, "num_workers": workers, "throughput": round(throughput, 3)})
+    best = dict(max(results, key=lambda r: r["throughput"]))
+    best["results"] = results
+    print("CPU TUNING: best cpu_threads="+str(best["cpu_threads"])+" num_workers="+str(best["num_workers"]), flush=True)
+
+    if cachePath:
+        try:
+            os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+            cache[cacheKey] = best
+            with open(cachePath, "w") as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            print("Warning: can't save CPU tuning")
+            print(e)
+    return best
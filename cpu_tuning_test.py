@@ -0,0 +1,43 @@
+import os
+import tempfile
+import time
+import unittest
+
+from cpu_tuning import autotune, candidateConfigs
+
+class FakeModel:
+    """Pretends more threads per pass help up to 4, then stop scaling."""
+
+    def __init__(self, threads, workers):
+        self.delay = 0.02 / min(threads, 4)
+
+    def transcribe(self, clip, **options):
+        time.sleep(self.delay)
+        return iter(()), None
+
+class TestCpuTuning(unittest.TestCase):
+    def test_candidate_configs_fill_the_cores(self):
+        self.assertEqual(candidateConfigs(8), [(8, 1), (4, 2), (2, 4), (1, 8)])
+        self.assertEqual(candidateConfigs(1), [(1, 1)])
+
+    def test_autotune_picks_best_and_caches(self):
+        cachePath = os.path.join(tempfile.mkdtemp(), "tuning.json")
+        best = autotune("whisper-medium-ct2/", clip="markers/WOK-MRK-en.wav", cores=8, repeat=1,
+                        cachePath=cachePath, loader=FakeModel, concurrency=8)
+        self.assertEqual(len(best["results"]), 4)
+        self.assertGreaterEqual(best["num_workers"], 2)
+
+        def failingLoader(threads, workers):
+            raise AssertionError("cached result should be reused")
+        cached = autotune("whisper-medium-ct2/", clip="markers/WOK-MRK-en.wav", cores=8,
+                          cachePath=cachePath, loader=failingLoader, concurrency=8)
+        self.assertEqual(cached, best)
+
+    def test_autotune_one_request_at_a_time(self):
+        #One pass at a time: threads per pass matter, extra workers would sit idle
+        best = autotune("whisper-medium-ct2/", clip="markers/WOK-MRK-en.wav", cores=8, repeat=1,
+                        cachePath=None, loader=FakeModel)
+        self.assertGreaterEqual(best["cpu_threads"], 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import wave
 import torch
 import torchaudio
 import demucs
@@ -5,18 +6,27 @@ from demucs.pretrained import get_model_from_args
 from demucs.apply import apply_model
 from demucs.separate import load_track
 from torch._C import device
+from separation_engine import SeparationEngine
+from memory_budget import SEPARATION_OVERLAP_SECONDS
 
 def load_demucs_model():
     return get_model_from_args(type('args', (object,), dict(name='htdemucs', repo=None))).cpu().eval()
 
+def load_demucs_engine(**kw):
+    return SeparationEngine(load_demucs_model(), **kw)
+
 
 def demucs_audio(pathIn: str,
                  model=None,
                  device=None,
                  pathVocals: str = None,
-                 pathOther: str = None):
+                 pathOther: str = None,
+                 chunkSeconds: float = None):
     if model is None:
-        model = load_demucs_model()
+        model = load_demucs_engine()
+    engine = model if isinstance(model, SeparationEngine) else None
+    if engine is not None:
+        model = engine.model
 
     audio = load_track(pathIn, model.audio_channels, model.samplerate)
 
@@ -32,14 +42,65 @@ def demucs_audio(pathIn: str,
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
     print("Demucs using device: "+device)
-    result = apply_model(model, audio, device=device, split=True, overlap=.25)
-    if device != 'cpu':
-        torch.cuda.empty_cache()
+    if chunkSeconds:
+        #Degraded mode: sources of one chunk at a time, appended to 16-bit WAVs
+        separate_chunks(audio, model, engine, device, chunkSeconds, pathIn)
+        return
+    result = separate_tensor(audio, model, engine, device)
     
     for name in model.sources:
         print("Source: "+name)
         source_idx=model.sources.index(name)
         source=result[0, source_idx].mean(0)
         torchaudio.save(pathIn+"."+name+".wav", source[None], model.samplerate)
-        
 
+def separate_tensor(audio, model, engine, device):
+    if engine is not None and device == "cpu":
+        #Thread budget, inference mode and exported graph of the engine
+        result = engine.separate([audio[0]])[0][None]
+    else:
+        result = apply_model(model, audio, device=device, split=True, overlap=.25)
+    if device != 'cpu':
+        torch.cuda.empty_cache()
+    return result
+
+def separate_chunks(audio, model, engine, device, chunkSeconds, pathIn, overlapSeconds=SEPARATION_OVERLAP_SECONDS):
+    """Separate `audio` chunkSeconds at a time so only one chunk of sources is held in memory.
+
+    Each chunk runs overlapSeconds into the next one; the shared part is
+    cross-faded linearly, like the segments in demucs_batching.unpack.
+    """
+    length = audio.shape[-1]
+    step = int(chunkSeconds * model.samplerate)
+    fade = min(int(overlapSeconds * model.samplerate), step // 2)
+    writers = {}
+    try:
+        for name in model.sources:
+            writers[name] = wave.open(pathIn+"."+name+".wav", "wb")
+            writers[name].setnchannels(1)
+            writers[name].setsampwidth(2)
+            writers[name].setframerate(model.samplerate)
+        #Mono sources of the previous chunk's overlap, waiting for the next chunk
+        tail = None
+        start = 0
+        while True:
+            end = min(start + step + fade, length)
+            print("Chunk: "+str(start // step + 1)+"/"+str(max(1, -(-(length - fade) // step))))
+            result = separate_tensor(audio[..., start:end], model, engine, device)
+            sources = result[0].mean(1)
+            del result
+            if tail is not None:
+                n = tail.shape[-1]
+                ramp = torch.linspace(0, 1, n, device=sources.device)
+                sources = torch.cat([tail * (1 - ramp) + sources[:, :n] * ramp, sources[:, n:]], dim=-1)
+            last = end >= length
+            keep = sources.shape[-1] if last else sources.shape[-1] - fade
+            for idx, writer in enumerate(writers.values()):
+                writer.writeframes((sources[idx, :keep].clamp(-1, 1) * 32767).to(torch.int16).cpu().numpy().tobytes())
+            if last:
+                break
+            tail = sources[:, keep:]
+            start += step
+    finally:
+        for writer in writers.values():
+            writer.close()
@@ -0,0 +1,67 @@
+import math
+import os
+
+import torch
+
+#htdemucs training length in seconds, used when the model does not expose one
+DEFAULT_SEGMENT = 7.8
+OVERLAP = 0.25
+#Segments per forward pass, bounds memory however many requests are packed
+MAX_SEGMENTS = int(os.environ.get("DEMUCS_MAX_SEGMENTS", "16"))
+
+def segmentLength(model):
+    """Samples per segment the model accepts in one forward pass."""
+    seconds = min(float(getattr(model, "max_allowed_segment", math.inf)), float(getattr(model, "segment", math.inf)))
+    if math.isinf(seconds):
+        seconds = DEFAULT_SEGMENT
+    return int(seconds * model.samplerate)
+
+def segmentOffsets(length, segment, stride):
+    """Start of each segment covering `length` samples; the last one may run past the end."""
+    count = 1 if length <= segment else math.ceil((length - segment) / stride) + 1
+    return [i * stride for i in range(count)]
+
+def segmentWeight(segment):
+    """Triangular cross-fade weight, as apply_model uses between overlapping segments."""
+    weight = torch.cat([torch.arange(1, segment // 2 + 1), torch.arange(segment - segment // 2, 0, -1)]).float()
+    return weight / weight.max()
+
+def pack(wavs, segment, overlap=OVERLAP):
+    """Cut (channels, samples) tensors into one (segments, channels, segment) batch.
+
+    Returns the batch and, per segment, the (request index, offset) it came from.
+    """
+    stride = max(int((1 - overlap) * segment), 1)
+    pieces = []
+    index = []
+    for i, wav in enumerate(wavs):
+        length = wav.shape[-1]
+        for offset in segmentOffsets(length, segment, stride):
+            piece = wav[:, offset:offset + segment]
+            if piece.shape[-1] < segment:
+                piece = torch.nn.functional.pad(piece, (0, segment - piece.shape[-1]))
+            pieces.append(piece)
+            index.append((i, offset))
+    return torch.stack(pieces), index
+
+def unpack(separated, index, lengths, segment):
+    """Overlap-add (segments, sources, channels, segment) back to one (sources, channels, length) per request."""
+    weight = segmentWeight(segment).to(separated.device)
+    outputs = [separated.new_zeros(separated.shape[1:3] + (length,)) for length in lengths]
+    totals = [separated.new_zeros(length) for length in lengths]
+    for piece, (i, offset) in zip(separated, index):
+        valid = min(segment, lengths[i] - offset)
+        outputs[i][..., offset:offset + valid] += piece[..., :valid] * weight[:valid]
+        totals[i][offset:offset + valid] += weight[:valid]
+    return [out / total for out, total in zip(outputs, totals)]
+
+def separateBatch(model, wavs, forward, overlap=OVERLAP, maxSegments=MAX_SEGMENTS):
+    """Separate several (channels, samples) tensors at the model rate with shared forward passes.
+
+    `forward(batch)` maps (n, channels, segment) to (n, sources, channels, segment).
+    Returns one (sources, channels, samples) tensor per input, same length as the input.
+    """
+    segment = segmentLength(model)
+    batch, index = pack(wavs, segment, overlap)
+    separated = torch.cat([forward(batch[start:start + maxSegments]) for start in range(0, len(batch), maxSegments)])
+    return unpack(separated, index, [wav.shape[-1] for wav in wavs], segment)
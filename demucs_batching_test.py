@@ -0,0 +1,44 @@
+import unittest
+
+import torch
+
+from demucs_batching import pack, segmentLength, segmentOffsets, separateBatch
+
+class FakeModel:
+    """Four "sources", each the mix scaled by its index + 1, on 1 s segments at 100 Hz."""
+    samplerate = 100
+    segment = 1
+    sources = ["drums", "bass", "other", "vocals"]
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, batch):
+        self.calls.append(batch.shape[0])
+        return torch.stack([batch * (i + 1) for i in range(len(self.sources))], dim=1)
+
+class TestDemucsBatching(unittest.TestCase):
+    def test_offsets_cover_the_input(self):
+        self.assertEqual(segmentOffsets(50, 100, 75), [0])
+        self.assertEqual(segmentOffsets(100, 100, 75), [0])
+        self.assertEqual(segmentOffsets(250, 100, 75), [0, 75, 150])
+        self.assertEqual(segmentLength(FakeModel()), 100)
+
+    def test_pack_pads_the_last_segment(self):
+        batch, index = pack([torch.ones(2, 130), torch.ones(2, 40)], 100)
+        self.assertEqual(tuple(batch.shape), (3, 2, 100))
+        self.assertEqual(index, [(0, 0), (0, 75), (1, 0)])
+        self.assertEqual(batch[1, :, 55:].abs().sum().item(), 0)
+
+    def test_separate_batch_restores_each_request(self):
+        model = FakeModel()
+        wavs = [torch.randn(2, length) for length in (40, 100, 333, 1000)]
+        results = separateBatch(model, wavs, model, maxSegments=8)
+        #1 + 1 + 5 + 13 segments in three forward passes of at most 8
+        self.assertEqual(model.calls, [8, 8, 4])
+        for wav, sources in zip(wavs, results):
+            self.assertEqual(tuple(sources.shape), (4, 2, wav.shape[-1]))
+            self.assertTrue(torch.allclose(sources[model.sources.index("vocals")], wav * 4, atol=1e-5))
+
+if __name__ == '__main__':
+    unittest.main()
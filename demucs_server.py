@@ -2,18 +2,40 @@ import litserve as ls
 import os
 import torchaudio
 from demucs import pretrained
-from demucs.apply import apply_model
 import tempfile
 from fastapi import Response, HTTPException
+from fastapi.responses import JSONResponse
 from pydub import AudioSegment
 import torch
+from audio_format import sniffBytes
+from separation_engine import SeparationEngine
+from metrics import collect
+from warmup import Readiness, readiness, synthClip
+
+# Requests packed into one batch, and how long the first one waits for others (seconds)
+MAX_BATCH_SIZE = int(os.environ.get("DEMUCS_MAX_BATCH_SIZE", "4"))
+BATCH_TIMEOUT = float(os.environ.get("DEMUCS_BATCH_TIMEOUT", "0.05"))
 
 # Define your LitServe API
 class DemucsAPI(ls.LitAPI):
     def setup(self, device):
+        # Not ready until the model is loaded and warmed up
+        self.readiness = Readiness("demucs")
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
-        self.model = pretrained.get_model(name="htdemucs").to(self.device)
+        self.model = pretrained.get_model(name="htdemucs").to(self.device).eval()
+        # Engine, thread budget and self-check from WHISPERHALLU_DEMUCS_* settings
+        self.engine = SeparationEngine(self.model, device=self.device)
+        self.warm_up()
+
+    def warm_up(self):
+        # A short stereo clip at the model rate through ffmpeg and one separation (CUDA kernels, engine)
+        clip = synthClip(rate=self.model.samplerate, channels=2)
+        try:
+            self.readiness.run([("decode", lambda: AudioSegment.from_file(clip)),
+                                ("separate", lambda: os.remove(self.predict(clip)))])
+        finally:
+            os.remove(clip)
 
     def decode_request(self, request):
         # Get the uploaded audio file from the request (FormData)
@@ -21,11 +43,18 @@ class DemucsAPI(ls.LitAPI):
         if audio_file is None:
             raise HTTPException(status_code=400, detail="No audio file found in the request.")
 
-        # Create a temporary file with a .mp3 extension
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        
         # Read the file content
         audio_data = audio_file.read()
+
+        # WAV/FLAC (e.g. pre-encoded by client.py --preencode) is loaded directly by torchaudio
+        container, rate, channels = sniffBytes(audio_data)
+        if container in ("wav", "flac"):
+            with tempfile.NamedTemporaryFile(delete=False, suffix="."+container) as f:
+                f.write(audio_data)
+            return f.name
+
+        # Create a temporary file with a .mp3 extension
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
         
         # Write the audio data to the temporary file
         with open(temp_file.name, "wb") as f:
@@ -44,31 +73,44 @@ class DemucsAPI(ls.LitAPI):
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error processing audio file: {str(e)}")
 
-    def predict(self, file_path):
+    def load(self, file_path):
         # Load audio with torchaudio
-        try:
-            wav, sr = torchaudio.load(file_path)
-            wav = wav.to(self.device)
+        wav, sr = torchaudio.load(file_path)
+        # Pre-encoded uploads are already at the model rate
+        if sr != self.model.samplerate:
+            wav = torchaudio.functional.resample(wav, sr, self.model.samplerate)
 
-            # Check if the audio is mono (1 channel) and convert to stereo if necessary
-            if wav.shape[0] == 1:
-                wav = torch.cat([wav, wav], dim=0)
+        # Check if the audio is mono (1 channel) and convert to stereo if necessary
+        if wav.shape[0] == 1:
+            wav = torch.cat([wav, wav], dim=0)
+        return wav.to(self.device)
 
-            # Ensure the shape is (batch, channels, samples)
-            if wav.dim() == 2:
-                wav = wav.unsqueeze(0)
+    def batch(self, inputs):
+        return list(inputs)
 
-            sources = apply_model(self.model, wav, device=self.device)
-            
-            # Extract only the vocals (index 3 in the sources tensor)
-            vocals = sources[:, 3]
-            
-            output_path = f'{file_path}_vocals.wav'
-            torchaudio.save(output_path, vocals[0].cpu(), sr)  # Save only the vocals
-            return output_path
+    def predict(self, file_paths):
+        # Without batching LitServe passes a single path
+        single = not isinstance(file_paths, list)
+        if single:
+            file_paths = [file_paths]
+        try:
+            wavs = [self.load(file_path) for file_path in file_paths]
+            sources = self.engine.separate(wavs)
+
+            # Keep only the vocals, trimmed to each request's length
+            vocals_idx = self.model.sources.index("vocals")
+            output_paths = []
+            for file_path, separated in zip(file_paths, sources):
+                output_path = f'{file_path}_vocals.wav'
+                torchaudio.save(output_path, separated[vocals_idx].cpu(), self.model.samplerate)
+                output_paths.append(output_path)
+            return output_paths[0] if single else output_paths
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
 
+    def unbatch(self, output):
+        return list(output)
+
     def encode_response(self, output_path):
         try:
             # Read the content of the file
@@ -83,5 +125,11 @@ class DemucsAPI(ls.LitAPI):
 
 # Run the LitServe server
 if __name__ == "__main__":
-    server = ls.LitServer(DemucsAPI(), accelerator="cuda")
+    server = ls.LitServer(DemucsAPI(), accelerator="cuda", max_batch_size=MAX_BATCH_SIZE, batch_timeout=BATCH_TIMEOUT)
+
+    # For load balancers: 503 until the worker has warmed up
+    def ready():
+        is_ready, report = readiness(collect()["sections"], "demucs")
+        return JSONResponse(report, status_code=200 if is_ready else 503)
+    server.app.add_api_route("/ready", ready, methods=["GET"])
     server.run(port=8888)
\ No newline at end of file
@@ -0,0 +1,303 @@
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import unicodedata
+
+import tracing
+from hallu_bulk import AUDIO_EXTENSIONS
+from hallucination_index import indexFor
+from transcription_result import DEFAULT_OUTPUTS
+
+#Where runs are saved, one JSON file per run named after the commit
+RESULTS_DIR = os.environ.get("WHISPERHALLU_EVAL_DIR", "eval_results")
+#Manifest looked for in a corpus directory: one {"audio", "text", "lng", "lng_input", "is_music"} per line
+MANIFEST = "corpus.jsonl"
+
+#Pipeline variants compared by default, by knob:
+#profile (name or overrides of the default profile), remix_factor, speechnorm,
+#vad_threshold, silcut_threshold (ffmpeg dB), marks_max_duration (seconds)
+VARIANTS = {
+    "baseline": {},
+    "fast": {"profile": "fast"},
+    "no-markers": {"profile": {"markers": False}},
+    "vad-0.35": {"vad_threshold": 0.35},
+    "silcut-40dB": {"silcut_threshold": "-40dB"},
+    "vocals-only": {"remix_factor": "0"},
+    "no-speechnorm": {"speechnorm": False},
+}
+#Variant knob -> transcribeOpts parameter
+KNOBS = {
+    "profile": "profile",
+    "remix_factor": "remixFactor",
+    "speechnorm": "speechnorm",
+    "vad_threshold": "vadThreshold",
+    "silcut_threshold": "silcutThreshold",
+    "marks_max_duration": "marksMaxDuration",
+}
+
+def normalize(text):
+    """Lower case words without punctuation, as compared for WER."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"[^\w\s']|_", " ", text).split()
+
+def editDistance(ref, hyp):
+    """Levenshtein distance between two sequences."""
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1]
+
+def errorRates(reference, hypothesis):
+    """Word and character errors of `hypothesis`; characters ignore spaces so CER also suits unspaced scripts."""
+    refWords = normalize(reference)
+    hypWords = normalize(hypothesis)
+    refChars = "".join(refWords)
+    hypChars = "".join(hypWords)
+    wordErrors = editDistance(refWords, hypWords)
+    charErrors = editDistance(refChars, hypChars)
+    return {
+        "words": len(refWords), "word_errors": wordErrors, "wer": wordErrors / max(len(refWords), 1),
+        "chars": len(refChars), "char_errors": charErrors, "cer": charErrors / max(len(refChars), 1),
+    }
+
+def loadCorpus(source, lng="en", lngInput=None):
+    """Labelled items of a corpus.jsonl manifest, or of a directory of audio files with sibling .txt references.
+
+    Paths in a manifest are relative to it; missing "lng" and "lng_input" fall
+    back to `lng` and `lngInput`, a missing "is_music" is left to the classifier.
+    """
+    if os.path.isdir(source) and os.path.exists(os.path.join(source, MANIFEST)):
+        source = os.path.join(source, MANIFEST)
+    items = []
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "**", "*"), recursive=True)):
+            reference = os.path.splitext(path)[0]+".txt"
+            if not path.lower().endswith(AUDIO_EXTENSIONS) or not os.path.exists(reference):
+                continue
+            with open(reference, encoding="utf-8") as f:
+                text = f.read().strip()
+            items.append({"audio": path, "text": text})
+    else:
+        with open(source, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    item["audio"] = os.path.join(os.path.dirname(source), item["audio"])
+                    items.append(item)
+    for item in items:
+        item.setdefault("id", os.path.basename(item["audio"]))
+        item.setdefault("lng", lng)
+        item.setdefault("lng_input", lngInput or item["lng"])
+        item.setdefault("is_music", None)
+    return items
+
+def loadVariants(path=None, names=None):
+    """Built-in variants, plus or replaced by those of a JSON file, restricted to `names`."""
+    variants = dict(VARIANTS)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            variants.update(json.load(f))
+    for name, settings in variants.items():
+        unknown = set(settings) - set(KNOBS)
+        if unknown:
+            raise ValueError("Unknown knob(s) in variant "+name+": "+", ".join(sorted(unknown)))
+    if names:
+        missing = [name for name in names if name not in variants]
+        if missing:
+            raise ValueError("Unknown variant(s): "+", ".join(missing)+" (available: "+", ".join(sorted(variants))+")")
+        variants = {name: variants[name] for name in names}
+    return variants
+
+def stageSeconds(trace):
+    """Seconds per pipeline stage from the spans of one item: graph stages, markers and Whisper inference."""
+    seconds = {}
+    for event in trace.events:
+        name = event["name"]
+        if name.startswith("stage "):
+            key = name[len("stage "):]
+        elif name == "inference":
+            key = "whisper"
+        elif event["args"].get("output") in ("MRK", "CPS"):
+            key = "markers"
+        else:
+            continue
+        seconds[key] = seconds.get(key, 0.0) + event["dur"] / 1e6
+    return seconds
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def summarize(items):
+    """Corpus level scores of one variant: errors over all reference words/characters, latency percentiles, mean stage seconds."""
+    words = sum(item["words"] for item in items)
+    chars = sum(item["chars"] for item in items)
+    latencies = [item["seconds"] for item in items]
+    stages = {}
+    for item in items:
+        for name, seconds in item["stages"].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+    return {
+        "items": len(items),
+        "wer": sum(item["word_errors"] for item in items) / max(words, 1),
+        "cer": sum(item["char_errors"] for item in items) / max(chars, 1),
+        "hallucinations": sum(item["hallucinations"] for item in items),
+        "failed": sum(1 for item in items if item.get("error")),
+        "mean_seconds": sum(latencies) / max(len(latencies), 1),
+        "p90_seconds": percentile(latencies, 0.9),
+        "stages": {name: seconds / max(len(items), 1) for name, seconds in stages.items()},
+    }
+
+def transcribeItem(item, settings, modelKey=None):
+    """Transcribe one corpus item with a variant's settings: (text, seconds, stage seconds).
+
+    Runs in a scratch directory since the pipeline writes its intermediate
+    files next to its input. The server's default (timed) outputs are requested:
+    a text-only request skips the norm and remix stages the remix_factor and
+    speechnorm knobs act on.
+    """
+    import transcribeHallu
+    workDir = tempfile.mkdtemp(prefix="whisperhallu-eval-")
+    try:
+        path = shutil.copy(item["audio"], workDir)
+        prompt = "" if item["is_music"] else transcribeHallu.getPrompt(item["lng"])
+        opts = dict(language=item["lng"], initial_prompt=prompt)
+        params = {KNOBS[knob]: value for knob, value in settings.items()}
+        #Spans are kept in memory only, for the per stage latency
+        with tracing.traced(force=True, write=False) as trace:
+            startTime = time.time()
+            result = transcribeHallu.transcribeOpts(path, opts, item["lng_input"], isMusic=item["is_music"],
+                                                    outputs=DEFAULT_OUTPUTS, modelKey=modelKey, **params)
+            elapsed = time.time() - startTime
+        return result.text, elapsed, stageSeconds(trace)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+def evaluate(corpus, variants, modelKey=None):
+    """Every item through every variant: {"items": [...], "summary": {variant: scores}}."""
+    results = []
+    for name, settings in variants.items():
+        print("=====VARIANT "+name+" "+json.dumps(settings), flush=True)
+        for item in corpus:
+            row = {"variant": name, "id": item["id"]}
+            try:
+                text, seconds, stages = transcribeItem(item, settings, modelKey)
+            except Exception as e:
+                print("Warning: "+item["id"]+" failed with variant "+name)
+                print(e)
+                text, seconds, stages = "", 0.0, {}
+                row["error"] = type(e).__name__+": "+str(e)[:200]
+            row.update(errorRates(item["text"], text))
+            row.update(text=text, seconds=seconds, stages=stages, hallucinations=indexFor(item["lng_input"]).count(text))
+            print("EVAL "+name+" "+item["id"]+" WER="+str(round(row["wer"], 3))+" CER="+str(round(row["cer"], 3))
+                  +" HALLU="+str(row["hallucinations"])+" T="+str(round(seconds, 3)), flush=True)
+            results.append(row)
+    summary = {name: summarize([row for row in results if row["variant"] == name]) for name in variants}
+    return {"items": results, "summary": summary}
+
+def gitRevision():
+    """(short commit, True if tracked files have uncommitted changes), ("unknown", False) outside git."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+def saveResults(run, resultsDir=RESULTS_DIR):
+    """Write a run to <resultsDir>/<commit>[-dirty]-<time>.json and return its path."""
+    os.makedirs(resultsDir, exist_ok=True)
+    path = os.path.join(resultsDir, run["commit"]+("-dirty" if run["dirty"] else "")+"-"+time.strftime("%Y%m%d-%H%M%S", time.localtime(run["time"]))+".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, ensure_ascii=False, indent=1)
+    return path
+
+def formatTable(rows):
+    """Side by side table of (label, summary) rows, with the mean seconds of each stage."""
+    stages = sorted({name for _label, summary in rows for name in summary["stages"]})
+    header = ["variant", "items", "WER", "CER", "hallu", "failed", "mean s", "p90 s"] + stages
+    lines = [header]
+    for label, summary in rows:
+        lines.append([label, str(summary["items"]), "%.3f" % summary["wer"], "%.3f" % summary["cer"],
+                      str(summary["hallucinations"]), str(summary["failed"]),
+                      "%.2f" % summary["mean_seconds"], "%.2f" % summary["p90_seconds"]]
+                     + ["%.2f" % summary["stages"][name] if name in summary["stages"] else "-" for name in stages])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in lines)
+
+def compareRuns(paths):
+    """Table of the variants of saved runs, labelled <commit>:<variant>."""
+    rows = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            run = json.load(f)
+        commit = run["commit"]+("-dirty" if run.get("dirty") else "")
+        rows += [(commit+":"+name, summary) for name, summary in run["summary"].items()]
+    return formatTable(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a labelled corpus through pipeline variants and compare WER/CER, hallucinations and stage latency")
+    parser.add_argument("--corpus", help="corpus.jsonl manifest, or directory of audio files with sibling .txt references")
+    parser.add_argument("--lng", default="en", help="Default output language of the items")
+    parser.add_argument("--lng_input", default=None, help="Default spoken language of the items (default: --lng)")
+    parser.add_argument("--variants", default=None, help="JSON file of extra variants: {\"name\": {\"knob\": value}}")
+    parser.add_argument("--variant", nargs="+", default=None, help="Variants to run (default: all)")
+    parser.add_argument("--model", default=None, help="Whisper model size or key (default: the server's)")
+    parser.add_argument("--model_dir", default=None, help="Directory holding whisper-<size>-ct2/")
+    parser.add_argument("--device", default=None, choices=["cuda", "cpu"])
+    parser.add_argument("--allow_network", action="store_true", help="Keep the Gladia candidate and a remote Demucs server")
+    parser.add_argument("--results_dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", nargs="+", default=None, help="Saved runs to show side by side instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compareRuns(args.compare))
+        raise SystemExit(0)
+    if not args.corpus:
+        parser.error("--corpus is required unless --compare is given")
+
+    #Read by transcribeHallu at import
+    if args.model_dir:
+        os.environ["WHISPERHALLU_MODEL_DIR"] = args.model_dir
+    if not args.allow_network:
+        os.environ["WHISPERHALLU_GLADIA"] = "0"
+        os.environ["WHISPERHALLU_GLADIA_HEDGE"] = "0"
+        os.environ["WHISPERHALLU_DEMUCS_URL"] = ""
+    corpus = loadCorpus(args.corpus, args.lng, args.lng_input)
+    variants = loadVariants(args.variants, args.variant)
+    print("CORPUS="+args.corpus+" ITEMS="+str(len(corpus))+" VARIANTS="+",".join(variants), flush=True)
+
+    import transcribeHallu
+    from audio_classifier import classify
+    for item in corpus:
+        if item["is_music"] is None:
+            item["is_music"] = classify(item["audio"])[0] == "music"
+    #"fstr-large" or "large" -> "fstr-large"; the default model is of the installed backend, others load on demand
+    modelKey = None
+    modelSize = None
+    if args.model:
+        from model_registry import parseModelKey
+        try:
+            backend, size = parseModelKey(args.model, transcribeHallu.whisperFound)
+        except ValueError as e:
+            parser.error(str(e))
+        modelKey = backend.lower()+"-"+size
+        if backend == transcribeHallu.whisperFound:
+            modelSize = size
+    transcribeHallu.loadModel("0", modelSize=modelSize, aDevice=args.device)
+
+    commit, dirty = gitRevision()
+    run = {"commit": commit, "dirty": dirty, "time": time.time(), "corpus": args.corpus, "model": modelKey or transcribeHallu.loadedModel(),
+           "variants": variants}
+    run.update(evaluate(corpus, variants, modelKey))
+    print("RESULTS="+saveResults(run, args.results_dir))
+    print(formatTable(list(run["summary"].items())))
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import eval_pipeline
+import tracing
+from eval_pipeline import compareRuns, errorRates, evaluate, loadCorpus, loadVariants, saveResults, stageSeconds
+
+class TestEvalPipeline(unittest.TestCase):
+    def test_error_rates(self):
+        rates = errorRates("Hello, world! How are you?", "hello word how are you")
+        self.assertEqual((rates["words"], rates["word_errors"]), (5, 1))
+        self.assertAlmostEqual(rates["wer"], 0.2)
+        #"world" -> "word": one deleted character out of 19
+        self.assertEqual((rates["chars"], rates["char_errors"]), (19, 1))
+        self.assertEqual(errorRates("", "")["wer"], 0)
+        self.assertEqual(errorRates("a b", "")["wer"], 1)
+
+    def test_load_corpus(self):
+        corpus = tempfile.mkdtemp()
+        for name, text in (("a.wav", "first"), ("b.mp3", "second"), ("c.wav", None)):
+            open(os.path.join(corpus, name), "wb").close()
+            if text:
+                with open(os.path.join(corpus, name[:-4]+".txt"), "w") as f:
+                    f.write(text+"\n")
+        items = loadCorpus(corpus, lng="fr")
+        self.assertEqual([(i["id"], i["text"], i["lng"], i["lng_input"], i["is_music"]) for i in items],
+                         [("a.wav", "first", "fr", "fr", None), ("b.mp3", "second", "fr", "fr", None)])
+        #A manifest takes precedence, with paths relative to it
+        with open(os.path.join(corpus, "corpus.jsonl"), "w") as f:
+            f.write(json.dumps({"audio": "c.wav", "text": "third", "lng_input": "vi", "is_music": True})+"\n\n")
+        items = loadCorpus(corpus, lng="en")
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]["audio"], os.path.join(corpus, "c.wav"))
+        self.assertEqual((items[0]["lng"], items[0]["lng_input"], items[0]["is_music"]), ("en", "vi", True))
+
+    def test_variants(self):
+        path = os.path.join(tempfile.mkdtemp(), "variants.json")
+        with open(path, "w") as f:
+            json.dump({"loud": {"silcut_threshold": "-30dB"}}, f)
+        self.assertEqual(loadVariants(path, ["baseline", "loud"]), {"baseline": {}, "loud": {"silcut_threshold": "-30dB"}})
+        with self.assertRaises(ValueError):
+            loadVariants(names=["missing"])
+        with open(path, "w") as f:
+            json.dump({"bad": {"beam": 3}}, f)
+        with self.assertRaises(ValueError):
+            loadVariants(path)
+
+    def test_stage_seconds(self):
+        with tracing.traced(force=True, write=False) as trace:
+            with tracing.span("stage decode"):
+                pass
+            with tracing.span("inference"):
+                pass
+            with tracing.span("inference"):
+                pass
+            with tracing.span("ffmpeg", output="MRK"):
+                pass
+            with tracing.span("transcribeOpts"):
+                pass
+        self.assertEqual(set(stageSeconds(trace)), {"decode", "whisper", "markers"})
+
+    def test_evaluate_save_and_compare(self):
+        corpus = [{"id": "a", "audio": "a.wav", "text": "one two", "lng": "en", "lng_input": "en", "is_music": False},
+                  {"id": "b", "audio": "b.wav", "text": "three four", "lng": "en", "lng_input": "en", "is_music": False}]
+        def transcribeItem(item, settings, modelKey=None):
+            if item["id"] == "b" and settings:
+                raise RuntimeError("no model")
+            return item["text"], 1.0, {"decode": 0.5}
+        with patch.object(eval_pipeline, "transcribeItem", transcribeItem):
+            results = evaluate(corpus, {"baseline": {}, "fast": {"profile": "fast"}})
+        baseline, fast = results["summary"]["baseline"], results["summary"]["fast"]
+        self.assertEqual((baseline["wer"], baseline["failed"], baseline["stages"]), (0, 0, {"decode": 0.5}))
+        #The failed item counts as all words missed
+        self.assertEqual((fast["wer"], fast["failed"]), (0.5, 1))
+        resultsDir = tempfile.mkdtemp()
+        run = dict(results, commit="abc1234", dirty=True, time=0)
+        path = saveResults(run, resultsDir)
+        self.assertTrue(os.path.basename(path).startswith("abc1234-dirty-"))
+        table = compareRuns([path]).splitlines()
+        self.assertEqual(table[0].split()[:3], ["variant", "items", "WER"])
+        self.assertEqual(table[2].split()[:3], ["abc1234-dirty:fast", "2", "0.500"])
+
+if __name__ == '__main__':
+    unittest.main()
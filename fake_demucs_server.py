@@ -0,0 +1,77 @@
+import email
+import email.policy
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+class FakeDemucsServer:
+    """Local stand-in for demucs_server's /predict: answers the uploaded WAV as the "vocals".
+
+    delay: seconds to wait before answering, to exercise client timeouts.
+    failFirst: first N requests answered 500.
+    """
+
+    def __init__(self, delay=0.0, failFirst=0, host="127.0.0.1", port=0):
+        self.delay = delay
+        self.failFirst = failFirst
+        self.uploads = []
+        self.lock = Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.url = "http://"+host+":"+str(self.httpd.server_address[1])+"/predict"
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status, body, contentType):
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", contentType)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    #Client gave up (timeout test)
+                    pass
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                message = email.message_from_bytes(b"Content-Type: "+self.headers["Content-Type"].encode()+b"\r\n\r\n"+raw, policy=email.policy.HTTP)
+                form = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                with server.lock:
+                    fail = server.failFirst > 0
+                    server.failFirst -= 1 if fail else 0
+                    server.uploads.append(form["content"].get_filename() if "content" in form else None)
+                time.sleep(server.delay)
+                if fail or self.path != "/predict" or "content" not in form:
+                    self.reply(500, b'{"detail": "Error processing audio"}', "application/json")
+                    return
+                self.reply(200, form["content"].get_content(), "audio/wav")
+
+        return Handler
+
+if __name__ == "__main__":
+    #python fake_demucs_server.py [port], then WHISPERHALLU_DEMUCS_URL=http://127.0.0.1:<port>/predict
+    server = FakeDemucsServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8889)
+    print("Fake Demucs listening on "+server.url)
+    server.httpd.serve_forever()
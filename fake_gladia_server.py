@@ -0,0 +1,131 @@
+import json
+import sys
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+#Canned transcript returned once a job is done
+RESULT = {
+    "transcription": {
+        "full_transcript": "Xin chào. Hôm nay trời đẹp.",
+        "utterances": [
+            {"start": 0.0, "end": 1.2, "text": "Xin chào.",
+             "words": [{"start": 0.0, "end": 0.5, "word": "Xin"}, {"start": 0.5, "end": 1.2, "word": "chào."}]},
+            {"start": 1.5, "end": 3.0, "text": "Hôm nay trời đẹp.",
+             "words": [{"start": 1.5, "end": 1.8, "word": "Hôm"}, {"start": 1.8, "end": 2.1, "word": "nay"},
+                       {"start": 2.1, "end": 2.5, "word": "trời"}, {"start": 2.5, "end": 3.0, "word": "đẹp."}]},
+        ],
+        "subtitles": [{"format": "srt", "subtitles": "1\n00:00:00,000 --> 00:00:01,200\nXin chào.\n\n2\n00:00:01,500 --> 00:00:03,000\nHôm nay trời đẹp.\n"}],
+    }
+}
+
+class FakeGladiaServer:
+    """Local stand-in for the Gladia v2 pre-recorded API (upload, queued/processing, done).
+
+    pendingPolls: result fetches answered "queued"/"processing" before "done".
+    failFirst: first N requests answered 503, to exercise client retries.
+    """
+
+    def __init__(self, apiKey="test-key", pendingPolls=2, failFirst=0, host="127.0.0.1", port=0):
+        self.apiKey = apiKey
+        self.pendingPolls = pendingPolls
+        self.failFirst = failFirst
+        self.jobs = {}
+        self.deleted = []
+        self.requests = []
+        self.lock = Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.url = "http://"+host+":"+str(self.httpd.server_address[1])+"/v2"
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def admit(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                with server.lock:
+                    server.requests.append((self.command, self.path))
+                    if server.failFirst > 0:
+                        server.failFirst -= 1
+                        self.reply(503, {"message": "unavailable"})
+                        return None
+                if self.headers.get("x-gladia-key") != server.apiKey:
+                    self.reply(401, {"message": "invalid key"})
+                    return None
+                return body
+
+            def do_POST(self):
+                body = self.admit()
+                if body is None:
+                    return
+                if self.path == "/v2/upload":
+                    self.reply(200, {"audio_url": server.url+"/files/"+uuid.uuid4().hex})
+                elif self.path == "/v2/pre-recorded":
+                    jobId = uuid.uuid4().hex
+                    with server.lock:
+                        server.jobs[jobId] = {"polls": 0, "request": json.loads(body)}
+                    self.reply(201, {"id": jobId, "result_url": server.url+"/pre-recorded/"+jobId})
+                else:
+                    self.reply(404, {"message": "not found"})
+
+            def do_GET(self):
+                if self.admit() is None:
+                    return
+                jobId = self.path.rsplit("/", 1)[-1]
+                with server.lock:
+                    job = server.jobs.get(jobId)
+                    if job is None or not self.path.startswith("/v2/pre-recorded/"):
+                        self.reply(404, {"message": "not found"})
+                        return
+                    job["polls"] += 1
+                    polls = job["polls"]
+                if polls <= server.pendingPolls:
+                    self.reply(200, {"id": jobId, "status": "queued" if polls == 1 else "processing"})
+                else:
+                    self.reply(200, {"id": jobId, "status": "done", "result": RESULT})
+
+            def do_DELETE(self):
+                if self.admit() is None:
+                    return
+                jobId = self.path.rsplit("/", 1)[-1]
+                with server.lock:
+                    job = server.jobs.pop(jobId, None)
+                    if job is not None:
+                        server.deleted.append(jobId)
+                self.reply(202 if job is not None else 404, {})
+
+        return Handler
+
+if __name__ == "__main__":
+    #python fake_gladia_server.py [port], then GLADIA_BASE_URL=http://127.0.0.1:<port>/v2 GLADIA_API_KEY=test-key
+    server = FakeGladiaServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8090)
+    print("Fake Gladia listening on "+server.url)
+    server.httpd.serve_forever()
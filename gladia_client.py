@@ -0,0 +1,209 @@
+import contextvars
+import os
+import random
+import time
+from threading import Event, Thread
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from json_util import convert_gladia_to_internal_format
+import tracing
+
+GLADIA_BASE_URL = os.environ.get("GLADIA_BASE_URL", "https://api.gladia.io/v2")
+#Required to use Gladia, no default: without it every call fails fast with an empty result
+GLADIA_API_KEY = os.environ.get("GLADIA_API_KEY", "")
+
+#Statuses worth retrying: rate limited or temporarily unavailable
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def emptyResult():
+    return {"text": "", "srt": "", "json": []}
+
+def backoffDelays(initial=1.0, maximum=10.0, factor=2.0, jitter=0.5, rng=random):
+    """Exponential backoff with +/- jitter (as a fraction of the delay), forever."""
+    delay = initial
+    while True:
+        yield delay * (1 + rng.uniform(-jitter, jitter))
+        delay = min(delay * factor, maximum)
+
+class GladiaError(Exception):
+    pass
+
+class GladiaClient:
+    """Gladia pre-recorded API over a pooled session, with timeouts and retries."""
+
+    def __init__(self, baseUrl=GLADIA_BASE_URL, apiKey=GLADIA_API_KEY, connectTimeout=5.0, readTimeout=60.0,
+                 retries=3, pollInitial=1.0, pollMax=10.0, pollTimeout=60.0, poolSize=8, session=None):
+        self.baseUrl = baseUrl.rstrip("/")
+        self.apiKey = apiKey
+        self.timeout = (connectTimeout, readTimeout)
+        self.retries = retries
+        self.pollInitial = pollInitial
+        self.pollMax = pollMax
+        self.pollTimeout = pollTimeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method, url, **kwargs):
+        """One HTTP call, retried with backoff on connection errors and retryable statuses.
+
+        A POST that timed out may have been received, so only GETs are retried on timeouts:
+        a second upload or job would be billed again.
+        """
+        if not self.apiKey:
+            raise GladiaError("GLADIA_API_KEY is not set")
+        headers = dict(kwargs.pop("headers", {}), **{"x-gladia-key": self.apiKey})
+        delays = backoffDelays(self.pollInitial, self.pollMax)
+        #ConnectTimeout is a ConnectionError: nothing was sent yet
+        retryable = requests.exceptions.ConnectionError
+        if method == "GET":
+            retryable = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        for attempt in range(self.retries + 1):
+            if "files" in kwargs:
+                for _name, (_filename, f, _mime) in kwargs["files"].items():
+                    f.seek(0)
+            with tracing.span("gladia "+method, url=url.replace(self.baseUrl, ""), attempt=attempt) as args:
+                try:
+                    response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+                    args.update(status=response.status_code, bytes=len(response.content))
+                    if response.status_code not in RETRY_STATUSES:
+                        return response
+                    error = f"{response.status_code} {response.text[:200]}"
+                except retryable as e:
+                    error = str(e)
+                    args["error"] = error
+            if attempt < self.retries:
+                delay = next(delays)
+                print(f"Gladia {method} {url} failed ({error}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        raise GladiaError(f"Gladia {method} {url} failed: {error}")
+
+    def _json(self, response, what):
+        if response.status_code not in (200, 201):
+            raise GladiaError(f"Error {what}: {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def upload(self, audio_path):
+        with open(audio_path, "rb") as audio_file:
+            print("audio_path: "+ audio_path)
+            files = {"audio": (os.path.basename(audio_path), audio_file, "audio/mpeg")}
+            return self._json(self._request("POST", self.baseUrl+"/upload", files=files), "uploading file")["audio_url"]
+
+    def payload(self, audio_url, source_lang, target_lang):
+        return {
+            "audio_url": audio_url,
+            "detect_language": True,
+            "language": source_lang,
+            "translation": True,
+            "translation_config": {
+                "target_languages": [target_lang],
+                "model": "base",
+                "match_original_utterances": True
+            },
+            "diarization": True,
+            "subtitles": True,
+            "subtitles_config": {
+                "formats": ["srt"],
+            },
+        }
+
+    def request(self, audio_url, source_lang, target_lang):
+        response = self._request("POST", self.baseUrl+"/pre-recorded", json=self.payload(audio_url, source_lang, target_lang))
+        return self._json(response, "requesting transcription")["result_url"]
+
+    def fetch(self, result_url):
+        return self._json(self._request("GET", result_url), "fetching result")
+
+    def delete(self, result_url):
+        """Best effort removal of a job we no longer need."""
+        try:
+            response = self.session.delete(result_url, headers={"x-gladia-key": self.apiKey}, timeout=self.timeout)
+            if response.status_code >= 300:
+                print(f"Warning: can't delete Gladia job: {response.status_code}")
+        except requests.exceptions.RequestException as e:
+            print(f"Warning: can't delete Gladia job: {e}")
+
+    def poll(self, result_url, cancel=None):
+        deadline = time.time() + self.pollTimeout
+        for delay in backoffDelays(self.pollInitial, self.pollMax):
+            if cancel is not None and cancel.is_set():
+                self.delete(result_url)
+                raise GladiaError("Gladia job cancelled")
+            gladia_result = self.fetch(result_url)
+            status = gladia_result.get("status")
+            if status == "done":
+                return gladia_result
+            if status == "error":
+                raise GladiaError("Gladia transcription failed: "+str(gladia_result.get("error_code")))
+            delay = min(delay, deadline - time.time())
+            if delay <= 0:
+                raise GladiaError("Gladia result not ready after "+str(self.pollTimeout)+"s")
+            print(f"Gladia result not ready. Status: {status}. Waiting {delay:.1f} seconds...")
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+
+    def transcribe(self, audio_path, source_lang, target_lang, cancel=None):
+        """Internal {"text", "srt", "json"} dict; empty on any failure.
+
+        Setting the `cancel` Event stops polling and deletes the remote job.
+        """
+        with tracing.span("gladia", input=tracing.pathVariant(audio_path), bytes=os.path.getsize(audio_path) if os.path.exists(audio_path) else 0) as args:
+            try:
+                audio_url = self.upload(audio_path)
+                if cancel is not None and cancel.is_set():
+                    raise GladiaError("Gladia job cancelled")
+                gladia_result = self.poll(self.request(audio_url, source_lang, target_lang), cancel)
+                return convert_gladia_to_internal_format(gladia_result)
+            except (GladiaError, requests.exceptions.RequestException, KeyError, ValueError) as e:
+                print(f"Error transcribing with Gladia API: {e}")
+                args["error"] = str(e)[:200]
+                return emptyResult()
+
+class GladiaHedge:
+    """Gladia transcription started speculatively in a background thread.
+
+    `accept(result)` decides whether the remote result is good enough on its
+    own; once it is, `accepted` is set so local passes can stop. `cancel()`
+    abandons the remote job when a local candidate wins.
+    """
+
+    def __init__(self, client, audio_path, source_lang, target_lang, accept=None):
+        self.accept = accept
+        self.cancelled = Event()
+        self.accepted = Event()
+        self.done = Event()
+        self.result = None
+        self.startTime = time.time()
+        self.finishTime = None
+        #Same request (and trace) as the local candidates
+        self.thread = Thread(target=contextvars.copy_context().run, args=(self._run, client, audio_path, source_lang, target_lang), daemon=True)
+        self.thread.start()
+
+    def _run(self, client, audio_path, source_lang, target_lang):
+        try:
+            self.result = client.transcribe(audio_path, source_lang, target_lang, cancel=self.cancelled)
+            if(not self.cancelled.is_set() and self.accept is not None and self.result["json"] and self.accept(self.result)):
+                self.accepted.set()
+        finally:
+            self.finishTime = time.time()
+            self.done.set()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait(self, timeout=None):
+        """Remote result (empty if it failed or timed out); the job is cancelled on timeout."""
+        if not self.done.wait(timeout):
+            self.cancel()
+            return emptyResult()
+        return self.result
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+import requests
+
+from fake_gladia_server import FakeGladiaServer
+from gladia_client import GladiaClient, GladiaError, GladiaHedge, emptyResult
+
+def fastClient(url, apiKey="test-key", **kwargs):
+    options = dict(retries=2, pollInitial=0.01, pollMax=0.05, pollTimeout=5)
+    options.update(kwargs)
+    return GladiaClient(baseUrl=url, apiKey=apiKey, **options)
+
+class TestGladiaClient(unittest.TestCase):
+    def setUp(self):
+        fd, self.audioPath = tempfile.mkstemp(suffix=".mp3")
+        os.write(fd, b"ID3fake")
+        os.close(fd)
+        self.addCleanup(os.remove, self.audioPath)
+
+    def test_transcribe_after_pending_polls(self):
+        with FakeGladiaServer(pendingPolls=3) as server:
+            client = fastClient(server.url)
+            result = client.transcribe(self.audioPath, "vi", "vi")
+            client.close()
+        self.assertEqual(result["text"], "Xin chào. Hôm nay trời đẹp.")
+        self.assertEqual(len(result["json"]), 2)
+        self.assertTrue(result["srt"].startswith("1\n"))
+        self.assertEqual(sum(1 for method, _ in server.requests if method == "GET"), 4)
+
+    def test_retries_unavailable_server(self):
+        with FakeGladiaServer(pendingPolls=0, failFirst=2) as server:
+            result = fastClient(server.url).transcribe(self.audioPath, "vi", "vi")
+        self.assertEqual(len(result["json"]), 2)
+
+    def test_gives_up_with_empty_result(self):
+        with FakeGladiaServer(failFirst=100) as server:
+            self.assertEqual(fastClient(server.url).transcribe(self.audioPath, "vi", "vi"), emptyResult())
+        with FakeGladiaServer() as server:
+            self.assertEqual(fastClient(server.url, apiKey="wrong").transcribe(self.audioPath, "vi", "vi"), emptyResult())
+        #No key: nothing is sent
+        with FakeGladiaServer() as server:
+            self.assertEqual(fastClient(server.url, apiKey="").transcribe(self.audioPath, "vi", "vi"), emptyResult())
+        self.assertEqual(server.requests, [])
+
+    def test_poll_timeout(self):
+        with FakeGladiaServer(pendingPolls=1000) as server:
+            result = fastClient(server.url, pollTimeout=0.2).transcribe(self.audioPath, "vi", "vi")
+        self.assertEqual(result, emptyResult())
+
+    def test_hedge_accepted(self):
+        with FakeGladiaServer(pendingPolls=1) as server:
+            hedge = GladiaHedge(fastClient(server.url), self.audioPath, "vi", "vi", accept=lambda r: "chào" in r["text"])
+            self.assertTrue(hedge.accepted.wait(5))
+            self.assertEqual(len(hedge.wait(5)["json"]), 2)
+
+    def test_hedge_cancelled(self):
+        with FakeGladiaServer(pendingPolls=1000) as server:
+            hedge = GladiaHedge(fastClient(server.url), self.audioPath, "vi", "vi", accept=lambda r: True)
+            while not server.jobs:
+                hedge.done.wait(0.01)
+            hedge.cancel()
+            self.assertEqual(hedge.wait(5), emptyResult())
+            self.assertFalse(hedge.accepted.is_set())
+            self.assertEqual(len(server.deleted), 1)
+
+    def test_post_not_retried_after_timeout(self):
+        session = Mock()
+        session.request.side_effect = requests.exceptions.ReadTimeout("read timed out")
+        client = fastClient("http://gladia.invalid", session=session)
+        #The job may have been created: no second one
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.request("http://gladia.invalid/audio", "vi", "vi")
+        self.assertEqual(session.request.call_count, 1)
+        #Polls are safe to repeat
+        with self.assertRaises(GladiaError):
+            client.fetch("http://gladia.invalid/result")
+        self.assertEqual(session.request.call_count, 4)
+
+if __name__ == '__main__':
+    unittest.main()
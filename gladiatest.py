@@ -1,18 +1,23 @@
 import requests
 import os
+from gladia_client import GLADIA_API_KEY, GLADIA_BASE_URL
 
-url = "https://api.gladia.io/v2/upload"
+url = GLADIA_BASE_URL+"/upload"
 
 # Specify the name of the audio file in the same folder
 audio_file_name = "test.mp3"  # Replace with your actual file name
 
+if not GLADIA_API_KEY:
+    print("Error: set GLADIA_API_KEY.")
+    exit()
+
 # Check if the file exists
 if not os.path.exists(audio_file_name):
     print(f"Error: File '{audio_file_name}' not found in the current directory.")
     exit()
 
 headers = {
-    "x-gladia-key": "aac97688-7e14-4274-8e03-cbf2a8212828",
+    "x-gladia-key": GLADIA_API_KEY,
 }
 
 # Open the file and send it in the request
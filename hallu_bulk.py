@@ -0,0 +1,192 @@
+import glob
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from audio_format import preencode
+
+#Audio extensions picked up when a directory is given
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".flac", ".ogg", ".opus", ".aac", ".mp4", ".webm")
+MANIFEST_NAME = ".hallu_manifest.jsonl"
+
+class MultipartStream:
+    """multipart/form-data body read from disk in chunks, with a known length so no chunked encoding is needed."""
+
+    def __init__(self, fields, fileField, path, filename=None):
+        self.boundary = uuid.uuid4().hex
+        head = b""
+        for name, value in fields.items():
+            head += ("--"+self.boundary+"\r\nContent-Disposition: form-data; name=\""+name+"\"\r\n\r\n"+str(value)+"\r\n").encode("utf-8")
+        head += ("--"+self.boundary+"\r\nContent-Disposition: form-data; name=\""+fileField+"\"; filename=\""
+                 +(filename or os.path.basename(path))+"\"\r\nContent-Type: application/octet-stream\r\n\r\n").encode("utf-8")
+        self.parts = [head, None, ("\r\n--"+self.boundary+"--\r\n").encode("utf-8")]
+        self.path = path
+        self.length = len(head) + os.path.getsize(path) + len(self.parts[2])
+        self.file = None
+        self.index = 0
+        self.offset = 0
+
+    @property
+    def contentType(self):
+        return "multipart/form-data; boundary="+self.boundary
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        out = b""
+        while len(out) < size and self.index < len(self.parts):
+            part = self.parts[self.index]
+            if part is None:
+                if self.file is None:
+                    self.file = open(self.path, "rb")
+                data = self.file.read(size - len(out))
+                if not data:
+                    self.file.close()
+                    self.index += 1
+                out += data
+                continue
+            data = part[self.offset:self.offset + size - len(out)]
+            self.offset += len(data)
+            out += data
+            if self.offset >= len(part):
+                self.index += 1
+                self.offset = 0
+        return out
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def findInputs(source):
+    """Audio files under a directory (recursively) or matching a glob, sorted."""
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name) for root, _dirs, names in os.walk(source)
+                 for name in names if name.lower().endswith(AUDIO_EXTENSIONS)]
+        base = source
+    else:
+        paths = [p for p in glob.glob(source, recursive=True) if os.path.isfile(p)]
+        base = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else "."
+    return sorted(paths), base
+
+def outputPrefix(path, base, outputDir):
+    """Output files mirror the input tree: <outputDir>/<relative path without extension>."""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(base))
+    return os.path.join(outputDir, os.path.splitext(relative)[0])
+
+class Manifest:
+    """Append-only record of completed inputs, keyed by path, size and mtime."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        #Line cut by an interrupted run
+                        continue
+                    self.done[entry["path"]] = entry
+
+    @staticmethod
+    def fingerprint(path):
+        st = os.stat(path)
+        return {"path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime}
+
+    def isDone(self, path):
+        fingerprint = self.fingerprint(path)
+        entry = self.done.get(fingerprint["path"])
+        return entry is not None and entry["size"] == fingerprint["size"] and entry["mtime"] == fingerprint["mtime"]
+
+    def record(self, path, **details):
+        entry = dict(self.fingerprint(path), **details)
+        with self.lock:
+            self.done[entry["path"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry)+"\n")
+
+def makeSession(concurrency):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def postWithRetries(session, url, fields, path, retries=3, backoff=2.0, timeout=(10, 600)):
+    """POST one file, retried with exponential backoff and jitter on connection errors, 429 and 5xx."""
+    for attempt in range(retries + 1):
+        body = MultipartStream(fields, "content", path)
+        delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        try:
+            response = session.post(url, data=body, headers={"Content-Type": body.contentType}, timeout=timeout)
+            if response.status_code == 429 and response.headers.get("Retry-After", "").isdigit():
+                delay = int(response.headers["Retry-After"])
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            error = str(response.status_code)+" "+response.text[:200]
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = str(e)
+        finally:
+            body.close()
+        if attempt < retries:
+            print(f"Retrying {path} in {delay:.1f}s ({error})")
+            time.sleep(delay)
+    raise IOError(f"{path}: {error}")
+
+def runBulk(source, url, fields, saveOutputs, outputDir, concurrency=4, retries=3, backoff=2.0, manifestPath=None, preencodeCodec=None):
+    """Transcribe every audio file of `source`, skipping those already in the manifest. Returns the summary."""
+    paths, base = findInputs(source)
+    os.makedirs(outputDir, exist_ok=True)
+    manifest = Manifest(manifestPath or os.path.join(outputDir, MANIFEST_NAME))
+    todo = [p for p in paths if not manifest.isDone(p)]
+    summary = {"found": len(paths), "skipped": len(paths) - len(todo), "done": 0, "failed": 0, "bytes": 0}
+    print(f"{len(paths)} file(s) found, {summary['skipped']} already done, {len(todo)} to send with concurrency {concurrency}")
+
+    session = makeSession(concurrency)
+    def one(path):
+        startTime = time.time()
+        upload = preencode(path, codec=preencodeCodec) if preencodeCodec else path
+        size = os.path.getsize(upload)
+        try:
+            response = postWithRetries(session, url, fields, upload, retries, backoff)
+        finally:
+            if upload != path:
+                os.unlink(upload)
+        if response.status_code != 200:
+            raise IOError(f"{path}: {response.status_code} {response.text[:200]}")
+        prefix = outputPrefix(path, base, outputDir)
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        saveOutputs(response.json(), prefix)
+        manifest.record(path, output=prefix, seconds=round(time.time() - startTime, 3))
+        return size
+
+    startTime = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(one, p): p for p in todo}
+        for future in as_completed(futures):
+            try:
+                summary["bytes"] += future.result()
+                summary["done"] += 1
+            except Exception as e:
+                summary["failed"] += 1
+                print(f"Error: {e}")
+    session.close()
+    elapsed = time.time() - startTime
+    summary["seconds"] = round(elapsed, 3)
+    summary["files_per_second"] = round(summary["done"] / elapsed, 3) if elapsed > 0 else 0
+    summary["mb_per_second"] = round(summary["bytes"] / 1e6 / elapsed, 3) if elapsed > 0 else 0
+    print(f"Bulk finished: {summary['done']} done, {summary['failed']} failed, {summary['skipped']} skipped in {elapsed:.1f}s "
+          f"({summary['files_per_second']} files/s, {summary['mb_per_second']} MB/s uploaded)")
+    return summary
@@ -0,0 +1,90 @@
+import email
+import email.policy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from hallu_bulk import Manifest, MultipartStream, findInputs, runBulk
+
+class PredictStandIn(BaseHTTPRequestHandler):
+    """Answers /predict with the uploaded file name; the first request gets a 503."""
+    lock = Lock()
+    calls = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        message = email.message_from_bytes(b"Content-Type: "+self.headers["Content-Type"].encode()+b"\r\n\r\n"+raw, policy=email.policy.HTTP)
+        form = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        filename = form["content"].get_filename()
+        with self.lock:
+            self.calls.append(filename)
+            first = len(self.calls) == 1
+        body = json.dumps({"text": filename+" "+form["lng"].get_content().strip(), "srt": ""}).encode("utf-8")
+        self.send_response(503 if first else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def saveJson(data, prefix):
+    with open(prefix+".json", "w") as f:
+        json.dump(data, f)
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.inputs = os.path.join(self.tmp, "in")
+        os.makedirs(os.path.join(self.inputs, "sub"))
+        for name in ("a.mp3", "b.wav", os.path.join("sub", "a.mp3"), "notes.txt"):
+            with open(os.path.join(self.inputs, name), "wb") as f:
+                f.write(os.urandom(200000))
+        PredictStandIn.calls = []
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), PredictStandIn)
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        self.url = "http://127.0.0.1:"+str(self.httpd.server_address[1])+"/predict"
+
+    def test_multipart_stream_length(self):
+        path = os.path.join(self.inputs, "a.mp3")
+        body = MultipartStream({"lng": "vi"}, "content", path)
+        data = b""
+        while True:
+            chunk = body.read(7000)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(len(data), len(body))
+        with open(path, "rb") as f:
+            self.assertIn(f.read(), data)
+
+    def test_find_inputs(self):
+        paths, base = findInputs(self.inputs)
+        self.assertEqual([os.path.relpath(p, base) for p in paths], ["a.mp3", "b.wav", os.path.join("sub", "a.mp3")])
+        paths, _ = findInputs(os.path.join(self.inputs, "*.mp3"))
+        self.assertEqual(len(paths), 1)
+
+    def test_bulk_retries_names_and_resumes(self):
+        out = os.path.join(self.tmp, "out")
+        summary = runBulk(self.inputs, self.url, {"lng": "vi"}, saveJson, out, concurrency=2, backoff=0.01)
+        self.assertEqual((summary["done"], summary["failed"]), (3, 0))
+        self.assertEqual(len(PredictStandIn.calls), 4)
+        with open(os.path.join(out, "sub", "a.json")) as f:
+            self.assertEqual(json.load(f)["text"], "a.mp3 vi")
+        self.assertTrue(os.path.exists(os.path.join(out, "b.json")))
+
+        summary = runBulk(self.inputs, self.url, {"lng": "vi"}, saveJson, out, concurrency=2)
+        self.assertEqual((summary["skipped"], summary["done"]), (3, 0))
+        with open(os.path.join(self.inputs, "b.wav"), "ab") as f:
+            f.write(b"changed")
+        self.assertFalse(Manifest(os.path.join(out, ".hallu_manifest.jsonl")).isDone(os.path.join(self.inputs, "b.wav")))
+
+if __name__ == '__main__':
+    unittest.main()
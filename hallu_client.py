@@ -2,64 +2,176 @@ import argparse
 import requests
 from datetime import datetime
 import json
+import os
+import time
+from hallu_bulk import runBulk
+from audio_format import preencode
 
 # Update this URL to your server's URL if hosted remotely
 API_URL = "http://localhost:8889/predict"
+JOBS_URL = "http://localhost:8889/jobs"
+BATCH_URL = "http://localhost:8889/batch"
 
-def send_request(input_source, lng, lng_input, is_url=False):
+def build_request(input_source, lng, lng_input, is_url=False, compression="gzip", outputs=None, model=None, preencode_codec=None, profile=None, trace=False):
     data = {
         "lng": lng,
         "lng_input": lng_input
     }
+    if outputs:
+        data["outputs"] = outputs
+    if model:
+        data["model"] = model
+    if profile:
+        data["profile"] = profile
+    if trace:
+        data["trace"] = "true"
+    if compression:
+        data["compression"] = compression
 
     if is_url:
         data["url"] = input_source
         files = None
     else:
-        with open(input_source, 'rb') as input_file:
+        upload_path = input_source
+        if preencode_codec:
+            # Send what the server consumes (16 kHz mono) instead of the original bytes
+            upload_path = preencode(input_source, codec=preencode_codec)
+        with open(upload_path, 'rb') as input_file:
             input_data = input_file.read()
-        files = {"content": ("audio.mp3", input_data)}
+        if preencode_codec:
+            os.unlink(upload_path)
+        files = {"content": (os.path.basename(upload_path) if preencode_codec else "audio.mp3", input_data)}
+    return data, files
 
-    response = requests.post(API_URL, files=files, data=data)
+def save_outputs(transcription_data, prefix):
+    # Save the full JSON response
+    json_filename = f"{prefix}.json"
+    with open(json_filename, "w", encoding="utf-8") as json_file:
+        json.dump(transcription_data, json_file, ensure_ascii=False, indent=2)
+    print(f"Full transcription data saved to {json_filename}")
     
+    # Save the subtitle and plain text outputs that were requested
+    for key, extension, label in (("srt", "srt", "SRT content"), ("vtt", "vtt", "WebVTT content"), ("text", "txt", "Plain text transcription")):
+        if key not in transcription_data:
+            continue
+        out_filename = f"{prefix}.{extension}"
+        with open(out_filename, "w", encoding="utf-8") as out_file:
+            out_file.write(transcription_data[key])
+        print(f"{label} saved to {out_filename}")
+
+def save_transcription(response):
     if response.status_code == 200:
         # Generate a unique filename for the output
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # Parse the JSON response
-        transcription_data = json.loads(response.text)
-        
-        # Save the full JSON response
-        json_filename = f"transcription_{timestamp}.json"
-        with open(json_filename, "w", encoding="utf-8") as json_file:
-            json.dump(transcription_data, json_file, ensure_ascii=False, indent=2)
-        print(f"Full transcription data saved to {json_filename}")
-        
-        # Save the SRT content
-        srt_filename = f"transcription_{timestamp}.srt"
-        with open(srt_filename, "w", encoding="utf-8") as srt_file:
-            srt_file.write(transcription_data["srt"])
-        print(f"SRT content saved to {srt_filename}")
-        
-        # Save the plain text transcription
-        text_filename = f"transcription_{timestamp}.txt"
-        with open(text_filename, "w", encoding="utf-8") as text_file:
-            text_file.write(transcription_data["text"])
-        print(f"Plain text transcription saved to {text_filename}")
-        
+        save_outputs(json.loads(response.text), f"transcription_{timestamp}")
     else:
         print(f"Error: Response with status code {response.status_code} - {response.text}")
 
+def send_request(input_source, lng, lng_input, is_url=False, compression="gzip", outputs=None, model=None, preencode_codec=None, profile=None, trace=False):
+    data, files = build_request(input_source, lng, lng_input, is_url, compression, outputs, model, preencode_codec, profile, trace)
+    response = requests.post(API_URL, files=files, data=data)
+    if trace:
+        # The trace file on the server is named after it
+        print(f"Request id: {response.headers.get('X-Request-Id')}")
+    save_transcription(response)
+
+def submit_job(input_source, lng, lng_input, is_url=False, compression="gzip", outputs=None, model=None, callback_url=None, poll_interval=5, preencode_codec=None, profile=None):
+    """Submit to the job API and poll until the transcription is ready, for files longer than the /predict timeout."""
+    data, files = build_request(input_source, lng, lng_input, is_url, compression, outputs, model, preencode_codec, profile)
+    if callback_url:
+        data["callback_url"] = callback_url
+    response = requests.post(JOBS_URL, files=files, data=data)
+    if response.status_code != 202:
+        print(f"Error: Response with status code {response.status_code} - {response.text}")
+        return
+    job_id = response.json()["id"]
+    print(f"Job {job_id} submitted")
+    if callback_url:
+        print(f"Completion will be posted to {callback_url}")
+        return job_id
+
+    while True:
+        time.sleep(poll_interval)
+        status = requests.get(f"{JOBS_URL}/{job_id}")
+        if status.status_code != 200:
+            print(f"Error: Response with status code {status.status_code} - {status.text}")
+            return job_id
+        job = status.json()
+        if job["status"] in ("done", "failed"):
+            break
+        print(f"Job {job_id} {job['status']}" + (f", {job['position']} ahead" if job.get("position") else ""))
+    save_transcription(requests.get(f"{JOBS_URL}/{job_id}/result"))
+    return job_id
+
+def send_batch(sources, lng, lng_input, compression="gzip", outputs=None, model=None, batch_size=50, preencode_codec=None, profile=None):
+    """Send many files and URLs through /batch, saving each result as it is streamed back."""
+    done = failed = 0
+    for start in range(0, len(sources), batch_size):
+        chunk = sources[start:start + batch_size]
+        data, _ = build_request(None, lng, lng_input, True, compression, outputs, model, profile=profile)
+        data["url"] = [s for s in chunk if s.startswith(("http://", "https://"))]
+        paths = [s for s in chunk if not s.startswith(("http://", "https://"))]
+        encoded = [preencode(p, codec=preencode_codec) for p in paths] if preencode_codec else []
+        # Keep the original name, it is echoed back with each result
+        files = [("content", (os.path.basename(p), open(e, "rb"))) for p, e in zip(paths, encoded or paths)]
+        try:
+            response = requests.post(BATCH_URL, files=files, data=data, stream=True)
+            if response.status_code != 200:
+                print(f"Error: Response with status code {response.status_code} - {response.text}")
+                failed += len(chunk)
+                continue
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item["status"] == "done":
+                    done += 1
+                    name = os.path.splitext(os.path.basename(item["name"].split("?")[0]))[0] or item["id"]
+                    save_outputs(item["result"], f"transcription_{start + item['index']:04d}_{name}")
+                else:
+                    failed += 1
+                    print(f"Error: {item['name']}: {item.get('error')}")
+        finally:
+            for _, (_, f) in files:
+                f.close()
+            for e in encoded:
+                os.unlink(e)
+    print(f"Batch finished: {done} done, {failed} failed")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sends an audio file or URL to the Whisper Hallu server and saves the transcription")
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--path", help="Path of the audio file to transcribe")
     group.add_argument("--url", help="URL of the audio file to transcribe")
-    parser.add_argument("--lng", default="en", help="Language for transcription output (default: en)")
-    parser.add_argument("--lng_input", default="en", help="Language of the input audio (default: en)")
+    group.add_argument("--batch", nargs="+", help="Several audio files and/or URLs sent together through /batch")
+    group.add_argument("--bulk", help="Directory or glob of audio files, sent concurrently with resume support")
+    parser.add_argument("--lng", default="en", help="Language for transcription output, or auto for the spoken language (default: en)")
+    parser.add_argument("--lng_input", default="en", help="Language of the input audio, or auto to detect it (default: en)")
+    parser.add_argument("--compression", default="gzip", help="Response compression: gzip, br or empty for none (default: gzip)")
+    parser.add_argument("--outputs", default=None, help="Comma separated outputs among text,srt,vtt,json,words (default: text,srt,json,words)")
+    parser.add_argument("--model", default=None, help="Model to use, e.g. medium, large, std-large, sm4t (default: server default)")
+    parser.add_argument("--profile", default=None, help="Latency/quality profile: fast, balanced or accurate (default: server default)")
+    parser.add_argument("--trace", action="store_true", help="Ask the server to write a Chrome trace of the request")
+    parser.add_argument("--job", action="store_true", help="Submit as a job and poll for the result instead of waiting on /predict")
+    parser.add_argument("--callback_url", default=None, help="With --job: URL notified on completion instead of polling")
+    parser.add_argument("--preencode", choices=["wav", "flac", "opus"], default=None, help="Transcode to 16 kHz mono WAV, FLAC or Opus before upload (needs ffmpeg)")
+    parser.add_argument("--batch_size", type=int, default=50, help="With --batch: items per request (default: 50)")
+    parser.add_argument("--output_dir", default="transcriptions", help="With --bulk: outputs mirror the input tree here (default: transcriptions)")
+    parser.add_argument("--concurrency", type=int, default=4, help="With --bulk: uploads in flight (default: 4)")
+    parser.add_argument("--retries", type=int, default=3, help="With --bulk: retries per file on errors, 429 and 5xx (default: 3)")
+    parser.add_argument("--manifest", default=None, help="With --bulk: resume manifest (default: <output_dir>/.hallu_manifest.jsonl)")
     args = parser.parse_args()
     
-    if args.url:
-        send_request(args.url, args.lng, args.lng_input, is_url=True)
+    source = args.url or args.path
+    if args.bulk:
+        fields, _ = build_request(None, args.lng, args.lng_input, True, args.compression, args.outputs, args.model, profile=args.profile)
+        del fields["url"]
+        runBulk(args.bulk, API_URL, fields, save_outputs, args.output_dir, concurrency=args.concurrency, retries=args.retries, manifestPath=args.manifest, preencodeCodec=args.preencode)
+    elif args.batch:
+        send_batch(args.batch, args.lng, args.lng_input, compression=args.compression, outputs=args.outputs, model=args.model, batch_size=args.batch_size, preencode_codec=args.preencode, profile=args.profile)
+    elif args.job or args.callback_url:
+        submit_job(source, args.lng, args.lng_input, is_url=bool(args.url), compression=args.compression, outputs=args.outputs, model=args.model, callback_url=args.callback_url, preencode_codec=args.preencode, profile=args.profile)
     else:
-        send_request(args.path, args.lng, args.lng_input, is_url=False)
\ No newline at end of file
+        send_request(source, args.lng, args.lng_input, is_url=bool(args.url), compression=args.compression, outputs=args.outputs, model=args.model, preencode_codec=args.preencode, profile=args.profile, trace=args.trace)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import json
+import os
+import re
+from threading import Lock
+
+#Phrases Whisper tends to produce on music or silence, by input language; "*" applies to all
+HALLUCINATIONS_PATH = os.environ.get("WHISPERHALLU_HALLUCINATIONS",
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "hallucinations.json"))
+
+class PhraseIndex:
+    """All phrases of a language compiled into one case-insensitive alternation."""
+
+    def __init__(self, phrases):
+        self.phrases = sorted(set(phrases), key=len, reverse=True)
+        if self.phrases:
+            self.pattern = re.compile("|".join(re.escape(p) for p in self.phrases), re.IGNORECASE)
+        else:
+            self.pattern = None
+
+    def count(self, text):
+        if self.pattern is None or not text:
+            return 0
+        return sum(1 for _ in self.pattern.finditer(text))
+
+    def contains(self, text):
+        return self.pattern is not None and bool(text) and self.pattern.search(text) is not None
+
+class HallucinationMonitor:
+    """Counts phrases segment by segment so a bad pass can stop decoding early.
+
+    A `stop` Event also ends the pass, e.g. once a hedged remote result was accepted.
+    """
+
+    def __init__(self, index, threshold, stop=None):
+        self.index = index
+        self.threshold = threshold
+        self.stop = stop
+        self.count = 0
+
+    def feed(self, text):
+        self.count += self.index.count(text)
+        return self.exceeded()
+
+    def preempted(self):
+        return self.stop is not None and self.stop.is_set()
+
+    def exceeded(self):
+        return self.count > self.threshold or self.preempted()
+
+_phrases = None
+_indexes = {}
+_lock = Lock()
+
+def loadPhrases(path=HALLUCINATIONS_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {lng.lower(): list(phrases) for lng, phrases in json.load(f).items()}
+    except (OSError, ValueError) as e:
+        print("Warning: can't load hallucination phrases from "+path)
+        print(e)
+        return {}
+
+def indexFor(language=None):
+    """PhraseIndex for a language (None for the language independent phrases only)."""
+    global _phrases
+    key = (language or "*").lower()
+    with _lock:
+        if _phrases is None:
+            _phrases = loadPhrases()
+        index = _indexes.get(key)
+        if index is None:
+            phrases = _phrases.get("*", []) + (_phrases.get(key, []) if key != "*" else [])
+            index = _indexes[key] = PhraseIndex(phrases)
+        return index
+
+def reload(path=HALLUCINATIONS_PATH):
+    global _phrases
+    with _lock:
+        _phrases = loadPhrases(path)
+        _indexes.clear()
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import unittest
+from threading import Event
+
+import hallucination_index
+from hallucination_index import HallucinationMonitor, PhraseIndex, indexFor
+from json_util import contains_weird_words
+
+class TestPhraseIndex(unittest.TestCase):
+    def test_count_is_case_insensitive(self):
+        index = PhraseIndex(["Hãy đăng ký kênh", "subscribe cho"])
+        self.assertEqual(index.count("hãy đăng ký kênh. Subscribe cho mình. Hãy đăng ký kênh"), 3)
+        self.assertFalse(index.contains("Xin chào"))
+        self.assertEqual(PhraseIndex([]).count("anything"), 0)
+
+    def test_monitor_crosses_threshold(self):
+        monitor = HallucinationMonitor(PhraseIndex(["subscribe cho"]), threshold=1)
+        self.assertFalse(monitor.feed("Subscribe cho kênh"))
+        self.assertFalse(monitor.feed("Xin chào"))
+        self.assertTrue(monitor.feed("subscribe cho mình"))
+
+    def test_monitor_stop_event(self):
+        stop = Event()
+        monitor = HallucinationMonitor(PhraseIndex(["subscribe cho"]), threshold=1, stop=stop)
+        self.assertFalse(monitor.feed("Xin chào"))
+        stop.set()
+        self.assertTrue(monitor.feed("Xin chào"))
+        self.assertTrue(monitor.preempted())
+
+    def test_per_language_phrases(self):
+        path = os.path.join(tempfile.mkdtemp(), "phrases.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"*": ["subscribe cho"], "en": ["Thanks for watching"]}, f)
+        hallucination_index.reload(path)
+        try:
+            self.assertEqual(indexFor("en").count("Thanks for watching, subscribe cho"), 2)
+            self.assertEqual(indexFor("vi").count("Thanks for watching, subscribe cho"), 1)
+        finally:
+            hallucination_index.reload()
+
+    def test_json_util_uses_the_index(self):
+        self.assertTrue(contains_weird_words("Nhớ HÃY ĐĂNG KÝ KÊNH nhé"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,344 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from queue import Empty, Queue
+from threading import Event, Thread
+
+import requests
+
+from metrics import metrics
+from admission import AGING_RATE
+
+#SQLite file shared by the server process (submit/status/result) and the job workers
+JOBS_DB = os.environ.get("WHISPERHALLU_JOBS_DB", os.path.join(tempfile.gettempdir(), "whisperhallu-jobs.sqlite"))
+#Seconds a finished job and its result are kept
+JOB_TTL = int(os.environ.get("WHISPERHALLU_JOB_TTL", "86400"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    callback_url TEXT,
+    result_url TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result BLOB,
+    content_encoding TEXT,
+    cost REAL NOT NULL DEFAULT 0,
+    size_class TEXT,
+    coalesce_key TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS active (
+    id TEXT PRIMARY KEY,
+    cost REAL NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+#Columns added after the first release, for queue files created before them
+MIGRATIONS = (("cost", "REAL NOT NULL DEFAULT 0"), ("size_class", "TEXT"), ("coalesce_key", "TEXT"))
+
+#Seconds an in-flight /predict row outlives its estimated cost, so rows left by a killed worker stop counting
+ACTIVE_GRACE = 600
+
+#Columns returned by status(), the result body is only read by result()
+STATUS_COLUMNS = ("id", "status", "created", "started", "finished", "expires", "attempts", "error", "cost", "size_class")
+
+class JobQueue:
+    """Persistent transcription jobs: queued -> running -> done | failed.
+
+    Queued jobs run cheapest first by estimated cost, minus `agingRate` per
+    second waited so long jobs are not starved.
+    """
+
+    def __init__(self, path=JOBS_DB, ttl=JOB_TTL, agingRate=AGING_RATE):
+        self.path = path
+        self.ttl = ttl
+        self.agingRate = agingRate
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._db() as db:
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for name, definition in MIGRATIONS:
+                if name not in columns:
+                    db.execute("ALTER TABLE jobs ADD COLUMN "+name+" "+definition)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.row_factory = sqlite3.Row
+        return db
+
+    @contextmanager
+    def _db(self):
+        db = self._connect()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, params, callbackUrl=None, resultUrl=None, cost=0, sizeClass=None, key=None):
+        """Queue a job and return its id; `resultUrl` may contain "{id}", it is sent to the callback.
+
+        With a `key`, a submission identical to a queued or running job joins it:
+        the existing id is returned and the callback is added to that job's.
+        """
+        jobId = uuid.uuid4().hex
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = None
+            if key is not None:
+                row = db.execute("SELECT id FROM jobs WHERE coalesce_key = ? AND status IN ('queued', 'running')", (key,)).fetchone()
+            if row is not None:
+                if callbackUrl:
+                    #URLs have no spaces, the column holds every callback of the job
+                    db.execute("UPDATE jobs SET callback_url = TRIM(COALESCE(callback_url, '') || ' ' || ?) WHERE id = ?", (callbackUrl, row["id"]))
+                db.execute("COMMIT")
+                removeAudio(params)
+                metrics.inc("jobs_coalesced_total")
+                return row["id"]
+            db.execute("INSERT INTO jobs (id, status, params, callback_url, result_url, created, cost, size_class, coalesce_key) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                       (jobId, json.dumps(params), callbackUrl, resultUrl.format(id=jobId) if resultUrl else None, time.time(), cost, sizeClass, key))
+            db.execute("COMMIT")
+        metrics.inc("jobs_submitted_total")
+        return jobId
+
+    def claim(self):
+        """Queued job with the lowest aged cost marked running, or None."""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY cost - ? * (? - created), created LIMIT 1",
+                             (self.agingRate, now)).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute("UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1 WHERE id = ?", (now, row["id"]))
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["started"] = now
+        metrics.observe("job_wait_seconds", now - job["created"], size_class=job["size_class"] or "unknown")
+        return job
+
+    def complete(self, jobId, result, contentEncoding=None):
+        now = time.time()
+        with self._db() as db:
+            db.execute("UPDATE jobs SET status = 'done', finished = ?, expires = ?, result = ?, content_encoding = ? WHERE id = ?",
+                       (now, now + self.ttl, result, contentEncoding, jobId))
+        metrics.inc("jobs_finished_total", status="done")
+
+    def fail(self, jobId, error):
+        now = time.time()
+        with self._db() as db:
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, expires = ?, error = ? WHERE id = ?",
+                       (now, now + self.ttl, error, jobId))
+        metrics.inc("jobs_finished_total", status="failed")
+
+    def requeueRunning(self, maxAttempts=2):
+        """After a worker restart: retry jobs it was running, fail those already retried."""
+        with self._db() as db:
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, expires = ?, error = 'worker stopped' "
+                       "WHERE status = 'running' AND attempts >= ?", (time.time(), time.time() + self.ttl, maxAttempts))
+            return db.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'").rowcount
+
+    def pending(self, key):
+        """Id of the queued or running job with this coalescing key, if any."""
+        with self._db() as db:
+            row = db.execute("SELECT id FROM jobs WHERE coalesce_key = ? AND status IN ('queued', 'running')", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def callbacks(self, jobId):
+        with self._db() as db:
+            row = db.execute("SELECT callback_url FROM jobs WHERE id = ?", (jobId,)).fetchone()
+        return row[0].split() if row is not None and row[0] else []
+
+    def backlog(self, includeJobs=True):
+        """Estimated seconds of work queued or running, jobs and in-flight /predict requests of every worker.
+
+        includeJobs=False leaves jobs out, for when no job worker runs them.
+        """
+        with self._db() as db:
+            jobs = 0
+            if includeJobs:
+                jobs = db.execute("SELECT COALESCE(SUM(cost), 0) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            active = db.execute("SELECT COALESCE(SUM(cost), 0) FROM active WHERE expires > ?", (time.time(),)).fetchone()[0]
+        return jobs + active
+
+    def addActive(self, requestId, cost):
+        """Count a synchronous request in the backlog until removeActive()."""
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO active (id, cost, expires) VALUES (?, ?, ?)",
+                       (requestId, cost, time.time() + 3 * cost + ACTIVE_GRACE))
+
+    def removeActive(self, requestId):
+        with self._db() as db:
+            db.execute("DELETE FROM active WHERE id = ?", (requestId,))
+
+    def status(self, jobId):
+        with self._db() as db:
+            row = db.execute("SELECT "+", ".join(STATUS_COLUMNS)+" FROM jobs WHERE id = ? AND (expires IS NULL OR expires > ?)",
+                             (jobId, time.time())).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == "queued":
+                #Jobs currently ahead by aged cost; later cheap submissions can still overtake
+                now = time.time()
+                priority = job["cost"] - self.agingRate * (now - job["created"])
+                job["position"] = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND cost - ? * (? - created) < ?",
+                                             (self.agingRate, now, priority)).fetchone()[0]
+            return job
+
+    def result(self, jobId):
+        """(status, result bytes, content encoding, error) or None if unknown or expired."""
+        with self._db() as db:
+            row = db.execute("SELECT status, result, content_encoding, error FROM jobs WHERE id = ? AND (expires IS NULL OR expires > ?)",
+                             (jobId, time.time())).fetchone()
+        return tuple(row) if row is not None else None
+
+    def finished(self, jobIds):
+        """{id: (status, result bytes, content encoding, error)} for the done or failed jobs among jobIds,
+        None for unknown or expired ones; jobs still queued or running are left out. One query for all.
+        """
+        if not jobIds:
+            return {}
+        jobIds = list(jobIds)
+        with self._db() as db:
+            rows = db.execute("SELECT id, status, result, content_encoding, error FROM jobs WHERE id IN ("+", ".join("?" * len(jobIds))+")"
+                              " AND (expires IS NULL OR expires > ?)", jobIds + [time.time()]).fetchall()
+        found = {row["id"]: tuple(row)[1:] for row in rows}
+        return {jobId: found.get(jobId) for jobId in jobIds
+                if jobId not in found or found[jobId][0] in ("done", "failed")}
+
+    def purgeExpired(self):
+        """Delete expired jobs with the audio they still reference."""
+        with self._db() as db:
+            rows = db.execute("SELECT id, params FROM jobs WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)).fetchall()
+            for row in rows:
+                removeAudio(json.loads(row["params"]))
+            db.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+            db.execute("DELETE FROM active WHERE expires <= ?", (time.time(),))
+        return len(rows)
+
+def removeAudio(params):
+    path = params.get("file_path")
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            print("Warning: can't remove "+path)
+            print(e)
+
+def notify(callbackUrl, payload, retries=3, timeout=10):
+    """POST the job status to the completion callback, retried with backoff."""
+    for attempt in range(retries):
+        try:
+            response = requests.post(callbackUrl, json=payload, timeout=timeout)
+            if response.status_code < 500:
+                metrics.inc("job_callbacks_total", status=response.status_code)
+                return response.status_code
+            print("Callback "+callbackUrl+" answered "+str(response.status_code))
+        except requests.exceptions.RequestException as e:
+            print("Callback "+callbackUrl+" failed: "+str(e))
+        time.sleep(2 ** attempt)
+    metrics.inc("job_callbacks_total", status="failed")
+    return None
+
+class JobWorkerPool:
+    """Threads pulling jobs from the queue; `handler(params)` returns (body, content_encoding).
+
+    Completion callbacks are posted by a thread of their own, so a slow or
+    failing callback URL never holds up a worker.
+    """
+
+    def __init__(self, queue, handler, workers=1, pollInterval=1.0, purgeInterval=600):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.pollInterval = pollInterval
+        self.purgeInterval = purgeInterval
+        self.stopped = Event()
+        self.threads = []
+        #(callback URL, payload) waiting to be posted
+        self.callbacks = Queue()
+
+    def start(self):
+        requeued = self.queue.requeueRunning()
+        if requeued:
+            print("JOBS: requeued "+str(requeued)+" interrupted job(s)")
+        for i in range(self.workers):
+            thread = Thread(target=self._loop, name="job-worker-"+str(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = Thread(target=self._notifyLoop, name="job-callbacks", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def run(self):
+        self.start()
+        lastPurge = 0
+        while not self.stopped.wait(self.pollInterval):
+            if time.time() - lastPurge > self.purgeInterval:
+                lastPurge = time.time()
+                purged = self.queue.purgeExpired()
+                if purged:
+                    print("JOBS: purged "+str(purged)+" expired job(s)")
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopped.wait(self.pollInterval)
+                continue
+            self.process(job)
+
+    def _notifyLoop(self):
+        #Drains what is left after stop()
+        while not (self.stopped.is_set() and self.callbacks.empty()):
+            try:
+                url, payload = self.callbacks.get(timeout=self.pollInterval)
+            except Empty:
+                continue
+            notify(url, payload)
+
+    def process(self, job):
+        print("JOB "+job["id"]+" started", flush=True)
+        try:
+            body, contentEncoding = self.handler(job["params"])
+            self.queue.complete(job["id"], body, contentEncoding)
+            payload = {"id": job["id"], "status": "done", "result_url": job["result_url"]}
+        except Exception as e:
+            print("JOB "+job["id"]+" failed: "+str(e), flush=True)
+            self.queue.fail(job["id"], str(e))
+            payload = {"id": job["id"], "status": "failed", "error": str(e)}
+        finally:
+            removeAudio(job["params"])
+        metrics.observe("job_run_seconds", time.time() - job["started"], size_class=job["size_class"] or "unknown")
+        print("JOB "+job["id"]+" "+payload["status"], flush=True)
+        #Read again: coalesced submissions may have added their own callbacks
+        for url in self.queue.callbacks(job["id"]):
+            self.callbacks.put((url, payload))
@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from unittest.mock import patch
+
+import metrics
+from job_queue import JobQueue, JobWorkerPool
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = JobQueue(os.path.join(tempfile.mkdtemp(), "jobs.sqlite"), ttl=60)
+
+    def test_fifo_lifecycle(self):
+        first = self.queue.submit({"lng": "vi"}, resultUrl="http://host/jobs/{id}/result")
+        second = self.queue.submit({"lng": "en"})
+        self.assertEqual(self.queue.status(second)["position"], 1)
+
+        job = self.queue.claim()
+        self.assertEqual((job["id"], job["params"], job["result_url"]), (first, {"lng": "vi"}, "http://host/jobs/"+first+"/result"))
+        self.assertEqual(self.queue.status(first)["status"], "running")
+        self.assertEqual(self.queue.result(first)[0], "running")
+
+        self.queue.complete(first, b'{"text": "ok"}', "gzip")
+        self.assertEqual(self.queue.result(first), ("done", b'{"text": "ok"}', "gzip", None))
+        self.assertEqual(self.queue.claim()["id"], second)
+        self.assertIsNone(self.queue.claim())
+
+    def test_cheapest_first_with_aging(self):
+        longJob = self.queue.submit({}, cost=300, sizeClass="long")
+        shortJob = self.queue.submit({}, cost=3, sizeClass="short")
+        self.assertEqual(self.queue.backlog(), 303)
+        self.assertEqual(self.queue.status(longJob)["position"], 1)
+        self.assertEqual(self.queue.claim()["id"], shortJob)
+        #In-flight /predict requests count too, until answered or expired
+        self.queue.addActive("req", 20)
+        self.assertEqual(self.queue.backlog(), 323)
+        self.queue.removeActive("req")
+        self.assertEqual(self.queue.backlog(), 303)
+        with patch("job_queue.ACTIVE_GRACE", -100):
+            self.queue.addActive("stale", 20)
+        self.assertEqual(self.queue.backlog(), 303)
+        #Without job workers only /predict requests count
+        self.queue.addActive("req", 20)
+        self.assertEqual(self.queue.backlog(includeJobs=False), 20)
+        self.queue.removeActive("req")
+
+        #After waiting long enough the long job beats fresh short ones
+        self.queue.agingRate = 1000
+        time.sleep(0.5)
+        self.queue.submit({}, cost=3, sizeClass="short")
+        self.assertEqual(self.queue.claim()["id"], longJob)
+
+    def test_identical_submissions_join_the_pending_job(self):
+        fd, duplicateAudio = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        first = self.queue.submit({}, callbackUrl="http://a/done", key="k")
+        self.assertEqual(self.queue.pending("k"), first)
+        second = self.queue.submit({"file_path": duplicateAudio}, callbackUrl="http://b/done", key="k")
+        self.assertEqual(second, first)
+        self.assertFalse(os.path.exists(duplicateAudio))
+        self.assertEqual(self.queue.callbacks(first), ["http://a/done", "http://b/done"])
+
+        self.queue.claim()
+        self.queue.complete(first, b"{}")
+        self.assertIsNone(self.queue.pending("k"))
+        self.assertNotEqual(self.queue.submit({}, key="k"), first)
+
+    def test_finished_in_one_query(self):
+        done, failed, running, queued = (self.queue.submit({}, cost=c) for c in (1, 2, 3, 4))
+        for jobId in (done, failed, running):
+            self.assertEqual(self.queue.claim()["id"], jobId)
+        self.queue.complete(done, b'{"text": "ok"}')
+        self.queue.fail(failed, "boom")
+        finished = self.queue.finished([done, failed, running, queued, "gone"])
+        self.assertEqual(set(finished), {done, failed, "gone"})
+        self.assertEqual(finished[done], ("done", b'{"text": "ok"}', None, None))
+        self.assertEqual((finished[failed][0], finished[failed][3]), ("failed", "boom"))
+        self.assertIsNone(finished["gone"])
+        self.assertEqual(self.queue.finished([]), {})
+
+    def test_ttl_and_restart(self):
+        jobId = self.queue.submit({})
+        self.queue.claim()
+        #Worker restarted while running: the job is retried once, then failed
+        self.assertEqual(self.queue.requeueRunning(), 1)
+        self.queue.claim()
+        self.queue.requeueRunning()
+        self.assertEqual(self.queue.status(jobId)["status"], "failed")
+
+        self.queue.ttl = -1
+        expired = self.queue.submit({})
+        self.queue.claim()
+        self.queue.fail(expired, "boom")
+        self.assertIsNone(self.queue.status(expired))
+        self.assertEqual(self.queue.purgeExpired(), 1)
+
+    def test_worker_pool_and_callback(self):
+        received = []
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            def do_POST(self):
+                received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(200)
+                self.end_headers()
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        callbackUrl = "http://127.0.0.1:"+str(httpd.server_address[1])+"/done"
+
+        fd, audioPath = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        ok = self.queue.submit({"file_path": audioPath, "lng": "en"}, callbackUrl=callbackUrl)
+        bad = self.queue.submit({"lng": "fail"}, callbackUrl=callbackUrl)
+
+        def handler(params):
+            if params["lng"] == "fail":
+                raise RuntimeError("no speech")
+            return b'{"text": "hello"}', None
+        pool = JobWorkerPool(self.queue, handler, workers=2, pollInterval=0.01).start()
+        deadline = time.time() + 5
+        while len(received) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        pool.stop(1)
+
+        self.assertEqual(self.queue.result(ok)[:2], ("done", b'{"text": "hello"}'))
+        self.assertEqual(self.queue.status(bad)["error"], "no speech")
+        self.assertFalse(os.path.exists(audioPath))
+        self.assertEqual(sorted(r["status"] for r in received), ["done", "failed"])
+
+    def test_slow_callback_does_not_block_workers(self):
+        release = Event()
+        notified = []
+        def slowNotify(url, payload):
+            release.wait(5)
+            notified.append(payload["id"])
+        first = self.queue.submit({"lng": "en"}, callbackUrl="http://slow/done")
+        second = self.queue.submit({"lng": "en"})
+        with patch("job_queue.notify", slowNotify):
+            pool = JobWorkerPool(self.queue, lambda params: (b"{}", None), workers=1, pollInterval=0.01).start()
+            deadline = time.time() + 5
+            while self.queue.status(second)["status"] != "done" and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.queue.status(second)["status"], "done")
+            self.assertEqual(notified, [])
+            release.set()
+            pool.stop(5)
+        self.assertEqual(notified, [first])
+
+if __name__ == '__main__':
+    unittest.main()
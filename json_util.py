@@ -1,4 +1,5 @@
 import json
+from hallucination_index import indexFor
 
 def convert_gladia_to_internal_format(gladia_response):
     result = {
@@ -33,7 +34,8 @@ def convert_gladia_to_internal_format(gladia_response):
         
         result["json"].append(json_segment)
     result["text"] = gladia_response.get("transcription", {}).get("full_transcript", "")
-    result["srt"] = gladia_response.get("transcription", {}).get("subtitles", [])[0].get("subtitles", "")
+    subtitles = gladia_response.get("transcription", {}).get("subtitles", [])
+    result["srt"] = subtitles[0].get("subtitles", "") if subtitles else ""
     return result
 
 def split_sentence(sentence, words):
@@ -75,9 +77,8 @@ def split_sentence(sentence, words):
     
     return new_sentences
 
-def contains_weird_words(text):
-    weird_words = ["Hãy đăng ký kênh", "subscribe cho"]
-    return any(word.lower() in text.lower() for word in weird_words)
+def contains_weird_words(text, language=None):
+    return indexFor(language).contains(text)
 
 def process_json(input_json):
     output_json = []
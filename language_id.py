@@ -0,0 +1,52 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+#Speech kept for detection; Whisper only looks at the first 30 s anyway
+EXCERPT_SECONDS = 30
+#Below this probability the request's fallback language is used instead
+MIN_PROBABILITY = 0.5
+
+def audioHash(path: str, chunkSize=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class LanguageCache:
+    """Detected (language, probability) by audio content hash, LRU bounded."""
+
+    def __init__(self, maxEntries=4096):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+def detectWithModel(entry, pathExcerpt: str):
+    """(language, probability) from a registry model entry, or (None, 0) if the backend can't tell."""
+    if entry.backend == "FSTR":
+        #Language detection runs eagerly, the segment generator is never consumed
+        segments, info = entry.model.transcribe(pathExcerpt, beam_size=1)
+        return info.language, info.language_probability
+    if entry.backend == "STD":
+        import whisper
+        audio = whisper.pad_or_trim(whisper.load_audio(pathExcerpt))
+        mel = whisper.log_mel_spectrogram(audio, n_mels=entry.model.dims.n_mels).to(entry.model.device)
+        _, probs = entry.model.detect_language(mel)
+        language = max(probs, key=probs.get)
+        return language, probs[language]
+    return None, 0
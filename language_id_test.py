@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from language_id import LanguageCache, audioHash, detectWithModel
+
+class TestLanguageId(unittest.TestCase):
+    def test_audio_hash_is_content_based(self):
+        d = tempfile.mkdtemp()
+        paths = [os.path.join(d, name) for name in ("a.wav", "b.wav")]
+        for path in paths:
+            with open(path, "wb") as f:
+                f.write(b"RIFF" + b"\x00" * 100)
+        self.assertEqual(audioHash(paths[0]), audioHash(paths[1]))
+
+    def test_cache_is_lru_bounded(self):
+        cache = LanguageCache(maxEntries=2)
+        cache.put("a", ("vi", 0.9))
+        cache.put("b", ("en", 0.8))
+        cache.get("a")
+        cache.put("c", ("fr", 0.7))
+        self.assertEqual(cache.get("a"), ("vi", 0.9))
+        self.assertIsNone(cache.get("b"))
+
+    def test_faster_whisper_detection(self):
+        model = SimpleNamespace(transcribe=lambda path, **opts: (iter(()), SimpleNamespace(language="vi", language_probability=0.93)))
+        entry = SimpleNamespace(backend="FSTR", model=model)
+        self.assertEqual(detectWithModel(entry, "excerpt.wav"), ("vi", 0.93))
+        self.assertEqual(detectWithModel(SimpleNamespace(backend="SM4T", model=None), "excerpt.wav"), (None, 0))
+
+if __name__ == '__main__':
+    unittest.main()
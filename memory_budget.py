@@ -0,0 +1,179 @@
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Event, Thread
+
+from metrics import metrics
+
+#Memory the requests of one worker process may use at once (MB); 0 disables scheduling
+MEMORY_BUDGET_MB = float(os.environ.get("WHISPERHALLU_MEMORY_BUDGET_MB", "0"))
+#Seconds a request waits for room before falling back to its degraded plan
+MEMORY_WAIT = float(os.environ.get("WHISPERHALLU_MEMORY_WAIT", "30"))
+#Length of the pieces separated one after the other in the degraded plan
+SEPARATION_CHUNK_SECONDS = float(os.environ.get("WHISPERHALLU_SEPARATION_CHUNK", "60"))
+#Seconds shared by consecutive chunks, cross-faded so chunk boundaries leave no seams
+SEPARATION_OVERLAP_SECONDS = 2.0
+#Fixed per request overhead: buffers, results, Python objects (MB)
+REQUEST_MB = 50.0
+#RSS sampling period while a request runs
+SAMPLE_INTERVAL = 0.05
+
+MB = 1024.0 * 1024.0
+#float32 samples at the Whisper/VAD rate and at the Demucs rate (stereo)
+WHISPER_RATE = 16000
+DEMUCS_RATE = 44100
+FLOAT = 4
+#htdemucs sources, each as large as the input
+DEMUCS_SOURCES = 4
+
+def stageMemory(duration, channels=2, isMusic=True, localSeparation=True, vad=True, chunkSeconds=None):
+    """Estimated peak MB of each pipeline stage for `duration` seconds of audio.
+
+    Stages run one after the other (the parallel ones are ffmpeg subprocesses),
+    so the request peak is the largest stage, see peakMemory().
+    """
+    stages = {
+        #16-bit WAV in memory while the upload is converted
+        "decode": duration * WHISPER_RATE * 2 * max(channels, 1),
+        #Whole file decoded to float32 then the log-mel features
+        "whisper": duration * WHISPER_RATE * FLOAT * 2,
+    }
+    if vad and not isMusic:
+        #read_audio then collect_chunks copies the speech
+        stages["vad"] = duration * WHISPER_RATE * FLOAT * 2
+    if isMusic and localSeparation:
+        span = min(duration, chunkSeconds + SEPARATION_OVERLAP_SECONDS) if chunkSeconds else duration
+        #Stereo input at the model rate, plus every source and the overlap-add sums for the separated span
+        stages["separate"] = (duration + span * DEMUCS_SOURCES * 2) * DEMUCS_RATE * 2 * FLOAT
+        #Vocals read back as float32 frames with 50% overlap
+        stages["activity"] = duration * WHISPER_RATE * FLOAT * 3
+    return {name: size / MB for name, size in stages.items()}
+
+def peakMemory(stages):
+    return REQUEST_MB + max(stages.values())
+
+def requestPlan(duration, channels=2, isMusic=True, localSeparation=True, vad=True, chunkSeconds=SEPARATION_CHUNK_SECONDS):
+    """(estimated peak MB, peak MB with chunked separation or None when chunking would not lower it)."""
+    full = peakMemory(stageMemory(duration, channels, isMusic, localSeparation, vad))
+    chunked = peakMemory(stageMemory(duration, channels, isMusic, localSeparation, vad, chunkSeconds))
+    return full, (chunked if chunked < full else None)
+
+def residentMB():
+    """Resident set size of this process (Linux), None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+class PeakSampler:
+    """Growth of this process' RSS above its level at start, sampled in the background.
+
+    Concurrent requests share the process, so this is their combined growth:
+    an upper bound of the request's own peak.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.startMB = residentMB()
+        self.maxMB = self.startMB
+        self.stopped = Event()
+        self.thread = Thread(target=self.sample, daemon=True)
+        if self.startMB is not None:
+            self.thread.start()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.maxMB = max(self.maxMB, residentMB() or 0)
+
+    def stop(self):
+        """Peak growth in MB, None if RSS can't be read."""
+        self.stopped.set()
+        if self.startMB is None:
+            return None
+        self.thread.join()
+        self.maxMB = max(self.maxMB, residentMB() or 0)
+        return self.maxMB - self.startMB
+
+class Grant:
+    def __init__(self, estimateMB):
+        self.estimateMB = estimateMB
+        #Separation chunk length when running the degraded plan
+        self.chunkSeconds = None
+        self.degraded = None
+
+    def degrade(self, estimateMB, chunkSeconds, reason):
+        print("MEMORY degraded ("+reason+"): chunked separation, "+str(int(self.estimateMB))+" -> "+str(int(estimateMB))+" MB", flush=True)
+        metrics.inc("memory_degraded_total", reason=reason)
+        self.estimateMB = estimateMB
+        self.chunkSeconds = chunkSeconds
+        self.degraded = reason
+
+class MemoryScheduler:
+    """Admits requests in arrival order while the sum of their estimated peaks fits the budget.
+
+    A request over the whole budget runs its degraded plan if it has one; if
+    that does not fit either it runs alone. A request queued for more than
+    maxWait switches to its degraded plan when that is smaller.
+
+    The budget is per process: requests of other worker processes (another
+    LitServe worker, the job workers) are not counted, so give each process
+    its share of the host's memory.
+    """
+
+    def __init__(self, budgetMB=MEMORY_BUDGET_MB, maxWait=MEMORY_WAIT, chunkSeconds=SEPARATION_CHUNK_SECONDS):
+        self.budgetMB = budgetMB
+        self.maxWait = maxWait
+        self.chunkSeconds = chunkSeconds
+        self.reservedMB = 0.0
+        self.running = 0
+        self.queue = deque()
+        self.cond = Condition()
+
+    def fits(self, estimateMB):
+        return self.running == 0 or self.reservedMB + estimateMB <= self.budgetMB
+
+    @contextmanager
+    def reserve(self, estimateMB, degradedMB=None):
+        """Wait for room for the request, yield its Grant and release the room when done."""
+        grant = Grant(estimateMB)
+        if self.budgetMB > 0:
+            if degradedMB is not None and estimateMB > self.budgetMB:
+                grant.degrade(degradedMB, self.chunkSeconds, "budget")
+            startTime = time.time()
+            ticket = object()
+            with self.cond:
+                self.queue.append(ticket)
+                try:
+                    while not (self.queue[0] is ticket and self.fits(grant.estimateMB)):
+                        waited = time.time() - startTime
+                        if degradedMB is not None and grant.degraded is None and waited >= self.maxWait:
+                            grant.degrade(degradedMB, self.chunkSeconds, "wait")
+                            continue
+                        self.cond.wait(max(0.01, self.maxWait - waited) if grant.degraded is None and degradedMB is not None else None)
+                finally:
+                    self.queue.remove(ticket)
+                    self.cond.notify_all()
+                self.reservedMB += grant.estimateMB
+                self.running += 1
+                metrics.set("memory_reserved_mb", self.reservedMB)
+            metrics.observe("memory_wait_seconds", time.time() - startTime)
+        sampler = PeakSampler()
+        try:
+            yield grant
+        finally:
+            peakMB = sampler.stop()
+            if self.budgetMB > 0:
+                with self.cond:
+                    self.reservedMB -= grant.estimateMB
+                    self.running -= 1
+                    metrics.set("memory_reserved_mb", self.reservedMB)
+                    self.cond.notify_all()
+            plan = "chunked" if grant.degraded else "full"
+            metrics.observe("memory_estimate_mb", grant.estimateMB, plan=plan)
+            if peakMB is not None:
+                #Actual against estimated peak, to tune the estimator
+                metrics.observe("memory_peak_mb", peakMB, plan=plan)
+                metrics.observe("memory_peak_ratio", peakMB / grant.estimateMB, plan=plan)
+                print("MEMORY estimate="+str(int(grant.estimateMB))+"MB peak="+str(int(peakMB))+"MB", flush=True)
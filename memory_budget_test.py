@@ -0,0 +1,84 @@
+import tempfile
+import time
+import unittest
+from threading import Event, Thread
+from unittest.mock import patch
+
+import metrics
+from memory_budget import MemoryScheduler, requestPlan, stageMemory
+
+class TestMemoryBudget(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_estimates(self):
+        music = stageMemory(600)
+        self.assertEqual(max(music, key=music.get), "separate")
+        #Four stereo sources twice over, plus the input: ~1.8 GB for 10 minutes
+        self.assertAlmostEqual(music["separate"], 1817, delta=5)
+        self.assertNotIn("separate", stageMemory(600, localSeparation=False))
+        self.assertNotIn("vad", music)
+        self.assertIn("vad", stageMemory(600, isMusic=False))
+        full, chunked = requestPlan(600, chunkSeconds=60)
+        self.assertLess(chunked, full / 3)
+        #Short files and speech gain nothing from chunks
+        self.assertIsNone(requestPlan(30, chunkSeconds=60)[1])
+        self.assertIsNone(requestPlan(600, isMusic=False)[1])
+
+    def hold(self, scheduler, estimateMB, degradedMB=None):
+        """Thread holding a reservation until its release event is set."""
+        admitted = Event()
+        release = Event()
+        grants = []
+        def run():
+            with scheduler.reserve(estimateMB, degradedMB) as grant:
+                grants.append(grant)
+                admitted.set()
+                release.wait(5)
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        return thread, admitted, release, grants
+
+    def test_queues_until_it_fits(self):
+        scheduler = MemoryScheduler(budgetMB=1000, maxWait=60)
+        estimates = metrics.metrics.summaries.get("memory_estimate_mb{plan=full}", {}).get("count", 0)
+        first = self.hold(scheduler, 600)
+        self.assertTrue(first[1].wait(5))
+        second = self.hold(scheduler, 300)
+        self.assertTrue(second[1].wait(5))
+        third = self.hold(scheduler, 300)
+        self.assertFalse(third[1].wait(0.2))
+        self.assertEqual(scheduler.reservedMB, 900)
+        first[2].set()
+        self.assertTrue(third[1].wait(5))
+        for thread, _admitted, release, _grants in (second, third):
+            release.set()
+            thread.join(5)
+        self.assertEqual((scheduler.reservedMB, scheduler.running), (0, 0))
+        self.assertIsNone(third[3][0].degraded)
+        self.assertEqual(metrics.metrics.summaries["memory_estimate_mb{plan=full}"]["count"], estimates + 3)
+
+    def test_degrades_over_budget_or_after_waiting(self):
+        scheduler = MemoryScheduler(budgetMB=1000, maxWait=0.2, chunkSeconds=60)
+        with scheduler.reserve(2000, 400) as grant:
+            self.assertEqual((grant.degraded, grant.chunkSeconds, grant.estimateMB), ("budget", 60, 400))
+            startTime = time.time()
+            #Full plan waits for the running request, the chunked one fits next to it
+            with scheduler.reserve(700, 500) as waiting:
+                self.assertEqual(waiting.degraded, "wait")
+                self.assertGreaterEqual(time.time() - startTime, 0.2)
+        #Too big even degraded: runs alone
+        with scheduler.reserve(5000, 3000) as alone:
+            self.assertEqual(alone.estimateMB, 3000)
+        self.assertEqual(metrics.metrics.counters["memory_degraded_total{reason=wait}"], 1)
+
+    def test_disabled(self):
+        scheduler = MemoryScheduler(budgetMB=0)
+        with scheduler.reserve(5000, 100) as grant:
+            self.assertIsNone(grant.chunkSeconds)
+        self.assertEqual(scheduler.running, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import time
+from threading import Lock, Timer
+
+#LitServe runs inference in worker processes, so each process writes a snapshot
+#file and the server process merges them when /metrics is requested.
+METRICS_DIR = os.environ.get("WHISPERHALLU_METRICS_DIR", os.path.join(tempfile.gettempdir(), "whisperhallu-metrics"))
+FLUSH_INTERVAL = 1.0
+
+def metricKey(name, labels):
+    if not labels:
+        return name
+    return name+"{"+",".join(k+"="+str(labels[k]) for k in sorted(labels))+"}"
+
+class Metrics:
+    """Counters, gauges, summaries and free-form sections for one process."""
+
+    def __init__(self, metricsDir=METRICS_DIR, role="worker"):
+        self.metricsDir = metricsDir
+        self.role = role
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.sections = {}
+        self.lock = Lock()
+        self.lastFlush = 0
+        #Flush of the updates held back by the rate limit
+        self.timer = None
+
+    def inc(self, name, value=1, **labels):
+        key = metricKey(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.flush()
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[metricKey(name, labels)] = value
+        self.flush()
+
+    def observe(self, name, value, **labels):
+        key = metricKey(name, labels)
+        with self.lock:
+            s = self.summaries.get(key)
+            if s is None:
+                s = self.summaries[key] = {"count": 0, "sum": 0.0, "min": value, "max": value}
+            s["count"] += 1
+            s["sum"] += value
+            s["min"] = min(s["min"], value)
+            s["max"] = max(s["max"], value)
+        self.flush()
+
+    def section(self, name, data):
+        with self.lock:
+            self.sections[name] = data
+        self.flush(force=True)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "role": self.role,
+                "time": time.time(),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "summaries": {k: dict(v) for k, v in self.summaries.items()},
+                "sections": dict(self.sections),
+            }
+
+    def flush(self, force=False):
+        now = time.time()
+        if not force and now - self.lastFlush < FLUSH_INTERVAL:
+            #Written at the end of the interval even if nothing else happens in this process
+            with self.lock:
+                if self.timer is None:
+                    self.timer = Timer(FLUSH_INTERVAL - (now - self.lastFlush), self.flushLater)
+                    self.timer.daemon = True
+                    self.timer.start()
+            return
+        self.lastFlush = now
+        try:
+            os.makedirs(self.metricsDir, exist_ok=True)
+            path = os.path.join(self.metricsDir, str(os.getpid())+".json")
+            with open(path+".tmp", "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path+".tmp", path)
+        except (OSError, TypeError, ValueError) as e:
+            print("Warning: can't write metrics")
+            print(e)
+
+    def flushLater(self):
+        with self.lock:
+            self.timer = None
+        self.flush(force=True)
+
+def collect(metricsDir=METRICS_DIR):
+    """Merge the snapshots of all live processes: counters and summaries are summed, gauges kept per pid."""
+    merged = {"counters": {}, "gauges": {}, "summaries": {}, "sections": {}}
+    metrics.flush(force=True)
+    if not os.path.isdir(metricsDir):
+        return merged
+    for name in sorted(os.listdir(metricsDir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(metricsDir, name)) as f:
+                snap = json.load(f)
+            os.kill(snap["pid"], 0)
+        except (OSError, ValueError, KeyError):
+            #Process gone or snapshot half written
+            continue
+        pid = str(snap["pid"])
+        for k, v in snap["counters"].items():
+            merged["counters"][k] = merged["counters"].get(k, 0) + v
+        for k, v in snap["gauges"].items():
+            merged["gauges"].setdefault(k, {})[pid] = v
+        for k, v in snap["summaries"].items():
+            m = merged["summaries"].get(k)
+            if m is None:
+                merged["summaries"][k] = dict(v)
+            else:
+                m["count"] += v["count"]
+                m["sum"] += v["sum"]
+                m["min"] = min(m["min"], v["min"])
+                m["max"] = max(m["max"], v["max"])
+        for k, v in snap["sections"].items():
+            merged["sections"].setdefault(k, {})[pid] = v
+    for s in merged["summaries"].values():
+        s["avg"] = s["sum"] / s["count"] if s["count"] else 0
+    return merged
+
+#Process-wide instance
+metrics = Metrics()
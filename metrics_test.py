@@ -0,0 +1,23 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from metrics import Metrics, collect
+
+class TestMetrics(unittest.TestCase):
+    def test_rate_limited_updates_are_written_later(self):
+        metricsDir = tempfile.mkdtemp()
+        metrics = Metrics(metricsDir)
+        metrics.inc("requests_total")
+        metrics.inc("requests_total")
+        path = os.path.join(metricsDir, str(os.getpid())+".json")
+        with open(path) as f:
+            self.assertEqual(json.load(f)["counters"], {"requests_total": 1})
+        #No later event in this process: the timer writes the last increment
+        time.sleep(1.3)
+        self.assertEqual(collect(metricsDir)["counters"], {"requests_total": 2})
+
+if __name__ == '__main__':
+    unittest.main()
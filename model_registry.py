@@ -0,0 +1,269 @@
+import gc
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Event, Lock
+
+import torch
+
+from metrics import metrics
+
+BACKENDS = ("FSTR", "STD", "SM4T")
+
+#Rough resident size of each model once loaded, used to make room before loading
+ESTIMATED_MB = {
+    ("FSTR", "medium"): 1600,
+    ("FSTR", "large"): 3200,
+    ("STD", "medium"): 5000,
+    ("STD", "large"): 10000,
+    ("SM4T", "large"): 6000,
+}
+DEFAULT_ESTIMATED_MB = 4000
+#Directory holding the converted faster-whisper models (whisper-<size>-ct2/)
+MODEL_DIR = os.environ.get("WHISPERHALLU_MODEL_DIR", "")
+#Sizes always accepted; variants (large-v3, medium.en...) need a converted model for FSTR
+SIZES = ("tiny", "base", "small", "medium", "large")
+
+def baseSize(size):
+    """'large-v3' -> 'large', 'medium.en' -> 'medium'."""
+    return re.split(r"[-.]", size)[0]
+
+def hasConverted(modelDir, size):
+    return os.path.isdir(os.path.join(modelDir, "whisper-"+size+"-ct2"))
+
+def estimatedMB(backend, size):
+    return ESTIMATED_MB.get((backend, size), ESTIMATED_MB.get((backend, baseSize(size)), DEFAULT_ESTIMATED_MB))
+
+def parseModelKey(key: str, defaultBackend: str, modelDir=None):
+    """'large' -> (defaultBackend, 'large'); 'std-medium' -> ('STD', 'medium'); 'sm4t' -> ('SM4T', 'large').
+
+    Besides SIZES, FSTR takes any size converted in modelDir (WHISPERHALLU_MODEL_DIR),
+    e.g. 'large-v3' for whisper-large-v3-ct2/, and STD any variant of them, e.g. 'std-medium.en'.
+    """
+    modelDir = MODEL_DIR if modelDir is None else modelDir
+    key = key.strip().lower()
+    backend = defaultBackend
+    size = key
+    if "-" in key:
+        prefix, rest = key.split("-", 1)
+        if prefix.upper() in BACKENDS:
+            backend, size = prefix.upper(), rest
+        elif prefix not in SIZES and not hasConverted(modelDir, key):
+            raise ValueError("Unknown model backend: "+prefix.upper())
+    elif key.upper() in BACKENDS:
+        backend, size = key.upper(), ""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown model backend: "+backend)
+    if size == "":
+        size = "large" if backend == "SM4T" else "medium"
+    if (size not in SIZES and not (backend == "STD" and baseSize(size) in SIZES)
+            and not (backend == "FSTR" and hasConverted(modelDir, size))):
+        raise ValueError("Unknown model size: "+size)
+    return backend, size
+
+class ModelEntry:
+    def __init__(self, key, backend, size, model, residentMB, concurrency=1):
+        self.key = key
+        self.backend = backend
+        self.size = size
+        self.model = model
+        self.residentMB = residentMB
+        self.loadedAt = time.time()
+        self.lastUsed = self.loadedAt
+        self.users = 0
+        #Concurrent passes the loaded model can serve
+        self.slots = BoundedSemaphore(concurrency)
+
+class ModelRegistry:
+    """Several Whisper-like models resident at once, unloaded LRU-first under a memory budget.
+
+    Models load outside the registry lock: requests for resident models are
+    not held up by a load, and concurrent requests for the model being loaded
+    wait for that single load.
+    """
+
+    def __init__(self, defaultBackend="FSTR", device="cuda", deviceIndex=0, budgetMB=None,
+                 computeType="float16", whisperVersion="-v2", beam_size=5, patience=0, temperature=0, modelDir=MODEL_DIR):
+        self.defaultBackend = defaultBackend
+        self.modelDir = modelDir
+        self.device = device
+        self.deviceIndex = deviceIndex
+        self.budgetMB = budgetMB
+        self.computeType = computeType
+        self.whisperVersion = whisperVersion
+        #faster-whisper CPU settings, see cpu_tuning.autotune
+        self.cpuThreads = 0
+        self.numWorkers = 1
+        self.decodeInfo = " BS: "+str(beam_size)+" PTC="+str(patience)+" TEMP="+str(temperature)
+        self.defaultKey = None
+        self.entries = OrderedDict() #LRU order: least recently used first
+        #Models being loaded: key -> (Event set when done, estimated MB)
+        self.loading = {}
+        self.events = []
+        self.lock = Lock()
+
+    def normalizeKey(self, key=None):
+        if key is None or key == "":
+            if self.defaultKey is None:
+                raise ValueError("No model requested and no default model loaded")
+            return self.defaultKey
+        backend, size = parseModelKey(key, self.defaultBackend, self.modelDir)
+        return backend.lower()+"-"+size
+
+    def load(self, key=None, default=False):
+        """Load (or touch) a model and return its entry."""
+        key = self.normalizeKey(key)
+        entry = self._entry(key)
+        with self.lock:
+            if default or self.defaultKey is None:
+                self.defaultKey = key
+        return entry
+
+    @contextmanager
+    def acquire(self, key=None):
+        """Use a model; it can't be evicted while acquired."""
+        key = self.normalizeKey(key)
+        entry = self._entry(key, use=True)
+        try:
+            yield entry
+        finally:
+            with self.lock:
+                entry.users -= 1
+                entry.lastUsed = time.time()
+
+    def unload(self, key):
+        key = self.normalizeKey(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.users > 0:
+                return False
+            self._evictLocked(entry, "manual")
+            return True
+
+    def residentMB(self):
+        return sum(e.residentMB for e in self.entries.values())
+
+    def stats(self):
+        with self.lock:
+            return self._statsLocked()
+
+    def _statsLocked(self):
+        return {
+            "device": self.device+":"+str(self.deviceIndex),
+            "budget_mb": self.budgetMB,
+            "resident_mb": self.residentMB(),
+            "default": self.defaultKey,
+            "models": [{
+                "key": e.key,
+                "resident_mb": e.residentMB,
+                "in_use": e.users,
+                "idle_s": round(time.time() - e.lastUsed, 1),
+            } for e in self.entries.values()],
+            "events": list(self.events[-50:]),
+        }
+
+    def _event(self, kind, entry, **extra):
+        event = dict(time=time.time(), event=kind, model=entry.key, resident_mb=entry.residentMB, **extra)
+        self.events.append(event)
+        del self.events[:-200]
+        print(kind.upper()+": "+entry.key+" "+str(entry.residentMB)+"MB TOTAL="+str(self.residentMB())+"MB", flush=True)
+        metrics.inc("model_"+kind+"_total", model=entry.key)
+        metrics.set("model_resident_mb", self.residentMB())
+        metrics.section("models", self._statsLocked())
+
+    def _entry(self, key, use=False):
+        """Resident entry of `key` (touched, and marked in use if `use`), loaded first if needed."""
+        backend, size = parseModelKey(key, self.defaultBackend, self.modelDir)
+        estimateMB = estimatedMB(backend, size)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    entry.lastUsed = time.time()
+                    if use:
+                        entry.users += 1
+                    return entry
+                loading = self.loading.get(key)
+                if loading is None:
+                    done = Event()
+                    #Counted by _makeRoomLocked until loaded
+                    self.loading[key] = (done, estimateMB)
+                    self._makeRoomLocked()
+                    break
+            #Someone else is loading it: use theirs, or retry if their load failed
+            loading[0].wait()
+        try:
+            #Concurrent loads of other models blur the measure, the estimate is used then
+            before = self._usedMB()
+            startTime = time.time()
+            model = self._loadBackend(backend, size)
+            residentMB = (max(self._usedMB() - before, 0) if len(self.loading) == 1 else 0) or estimateMB
+            concurrency = self.numWorkers if backend == "FSTR" and self.device == "cpu" else 1
+            entry = ModelEntry(key, backend, size, model, residentMB, concurrency)
+            with self.lock:
+                self.entries[key] = entry
+                if use:
+                    entry.users += 1
+                self._event("loaded", entry, seconds=round(time.time() - startTime, 2))
+            return entry
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+            done.set()
+
+    def _makeRoomLocked(self):
+        """Evict idle models, least recently used first, until those being loaded fit the budget."""
+        if self.budgetMB is None:
+            return
+        neededMB = sum(estimateMB for _done, estimateMB in self.loading.values())
+        for entry in list(self.entries.values()):
+            if self.residentMB() + neededMB <= self.budgetMB:
+                break
+            if entry.users == 0:
+                self._evictLocked(entry, "budget")
+        if self.residentMB() + neededMB > self.budgetMB:
+            print("Warning: model memory budget exceeded: "+str(self.residentMB() + neededMB)+"MB > "+str(self.budgetMB)+"MB")
+
+    def _evictLocked(self, entry, reason):
+        del self.entries[entry.key]
+        entry.model = None
+        gc.collect()
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+        self._event("evicted", entry, reason=reason)
+
+    def _usedMB(self):
+        if self.device == "cuda" and torch.cuda.is_available():
+            free, total = torch.cuda.mem_get_info(int(self.deviceIndex))
+            return (total - free) // (1024 * 1024)
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+        except (OSError, ValueError):
+            return 0
+
+    def _loadBackend(self, backend, size):
+        gpu = str(self.deviceIndex)
+        if backend == "FSTR":
+            from faster_whisper import WhisperModel
+            modelPath = os.path.join(self.modelDir, "whisper-"+size+"-ct2/")
+            if not os.path.exists(modelPath):
+                raise FileNotFoundError(modelPath+" model not found")
+            if self.device == "cpu":
+                print("LOADING: "+modelPath+" CPU: "+self.computeType+" THREADS="+str(self.cpuThreads)+" WORKERS="+str(self.numWorkers)+self.decodeInfo)
+                return WhisperModel(modelPath, device="cpu", compute_type=self.computeType,
+                                    cpu_threads=self.cpuThreads, num_workers=self.numWorkers)
+            print("LOADING: "+modelPath+" GPU: "+gpu+self.decodeInfo)
+            return WhisperModel(modelPath, device=self.device, device_index=int(gpu), compute_type=self.computeType)
+        if backend == "STD":
+            import whisper
+            modelSize = "large"+self.whisperVersion if size == "large" else size
+            print("LOADING: "+modelSize+" GPU:"+gpu+self.decodeInfo)
+            return whisper.load_model(modelSize, device=torch.device(self.device+":"+gpu if self.device == "cuda" else self.device))
+        from seamless_communication.models.inference import Translator
+        print("LOADING: "+"seamlessM4T_"+size+" GPU:"+gpu)
+        return Translator("seamlessM4T_"+size, "vocoder_36langs", torch.device(self.device+":"+gpu if self.device == "cuda" else self.device),
+                          torch.float16 if self.device == "cuda" else torch.float32)
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+import unittest
+from threading import Event, Thread
+from unittest.mock import patch
+
+import metrics
+from model_registry import ModelRegistry, estimatedMB, parseModelKey
+
+class TestParseModelKey(unittest.TestCase):
+    def test_keys(self):
+        self.assertEqual(parseModelKey("large", "FSTR"), ("FSTR", "large"))
+        self.assertEqual(parseModelKey("std-medium", "FSTR"), ("STD", "medium"))
+        self.assertEqual(parseModelKey("sm4t", "FSTR"), ("SM4T", "large"))
+        with self.assertRaises(ValueError):
+            parseModelKey("foo-large", "FSTR")
+        with self.assertRaises(ValueError):
+            parseModelKey("huge", "FSTR")
+
+    def test_converted_variants(self):
+        modelDir = tempfile.mkdtemp()
+        for size in ("large-v3", "distil-large-v3"):
+            os.mkdir(os.path.join(modelDir, "whisper-"+size+"-ct2"))
+        self.assertEqual(parseModelKey("large-v3", "FSTR", modelDir), ("FSTR", "large-v3"))
+        self.assertEqual(parseModelKey("fstr-large-v3", "FSTR", modelDir), ("FSTR", "large-v3"))
+        self.assertEqual(parseModelKey("distil-large-v3", "FSTR", modelDir), ("FSTR", "distil-large-v3"))
+        #openai-whisper downloads its variants by name
+        self.assertEqual(parseModelKey("std-medium.en", "FSTR", modelDir), ("STD", "medium.en"))
+        with self.assertRaises(ValueError):
+            parseModelKey("large-v2", "FSTR", modelDir)
+        self.assertEqual(estimatedMB("FSTR", "large-v3"), estimatedMB("FSTR", "large"))
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = ModelRegistry(device="cpu", budgetMB=6000)
+        self.registry._loadBackend = lambda backend, size: object()
+        self.registry._usedMB = lambda: 0
+
+    def test_lru_eviction_under_budget(self):
+        self.registry.load("medium", default=True)  #1600MB estimated
+        self.registry.load("large")                 #3200MB
+        self.registry.load("medium")                #touch: large is now least recently used
+        self.registry.load("small")                 #4000MB, only large has to go
+        self.assertEqual(list(self.registry.entries), ["fstr-medium", "fstr-small"])
+        events = [(e["event"], e["model"]) for e in self.registry.stats()["events"]]
+        self.assertEqual(events[-2:], [("evicted", "fstr-large"), ("loaded", "fstr-small")])
+
+    def test_models_in_use_are_not_evicted(self):
+        with self.registry.acquire("large"):
+            self.registry.load("std-medium")
+            self.assertIn("fstr-large", self.registry.entries)
+
+    def test_resident_models_usable_during_a_load(self):
+        self.registry.load("medium", default=True)
+        started, release = Event(), Event()
+        def slowLoad(backend, size):
+            started.set()
+            release.wait(5)
+            return object()
+        self.registry._loadBackend = slowLoad
+        loads = [Thread(target=self.registry.load, args=("large",)) for _ in range(2)]
+        for thread in loads:
+            thread.start()
+        self.assertTrue(started.wait(5))
+        startTime = time.time()
+        with self.registry.acquire() as entry:
+            self.assertEqual(entry.key, "fstr-medium")
+        self.assertLess(time.time() - startTime, 1)
+        release.set()
+        for thread in loads:
+            thread.join(5)
+        #Both callers got the single load
+        self.assertEqual([e["event"] for e in self.registry.stats()["events"]].count("loaded"), 2)
+        self.assertEqual(list(self.registry.entries), ["fstr-medium", "fstr-large"])
+
+    def test_default_key(self):
+        self.registry.load("large", default=True)
+        self.assertEqual(self.registry.normalizeKey(None), "fstr-large")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import json
+import os
+
+#Latency/quality trade-offs selectable per request. Keys:
+# vad, demucs, compressor, markers: pipeline stages run when the audio needs them
+# cascade: Vietnamese candidate cascade (extra passes, Gladia fallback)
+# beam_size, patience, temperature: decoding parameters
+# model: model key used when the request does not name one (None: server default)
+PROFILES = {
+    "fast": {"vad": True, "demucs": False, "compressor": False, "markers": False, "cascade": False,
+             "beam_size": 1, "patience": 0, "temperature": 0, "model": None},
+    "balanced": {"vad": True, "demucs": True, "compressor": True, "markers": True, "cascade": True,
+                 "beam_size": 5, "patience": 0, "temperature": 0, "model": None},
+    "accurate": {"vad": True, "demucs": True, "compressor": True, "markers": True, "cascade": True,
+                 "beam_size": 5, "patience": 2, "temperature": 0, "model": "large"},
+}
+DEFAULT_PROFILE = os.environ.get("WHISPERHALLU_PROFILE", "balanced")
+#Optional JSON file adding profiles or overriding keys of the built-in ones
+PROFILES_PATH = os.environ.get("WHISPERHALLU_PROFILES")
+
+def loadProfiles(path=PROFILES_PATH):
+    """Built-in profiles updated from `path`; keys a new profile leaves out come from "balanced"."""
+    profiles = {name: dict(profile) for name, profile in PROFILES.items()}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for name, overrides in json.load(f).items():
+                unknown = set(overrides) - set(PROFILES["balanced"])
+                if unknown:
+                    raise ValueError("Unknown key(s) in profile "+name+": "+", ".join(sorted(unknown)))
+                profiles[name] = dict(profiles.get(name, PROFILES["balanced"]), **overrides)
+    return profiles
+
+profiles = loadProfiles()
+
+def getProfile(name=None):
+    """(name, settings) of a profile, the default one when `name` is empty.
+
+    A dict is taken as overrides of the default profile ("custom"), e.g. for evaluation variants.
+    """
+    if isinstance(name, dict):
+        unknown = set(name) - set(PROFILES["balanced"])
+        if unknown:
+            raise ValueError("Unknown profile key(s): "+", ".join(sorted(unknown)))
+        return "custom", dict(getProfile()[1], **name)
+    name = (name or DEFAULT_PROFILE).strip().lower()
+    if name not in profiles:
+        raise ValueError("Unknown profile: "+name+" (available: "+", ".join(sorted(profiles))+")")
+    return name, profiles[name]
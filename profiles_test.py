@@ -0,0 +1,38 @@
+import json
+import os
+import tempfile
+import unittest
+
+from profiles import PROFILES, getProfile, loadProfiles
+
+class TestProfiles(unittest.TestCase):
+    def test_builtin_profiles(self):
+        self.assertEqual(getProfile()[0], "balanced")
+        name, fast = getProfile(" Fast ")
+        self.assertEqual(name, "fast")
+        self.assertFalse(fast["demucs"])
+        self.assertEqual(fast["beam_size"], 1)
+        self.assertEqual(getProfile("accurate")[1]["model"], "large")
+        with self.assertRaises(ValueError):
+            getProfile("turbo")
+        self.assertEqual(getProfile({"markers": False}), ("custom", dict(PROFILES["balanced"], markers=False)))
+        with self.assertRaises(ValueError):
+            getProfile({"beam": 3})
+
+    def test_file_overrides_and_adds(self):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"fast": {"model": "small"}, "karaoke": {"vad": False, "patience": 1}}, f)
+        self.addCleanup(os.unlink, path)
+        profiles = loadProfiles(path)
+        self.assertEqual(profiles["fast"], dict(PROFILES["fast"], model="small"))
+        self.assertEqual(profiles["karaoke"], dict(PROFILES["balanced"], vad=False, patience=1))
+        self.assertIsNone(PROFILES["fast"]["model"])
+
+        with open(path, "w") as f:
+            json.dump({"fast": {"beam": 3}}, f)
+        with self.assertRaises(ValueError):
+            loadProfiles(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from audio_format import sniffBytes
+from metrics import metrics
+import tracing
+
+#demucs_server /predict endpoint; empty runs Demucs in this process
+DEMUCS_URL = os.environ.get("WHISPERHALLU_DEMUCS_URL", "")
+#Separate locally when the remote server fails (loads the model on first use)
+DEMUCS_FALLBACK = os.environ.get("WHISPERHALLU_DEMUCS_FALLBACK", "1") == "1"
+DEMUCS_CONNECT_TIMEOUT = float(os.environ.get("WHISPERHALLU_DEMUCS_CONNECT_TIMEOUT", "5"))
+DEMUCS_READ_TIMEOUT = float(os.environ.get("WHISPERHALLU_DEMUCS_READ_TIMEOUT", "90"))
+
+class SeparationError(Exception):
+    pass
+
+class LocalSeparator:
+    """htdemucs in this process through demucsWrapper, loaded on first use."""
+    name = "local"
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.lock = Lock()
+
+    def load(self):
+        with self.lock:
+            if self.engine is None:
+                from demucsWrapper import load_demucs_engine
+                self.engine = load_demucs_engine()
+        return self.engine
+
+    def separate(self, pathIn, pathVocals, device="cpu", chunkSeconds=None):
+        """Write the vocals of `pathIn` to `pathVocals` and return it; chunkSeconds bounds memory on long files."""
+        from demucsWrapper import demucs_audio
+        startTime = time.time()
+        demucs_audio(pathIn=pathIn, model=self.load(), device=device, pathVocals=pathVocals, chunkSeconds=chunkSeconds)
+        if pathVocals != pathIn+".vocals.wav":
+            os.replace(pathIn+".vocals.wav", pathVocals)
+        metrics.observe("separation_seconds", time.time() - startTime, backend=self.name)
+        return pathVocals
+
+class RemoteSeparator:
+    """demucs_server over a pooled session, falling back to `fallback` when it fails."""
+    name = "remote"
+
+    def __init__(self, url, fallback=None, connectTimeout=DEMUCS_CONNECT_TIMEOUT, readTimeout=DEMUCS_READ_TIMEOUT, poolSize=4, session=None):
+        self.url = url
+        self.fallback = fallback
+        self.timeout = (connectTimeout, readTimeout)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    def request(self, pathIn):
+        with tracing.span("demucs_server", bytes=os.path.getsize(pathIn)) as args:
+            with open(pathIn, "rb") as f:
+                response = self.session.post(self.url, files={"content": (os.path.basename(pathIn), f, "audio/wav")}, timeout=self.timeout)
+            args.update(status=response.status_code, received=len(response.content))
+        if response.status_code != 200:
+            raise SeparationError(str(response.status_code)+" "+response.text[:200])
+        if sniffBytes(response.content)[0] != "wav":
+            raise SeparationError("answer is not a WAV file")
+        return response.content
+
+    def separate(self, pathIn, pathVocals, device="cpu", chunkSeconds=None):
+        """Write the vocals of `pathIn` to `pathVocals` and return it; chunkSeconds only applies to the fallback."""
+        startTime = time.time()
+        try:
+            content = self.request(pathIn)
+        except (requests.exceptions.RequestException, SeparationError) as e:
+            print("Warning: remote separation failed: "+str(e))
+            metrics.inc("separation_fallback_total", reason=type(e).__name__)
+            if self.fallback is None:
+                raise
+            return self.fallback.separate(pathIn, pathVocals, device, chunkSeconds)
+        with open(pathVocals, "wb") as f:
+            f.write(content)
+        metrics.observe("separation_seconds", time.time() - startTime, backend=self.name)
+        return pathVocals
+
+def makeSeparator(url=DEMUCS_URL, fallback=DEMUCS_FALLBACK):
+    """Remote separator when a demucs_server URL is configured, else the in-process one."""
+    if url:
+        print("Using Demucs server "+url+(" with local fallback" if fallback else ""))
+        return RemoteSeparator(url, LocalSeparator() if fallback else None)
+    local = LocalSeparator()
+    local.load()
+    return local
@@ -0,0 +1,151 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from threading import Lock
+
+import torch
+
+from cpu_tuning import hostCores
+from demucs_batching import segmentLength, separateBatch
+from metrics import metrics
+
+#eager, torchscript or onnx; exported engines fall back to eager if the self-check fails
+DEMUCS_ENGINE = os.environ.get("WHISPERHALLU_DEMUCS_ENGINE", "eager")
+#Intra-op threads while separating, 0 uses every core on CPU
+DEMUCS_THREADS = int(os.environ.get("WHISPERHALLU_DEMUCS_THREADS", "0"))
+#Largest vocals difference allowed against eager, relative to the eager peak
+SELF_CHECK_TOLERANCE = float(os.environ.get("WHISPERHALLU_DEMUCS_TOLERANCE", "1e-3"))
+EXPORT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "whisperhallu")
+
+#torch.set_num_threads is process-wide: overlapping budgets share one setting, restored by the last to leave
+budgetLock = Lock()
+budgetUsers = 0
+budgetPrevious = None
+
+@contextmanager
+def threadBudget(threads):
+    """Run the block with `threads` intra-op threads, then restore the process setting.
+
+    Safe across threads: while budgets overlap the first one's setting holds, and the
+    previous setting comes back when the last of them ends.
+    """
+    global budgetUsers, budgetPrevious
+    if not threads:
+        yield
+        return
+    with budgetLock:
+        if budgetUsers == 0:
+            budgetPrevious = torch.get_num_threads()
+            if threads != budgetPrevious:
+                torch.set_num_threads(threads)
+        budgetUsers += 1
+    try:
+        yield
+    finally:
+        with budgetLock:
+            budgetUsers -= 1
+            if budgetUsers == 0 and torch.get_num_threads() != budgetPrevious:
+                torch.set_num_threads(budgetPrevious)
+
+def coreModel(model):
+    """The network behind a single-model bag (htdemucs), or the model itself; None for real ensembles."""
+    models = getattr(model, "models", None)
+    if models is None:
+        return model
+    return models[0] if len(models) == 1 else None
+
+def eagerForward(model, device):
+    core = coreModel(model)
+    if core is None:
+        from demucs.apply import apply_model
+        return lambda batch: apply_model(model, batch, shifts=0, split=False, device=device)
+    core.to(device).eval()
+    #Segments are exactly the training length, so apply_model would only call the network
+    return lambda batch: core(batch.to(device))
+
+def traceForward(core, example, device, threads):
+    traced = torch.jit.freeze(torch.jit.trace(core.to(device).eval(), example.to(device), check_trace=False))
+    return lambda batch: traced(batch.to(device))
+
+def onnxForward(core, example, device, threads, exportDir=EXPORT_DIR):
+    import onnxruntime
+    os.makedirs(exportDir, exist_ok=True)
+    path = os.path.join(exportDir, type(core).__name__+"-"+str(example.shape[-1])+".onnx")
+    if not os.path.exists(path):
+        fd, tmpPath = tempfile.mkstemp(suffix=".onnx", dir=exportDir)
+        os.close(fd)
+        torch.onnx.export(core.cpu().eval(), example.cpu(), tmpPath, input_names=["mix"], output_names=["sources"],
+                          dynamic_axes={"mix": {0: "batch"}, "sources": {0: "batch"}}, opset_version=17)
+        os.replace(tmpPath, path)
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    return lambda batch: torch.from_numpy(session.run(None, {"mix": batch.cpu().numpy()})[0])
+
+#Exported graph engines: fn(core model, example batch, device, threads) -> forward
+ENGINES = {"torchscript": traceForward, "onnx": onnxForward}
+
+class SeparationEngine:
+    """Demucs forward passes on fixed-length segments, in eager PyTorch or through an exported graph.
+
+    Every pass runs under inference_mode with the engine's own thread budget,
+    whatever torch.set_num_threads the rest of the process uses.
+    """
+
+    def __init__(self, model, engine=DEMUCS_ENGINE, threads=DEMUCS_THREADS, device="cpu", tolerance=SELF_CHECK_TOLERANCE):
+        self.model = model
+        self.device = torch.device(device)
+        self.threads = threads or (hostCores() if self.device.type == "cpu" else 0)
+        self.vocalsIdx = model.sources.index("vocals")
+        self.eager = eagerForward(model, self.device)
+        self.engine = "eager"
+        self.run = self.eager
+        if engine != "eager":
+            self.load(engine, tolerance)
+        print("DEMUCS ENGINE: "+self.engine+" on "+str(self.device)+" with "+str(self.threads or torch.get_num_threads())+" thread(s)", flush=True)
+
+    def example(self, batchSize=2):
+        generator = torch.Generator().manual_seed(0)
+        return torch.randn(batchSize, self.model.audio_channels, segmentLength(self.model), generator=generator) * 0.1
+
+    def load(self, engine, tolerance):
+        """Switch to an exported engine if it builds and its vocals match eager within `tolerance`."""
+        try:
+            core = coreModel(self.model)
+            if core is None:
+                raise ValueError("can't export an ensemble of "+str(len(self.model.models))+" models")
+            #Tracing and export record autograd-free ops, inference tensors are not allowed there
+            with threadBudget(self.threads), torch.no_grad():
+                forward = ENGINES[engine](core, self.example(1), self.device, self.threads)
+            error = self.selfCheck(forward)
+            if error > tolerance:
+                raise ValueError("vocals differ from eager by "+format(error, ".2e")+" (tolerance "+format(tolerance, ".0e")+")")
+        except Exception as e:
+            print("Warning: DEMUCS ENGINE "+engine+" unavailable, using eager")
+            print(e)
+            metrics.inc("demucs_engine_fallback_total", engine=engine)
+            return False
+        self.engine = engine
+        self.run = forward
+        return True
+
+    def selfCheck(self, forward):
+        """Largest vocals difference between `forward` and eager on a fixed batch, relative to the eager peak."""
+        example = self.example()
+        with threadBudget(self.threads), torch.inference_mode():
+            expected = self.eager(example)[:, self.vocalsIdx].float().cpu()
+            actual = forward(example)[:, self.vocalsIdx].float().cpu()
+        error = ((expected - actual).abs().max() / expected.abs().max().clamp_min(1e-8)).item()
+        print("DEMUCS ENGINE: self-check max relative error "+format(error, ".2e"), flush=True)
+        return error
+
+    def forward(self, batch):
+        with threadBudget(self.threads), torch.inference_mode():
+            return self.run(batch)
+
+    def separate(self, wavs):
+        """One (sources, channels, samples) tensor per (channels, samples) input at the model rate."""
+        #Packing and the overlap-add of the outputs too, not only the forward passes
+        with threadBudget(self.threads), torch.inference_mode():
+            return separateBatch(self.model, wavs, self.forward)
@@ -0,0 +1,69 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import torch
+
+import metrics
+from separation_engine import ENGINES, SeparationEngine, threadBudget
+
+class FakeDemucs(torch.nn.Module):
+    """Tiny stand-in for HTDemucs: 1 s segments at 100 Hz, four sources from one convolution."""
+    samplerate = 100
+    segment = 1
+    audio_channels = 2
+    sources = ["drums", "bass", "other", "vocals"]
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv1d(2, 8, 5, padding=2)
+
+    def forward(self, mix):
+        out = torch.tanh(self.conv(mix))
+        return out.view(mix.shape[0], 4, 2, mix.shape[-1])
+
+class TestSeparationEngine(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_thread_budget_is_restored(self):
+        previous = torch.get_num_threads()
+        with threadBudget(previous + 1):
+            self.assertEqual(torch.get_num_threads(), previous + 1)
+        self.assertEqual(torch.get_num_threads(), previous)
+
+    def test_overlapping_thread_budgets(self):
+        previous = torch.get_num_threads()
+        first, second = threadBudget(previous + 1), threadBudget(previous + 1)
+        first.__enter__()
+        second.__enter__()
+        #The first to finish must not restore the setting under the other one
+        first.__exit__(None, None, None)
+        self.assertEqual(torch.get_num_threads(), previous + 1)
+        second.__exit__(None, None, None)
+        self.assertEqual(torch.get_num_threads(), previous)
+
+    def test_eager_separates_under_inference_mode(self):
+        engine = SeparationEngine(FakeDemucs(), engine="eager", threads=2)
+        sources = engine.separate([torch.randn(2, 250), torch.randn(2, 30)])
+        self.assertEqual([tuple(s.shape) for s in sources], [(4, 2, 250), (4, 2, 30)])
+        self.assertTrue(sources[0].is_inference())
+
+    def test_torchscript_passes_the_self_check(self):
+        engine = SeparationEngine(FakeDemucs(), engine="torchscript", threads=2)
+        self.assertEqual(engine.engine, "torchscript")
+        self.assertLess(engine.selfCheck(engine.run), 1e-5)
+
+    def test_mismatching_engine_falls_back_to_eager(self):
+        broken = lambda core, example, device, threads: (lambda batch: core(batch) * 1.1)
+        with patch.dict(ENGINES, {"broken": broken}):
+            engine = SeparationEngine(FakeDemucs(), engine="broken", threads=2)
+        self.assertEqual(engine.engine, "eager")
+        self.assertEqual(engine.run, engine.eager)
+        self.assertEqual(metrics.metrics.counters["demucs_engine_fallback_total{engine=broken}"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
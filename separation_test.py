@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import requests
+
+import metrics
+from fake_demucs_server import FakeDemucsServer
+from separation import RemoteSeparator, SeparationError
+
+class FakeLocal:
+    name = "local"
+
+    def __init__(self):
+        self.calls = []
+
+    def separate(self, pathIn, pathVocals, device="cpu", chunkSeconds=None):
+        self.calls.append((pathIn, device))
+        shutil.copy(pathIn, pathVocals)
+        return pathVocals
+
+class TestSeparation(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pathIn = "markers/WOK-MRK-en.wav"
+        self.pathVocals = os.path.join(tempfile.mkdtemp(), "vocals.wav")
+        with open(self.pathIn, "rb") as f:
+            self.audio = f.read()
+
+    def test_remote_separation(self):
+        local = FakeLocal()
+        with FakeDemucsServer() as server:
+            separator = RemoteSeparator(server.url, fallback=local)
+            for _ in range(2):
+                self.assertEqual(separator.separate(self.pathIn, self.pathVocals), self.pathVocals)
+            separator.close()
+        with open(self.pathVocals, "rb") as f:
+            self.assertEqual(f.read(), self.audio)
+        self.assertEqual(server.uploads, ["WOK-MRK-en.wav"] * 2)
+        self.assertEqual(local.calls, [])
+        self.assertEqual(metrics.metrics.summaries["separation_seconds{backend=remote}"]["count"], 2)
+
+    def test_server_error_falls_back(self):
+        local = FakeLocal()
+        with FakeDemucsServer(failFirst=1) as server:
+            RemoteSeparator(server.url, fallback=local).separate(self.pathIn, self.pathVocals, "cuda:0")
+        self.assertEqual(local.calls, [(self.pathIn, "cuda:0")])
+        self.assertEqual(metrics.metrics.counters["separation_fallback_total{reason=SeparationError}"], 1)
+
+    def test_timeout_falls_back(self):
+        local = FakeLocal()
+        with FakeDemucsServer(delay=1.0) as server:
+            RemoteSeparator(server.url, fallback=local, readTimeout=0.2).separate(self.pathIn, self.pathVocals)
+        self.assertEqual(len(local.calls), 1)
+        self.assertEqual(metrics.metrics.counters["separation_fallback_total{reason=ReadTimeout}"], 1)
+
+    def test_unreachable_without_fallback_raises(self):
+        server = FakeDemucsServer()
+        url = server.url
+        server.httpd.server_close()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            RemoteSeparator(url, connectTimeout=0.5).separate(self.pathIn, self.pathVocals)
+        with FakeDemucsServer(failFirst=1) as server:
+            with self.assertRaises(SeparationError):
+                RemoteSeparator(server.url).separate(self.pathIn, self.pathVocals)
+
+if __name__ == '__main__':
+    unittest.main()
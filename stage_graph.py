@@ -0,0 +1,110 @@
+import contextvars
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import metrics
+import tracing
+
+#Stages of one request allowed to run at the same time
+STAGE_WORKERS = int(os.environ.get("WHISPERHALLU_STAGE_WORKERS", "4"))
+
+class Stage:
+    """A named step: fn(**inputs) returns its single output, or a tuple for several outputs."""
+
+    def __init__(self, name, fn, inputs=(), outputs=()):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def __repr__(self):
+        return "Stage("+self.name+": "+", ".join(self.inputs)+" -> "+", ".join(self.outputs)+")"
+
+class StageGraph:
+    """Stages wired by the names of the values they read and produce.
+
+    run() only executes the stages some target depends on and that have not
+    produced their outputs yet, so it can be called again later for values
+    needed only on some paths. Stages whose inputs are ready run concurrently
+    on a thread pool; each one is timed into `timings` and stage_seconds{stage}.
+    """
+
+    def __init__(self, stages, workers=STAGE_WORKERS, values=None):
+        self.stages = {}
+        self.producers = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError("Duplicate stage: "+stage.name)
+            self.stages[stage.name] = stage
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError("Value "+output+" produced by both "+self.producers[output]+" and "+stage.name)
+                self.producers[output] = stage.name
+        self.workers = workers
+        self.values = dict(values or {})
+        self.timings = {}
+
+    def plan(self, targets):
+        """Stages to run for `targets`, dependencies first."""
+        order = []
+        visiting = set()
+        def visit(value):
+            if value in self.values:
+                return
+            name = self.producers.get(value)
+            if name is None:
+                raise ValueError("No stage produces "+value)
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError("Cycle through stage "+name)
+            visiting.add(name)
+            for inp in self.stages[name].inputs:
+                visit(inp)
+            visiting.discard(name)
+            order.append(name)
+        for target in targets:
+            visit(target)
+        return order
+
+    def skipped(self):
+        """Stages that have not run (yet)."""
+        return [name for name in self.stages if name not in self.timings]
+
+    def runStage(self, stage):
+        startTime = time.time()
+        with tracing.span("stage "+stage.name, inputs=", ".join(stage.inputs), outputs=", ".join(stage.outputs)):
+            result = stage.fn(**{inp: self.values[inp] for inp in stage.inputs})
+        elapsed = time.time() - startTime
+        self.timings[stage.name] = elapsed
+        metrics.observe("stage_seconds", elapsed, stage=stage.name)
+        print("STAGE "+stage.name+" T="+str(round(elapsed, 3)), flush=True)
+        return result
+
+    def store(self, stage, result):
+        if len(stage.outputs) == 1:
+            result = (result,)
+        if len(result) != len(stage.outputs):
+            raise ValueError("Stage "+stage.name+" returned "+str(len(result))+" values for "+", ".join(stage.outputs))
+        self.values.update(zip(stage.outputs, result))
+
+    def run(self, *targets):
+        """Values of `targets`, running the stages they need."""
+        pending = [self.stages[name] for name in self.plan(targets)]
+        if len(pending) == 1 or self.workers <= 1:
+            for stage in pending:
+                self.store(stage, self.runStage(stage))
+        elif pending:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                running = {}
+                while pending or running:
+                    for stage in [s for s in pending if all(inp in self.values for inp in s.inputs)]:
+                        pending.remove(stage)
+                        #Spans of pool threads go to the caller's request
+                        running[pool.submit(contextvars.copy_context().run, self.runStage, stage)] = stage
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        #Re-raises the stage's exception; the pool waits for the others
+                        self.store(running.pop(future), future.result())
+        return tuple(self.values[target] for target in targets) if len(targets) != 1 else self.values[targets[0]]
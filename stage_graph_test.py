@@ -0,0 +1,70 @@
+import tempfile
+import unittest
+from threading import Barrier
+from unittest.mock import patch
+
+import metrics
+from stage_graph import Stage, StageGraph
+
+class TestStageGraph(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def graph(self, runs, barrier=None):
+        def step(name, fn):
+            def run(**inputs):
+                runs.append(name)
+                if barrier is not None and name in ("cut", "remix"):
+                    #Both branches must be running at the same time to get past this
+                    barrier.wait(5)
+                return fn(**inputs)
+            return Stage(name, run, *STAGES[name])
+        fns = {
+            "decode": lambda source: (source+".wav", 12),
+            "separate": lambda wav: wav+".vocals",
+            "cut": lambda vocals: vocals+".cut",
+            "vad": lambda cut: (cut+".vad", 3.5),
+            "remix": lambda vocals, wav: vocals+".remix",
+        }
+        return StageGraph([step(name, fn) for name, fn in fns.items()], values={"source": "a"})
+
+    def test_runs_only_what_targets_need(self):
+        runs = []
+        graph = self.graph(runs)
+        self.assertEqual(graph.run("duration"), 12)
+        self.assertEqual(runs, ["decode"])
+        self.assertEqual(graph.run("clean", "speech_seconds"), ("a.wav.vocals.cut.vad", 3.5))
+        self.assertEqual(runs, ["decode", "separate", "cut", "vad"])
+        self.assertEqual(graph.skipped(), ["remix"])
+        self.assertEqual(set(graph.timings), {"decode", "separate", "cut", "vad"})
+        self.assertEqual(metrics.metrics.summaries["stage_seconds{stage=vad}"]["count"], 1)
+
+    def test_independent_branches_run_concurrently(self):
+        runs = []
+        graph = self.graph(runs, Barrier(2))
+        self.assertEqual(graph.run("cut", "remix"), ("a.wav.vocals.cut", "a.wav.vocals.remix"))
+        self.assertEqual(sorted(runs[2:]), ["cut", "remix"])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", lambda: 1, [], ["x"]), Stage("b", lambda: 2, [], ["x"])])
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", lambda y: 1, ["y"], ["x"])]).run("x")
+        def fail(x):
+            raise IOError("disk full")
+        graph = StageGraph([Stage("a", lambda: 1, [], ["x"]), Stage("b", fail, ["x"], ["y"]), Stage("c", lambda x: 3, ["x"], ["z"])])
+        with self.assertRaises(IOError):
+            graph.run("y", "z")
+
+STAGES = {
+    "decode": (["source"], ["wav", "duration"]),
+    "separate": (["wav"], ["vocals"]),
+    "cut": (["vocals"], ["cut"]),
+    "vad": (["cut"], ["clean", "speech_seconds"]),
+    "remix": (["vocals", "wav"], ["remix"]),
+}
+
+if __name__ == '__main__':
+    unittest.main()
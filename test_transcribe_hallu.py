@@ -1,37 +1,26 @@
 import unittest
-from unittest.mock import patch
 import json
+from fake_gladia_server import FakeGladiaServer
+from gladia_client import GladiaClient
 from transcribeHallu import transcribe_with_gladia
 
 class TestTranscribeWithGladia(unittest.TestCase):
 
-    @patch('transcribeHallu.requests.post')
-    @patch('transcribeHallu.requests.get')
-    def test_successful_transcription(self, mock_get, mock_post):
-        # Mock the API responses
-        mock_post.side_effect = [
-            unittest.mock.Mock(status_code=200, json=lambda: {"audio_url": "http://example.com/audio"}),
-            unittest.mock.Mock(status_code=200, json=lambda: {"result_url": "http://example.com/result"})
-        ]
-        mock_get.return_value = unittest.mock.Mock(status_code=200, json=lambda: {
-            "transcription": {"full_transcript": "Test transcript"},
-            "translation": {"full_transcript": "Test translation"},
-            "subtitles": {"srt": "1\n00:00:00,000 --> 00:00:05,000\nTest subtitle"}
-        })
-
-        result = transcribe_with_gladia("test.mp3", "en", "en")
+    def test_successful_transcription(self):
+        with FakeGladiaServer(pendingPolls=1) as server:
+            client = GladiaClient(baseUrl=server.url, apiKey="test-key", pollInitial=0.01, pollMax=0.05)
+            result = transcribe_with_gladia("markers/WOK-MRK-en.wav", "vi", "vi", client=client)
         result_dict = json.loads(result)
 
         self.assertIn("text", result_dict)
         self.assertIn("srt", result_dict)
         self.assertIn("json", result_dict)
-        self.assertEqual(result_dict["text"], "Test translation")
-
-    @patch('transcribeHallu.requests.post')
-    def test_upload_failure(self, mock_post):
-        mock_post.return_value = unittest.mock.Mock(status_code=400, text="Upload failed")
+        self.assertEqual(result_dict["text"], "Xin chào. Hôm nay trời đẹp.")
 
-        result = transcribe_with_gladia("test.mp3", "en", "en")
+    def test_upload_failure(self):
+        with FakeGladiaServer() as server:
+            client = GladiaClient(baseUrl=server.url, apiKey="wrong-key", retries=0)
+            result = transcribe_with_gladia("markers/WOK-MRK-en.wav", "en", "en", client=client)
         result_dict = json.loads(result)
 
         self.assertEqual(result_dict, {"text": "", "srt": "", "json": []})
@@ -40,4 +29,3 @@ class TestTranscribeWithGladia(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
-
@@ -0,0 +1,107 @@
+import contextvars
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+#Share of requests traced; requests can also ask for a trace with trace=true
+TRACE_RATE = float(os.environ.get("WHISPERHALLU_TRACE_RATE", "0"))
+#Where traces are written, one Chrome trace / Perfetto JSON file per request
+TRACE_DIR = os.environ.get("WHISPERHALLU_TRACE_DIR", os.path.join(tempfile.gettempdir(), "whisperhallu-traces"))
+
+#Request being processed by this thread or task, copied into stage and hedge threads
+currentRequest = contextvars.ContextVar("whisperhallu_request", default=None)
+
+def newRequestId():
+    return uuid.uuid4().hex[:16]
+
+def requestId():
+    request = currentRequest.get()
+    return request.id if request is not None else None
+
+class Trace:
+    """Spans of one request, as Chrome trace "complete" events (timestamps in microseconds)."""
+
+    def __init__(self, id, sampled):
+        self.id = id
+        self.sampled = sampled
+        self.events = []
+        self.lock = threading.Lock()
+        self.threads = {}
+
+    def add(self, name, start, end, args):
+        tid = threading.get_ident()
+        with self.lock:
+            self.threads.setdefault(tid, threading.current_thread().name)
+            self.events.append({"name": name, "ph": "X", "ts": int(start * 1e6), "dur": int((end - start) * 1e6),
+                                "pid": os.getpid(), "tid": tid, "args": args})
+
+    def write(self, traceDir=TRACE_DIR):
+        """Save to <traceDir>/<time>-<id>.json, open it in chrome://tracing or ui.perfetto.dev."""
+        with self.lock:
+            meta = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "request "+self.id}}]
+            meta += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                     for tid, name in self.threads.items()]
+            data = {"traceEvents": meta + self.events, "displayTimeUnit": "ms", "otherData": {"request_id": self.id}}
+        os.makedirs(traceDir, exist_ok=True)
+        path = os.path.join(traceDir, time.strftime("%Y%m%d-%H%M%S")+"-"+self.id+".json")
+        with open(path+".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path+".tmp", path)
+        return path
+
+@contextmanager
+def traced(id=None, force=False, rate=None, traceDir=None, write=True):
+    """Make `id` the current request; record its spans if forced or sampled at `rate`, and write them at the end.
+
+    With write=False the spans are only kept in the yielded Trace (eval_pipeline.py reads them).
+    """
+    rate = TRACE_RATE if rate is None else rate
+    trace = Trace(id or newRequestId(), force or (rate > 0 and random.random() < rate))
+    token = currentRequest.set(trace)
+    try:
+        yield trace
+    finally:
+        currentRequest.reset(token)
+        if trace.sampled and write:
+            try:
+                print("TRACE="+trace.write(traceDir or TRACE_DIR), flush=True)
+            except (OSError, TypeError, ValueError) as e:
+                print("Warning: can't write trace")
+                print(e)
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as a span of the current request; the yielded dict takes attributes known later."""
+    trace = currentRequest.get()
+    if trace is None or not trace.sampled:
+        yield {}
+        return
+    start = time.time()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__+": "+str(e)[:200]
+        raise
+    finally:
+        trace.add(name, start, time.time(), attrs)
+
+def pathVariant(path):
+    """Preprocessing step that produced `path`, e.g. "SILCUT" for x.WAV.wav.SILCUT.wav, else its extension."""
+    steps = re.findall(r"\.([A-Za-z0-9]+)\.wav", path or "")
+    return steps[-1] if steps else os.path.splitext(path or "")[1].lstrip(".")
+
+def system(aCmd, output=None, **attrs):
+    """os.system() recorded as a span named after the program, with the output file and its size."""
+    with span(aCmd.split(" ", 1)[0], cmd=aCmd[:500], **attrs) as args:
+        status = os.system(aCmd)
+        args["status"] = status
+        if output is not None:
+            args["output"] = pathVariant(output)
+            args["bytes"] = os.path.getsize(output) if os.path.exists(output) else 0
+        return status
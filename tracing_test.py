@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+
+import tracing
+from stage_graph import Stage, StageGraph
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.traceDir = tempfile.mkdtemp()
+
+    def load(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def test_spans_across_stage_threads(self):
+        out = os.path.join(tempfile.mkdtemp(), "a.SILCUT.wav")
+        def cut():
+            tracing.system("printf abc > "+out, out)
+            return out
+        with tracing.traced("req1", force=True, traceDir=self.traceDir) as trace:
+            self.assertEqual(tracing.requestId(), "req1")
+            with tracing.span("transcribeOpts", outputs="text") as args:
+                graph = StageGraph([Stage("cut", cut, [], ["cut"]), Stage("other", lambda: 1, [], ["other"])])
+                graph.run("cut", "other")
+                args["extra"] = 1
+        self.assertIsNone(tracing.requestId())
+        path = os.path.join(self.traceDir, os.listdir(self.traceDir)[0])
+        self.assertTrue(path.endswith("-req1.json"))
+        events = {e["name"]: e for e in self.load(path)["traceEvents"] if e["ph"] == "X"}
+        self.assertEqual(set(events), {"transcribeOpts", "stage cut", "stage other", "printf"})
+        self.assertEqual(events["transcribeOpts"]["args"], {"outputs": "text", "extra": 1})
+        self.assertEqual((events["printf"]["args"]["output"], events["printf"]["args"]["bytes"]), ("SILCUT", 3))
+        #Stage threads differ from the request thread but stay inside its span
+        self.assertNotEqual(events["stage cut"]["tid"], events["transcribeOpts"]["tid"])
+        self.assertGreaterEqual(events["stage cut"]["ts"], events["transcribeOpts"]["ts"])
+        self.assertEqual(trace.id, "req1")
+
+    def test_errors_and_sampling(self):
+        with tracing.traced(force=True, traceDir=self.traceDir):
+            with self.assertRaises(IOError):
+                with tracing.span("gladia"):
+                    raise IOError("timeout")
+        events = self.load(os.path.join(self.traceDir, os.listdir(self.traceDir)[0]))["traceEvents"]
+        self.assertEqual([e["args"]["error"] for e in events if e["ph"] == "X"], ["OSError: timeout"])
+        otherDir = tempfile.mkdtemp()
+        with tracing.traced("req2", rate=0, traceDir=otherDir) as trace:
+            #Not sampled: request id only, spans are no-ops
+            self.assertEqual(tracing.requestId(), "req2")
+            with tracing.span("inference") as args:
+                args["chars"] = 3
+        self.assertFalse(trace.events)
+        self.assertEqual(os.listdir(otherDir), [])
+
+    def test_path_variant(self):
+        self.assertEqual(tracing.pathVariant("/tmp/x.mp3.WAV.wav.vocals.wav.SILCUT.wav"), "SILCUT")
+        self.assertEqual(tracing.pathVariant("/tmp/x.mp3.WAV.wav"), "WAV")
+        self.assertEqual(tracing.pathVariant("/tmp/x.mp3"), "mp3")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,8 @@ import time
 import re
 from _io import StringIO
 import json
-from json_util import split_transcription, convert_gladia_to_internal_format
+from gladia_client import GLADIA_API_KEY, GladiaClient, GladiaHedge
+from transcription_result import TranscriptionResult, TIMED_OUTPUTS, formatTimeStamp
 
 if sys.version_info.major == 3 and sys.version_info.minor >= 10:
     print("Python >= 3.10")
@@ -19,7 +20,8 @@ import traceback
 
 import torch
 
-torch.set_num_threads(1)
+#Intra-op threads for torch stages (VAD, Demucs); the Whisper backend has its own threads
+torch.set_num_threads(int(os.environ.get("WHISPERHALLU_TORCH_THREADS", "1")))
 useSileroVAD=True
 if(useSileroVAD):
     modelVAD, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad',
@@ -42,10 +44,11 @@ if(useSpleeter):
 
 useDemucs=True
 if(useDemucs):
-    from demucsWrapper import load_demucs_model
-    from demucsWrapper import demucs_audio
+    from separation import makeSeparator
     print("Using Demucs")
-    modelDemucs = load_demucs_model()
+    #demucs_server when WHISPERHALLU_DEMUCS_URL is set, else in process with its own
+    #thread budget (WHISPERHALLU_DEMUCS_THREADS), not the torch threads set above
+    vocalSeparator = makeSeparator()
 
 useCompressor=True
 
@@ -64,10 +67,6 @@ try:
     from faster_whisper import WhisperModel
     print("Using Faster Whisper")
     whisperFound = "FSTR"
-    modelPath = "whisper-medium-ct2/"#"whisper-medium-ct2/" "whisper-large-ct2/"
-    if not os.path.exists(modelPath):
-        print("Faster installation found, but "+modelPath+" model not found")
-        sys.exit(-1)
 except ImportError as e:
     pass
 
@@ -85,42 +84,88 @@ whisperLoaded = "??"
 beam_size=5
 patience=0
 temperature=0
-model = None
-device = "cuda" #cuda / cpu
-cudaIdx = 0
+device = "cuda" if torch.cuda.is_available() else "cpu" #cuda / cpu
+cudaIdx = "0"
+#CPU compute type for faster-whisper: int8 or int8_float32
+cpuComputeType = os.environ.get("WHISPERHALLU_CPU_COMPUTE_TYPE", "int8")
+#Gladia as the remote candidate of the Vietnamese cascade; 0 keeps everything local (offline evaluation)
+#Off without a GLADIA_API_KEY, every call would return an empty result
+useGladia = os.environ.get("WHISPERHALLU_GLADIA", "1") == "1" and GLADIA_API_KEY != ""
+#Start the Gladia fallback as soon as the Vietnamese cascade looks risky
+gladiaHedging = os.environ.get("WHISPERHALLU_GLADIA_HEDGE", "0") == "1"
 
 SAMPLING_RATE = 16000
 MAX_DURATION = 600
 TRUNC_DURATION = MAX_DURATION
+#Less speech (VAD) or vocals (separated stem) than this: empty result, no Whisper pass
+NO_SPEECH_SECONDS = float(os.environ.get("WHISPERHALLU_NO_SPEECH_SECONDS", "0.5"))
+#Hand-tuned stage settings, overridden per call by the evaluation harness (eval_pipeline.py)
+VAD_THRESHOLD = 0.5
+SILCUT_THRESHOLD = "-50dB"
+#Longer inputs skip the marker passes
+MARKS_MAX_DURATION = 30
 
 from threading import Lock, Thread
 lock = Lock()
 
-def loadModel(gpu: str,modelSize=None):
-    global model
+from model_registry import ModelRegistry
+from language_id import LanguageCache, audioHash, detectWithModel, EXCERPT_SECONDS, MIN_PROBABILITY
+from metrics import metrics
+from hallucination_index import HallucinationMonitor, indexFor
+from coalesce import InFlight, requestKey
+from audio_format import readyWavDuration, sniff
+from admission import probeDuration
+from memory_budget import MemoryScheduler, requestPlan
+from audio_classifier import classify, vocalActivity
+from profiles import getProfile
+import tracing
+from stage_graph import Stage, StageGraph
+
+#Detected language by audio hash, so retries and repeated uploads skip detection
+languageCache = LanguageCache()
+#Requests currently being transcribed, by content and options
+inFlight = InFlight()
+#Requests admitted while their estimated peak memory fits WHISPERHALLU_MEMORY_BUDGET_MB
+memoryScheduler = MemoryScheduler()
+
+#Models resident in this process, selected per request by key (e.g. "large", "std-medium", "sm4t")
+registry = None
+
+def loadModel(gpu: str,modelSize=None,budgetMB=None,aDevice=None,autotune=True,concurrency=1):
+    """Load the default model; other models are loaded on demand by the registry.
+
+    The default model is only held by the registry (registry.acquire()), so evicting it frees it.
+    `concurrency` is how many requests this process transcribes at once, for CPU auto-tuning.
+    """
     global device
     global cudaIdx
     global whisperLoaded
+    global registry
     cudaIdx = gpu
+    if(aDevice != None):
+        device = aDevice
+    if(modelSize == None):
+        modelSize="medium"#"tiny"#"medium" #"large"
+    if registry is None:
+        registry = ModelRegistry(defaultBackend=whisperFound, device=device, deviceIndex=int(gpu), budgetMB=budgetMB,
+                                 computeType="float16" if device == "cuda" else cpuComputeType,# float16 int8_float16 int8 int8_float32
+                                 whisperVersion=whisperVersion, beam_size=beam_size, patience=patience, temperature=temperature)
+        #Converted models live in WHISPERHALLU_MODEL_DIR, checked for the default one only
+        modelPath = os.path.join(registry.modelDir, "whisper-"+modelSize+"-ct2/")
+        if whisperFound == "FSTR" and not os.path.exists(modelPath):
+            print("Faster installation found, but "+modelPath+" model not found")
+            sys.exit(-1)
+        if(device == "cpu" and whisperFound == "FSTR" and autotune):
+            from cpu_tuning import autotune as tuneCPU
+            try:
+                tuned = tuneCPU(modelPath, computeType=registry.computeType, concurrency=concurrency)
+                registry.cpuThreads = tuned["cpu_threads"]
+                registry.numWorkers = tuned["num_workers"]
+            except Exception as e:
+                print("Warning: CPU auto-tuning failed, using defaults")
+                print(e)
     try:
-        if whisperFound == "FSTR":
-            if(modelSize == "large"):
-                modelPath = "whisper-large-ct2/"
-            else:
-                modelPath = "whisper-medium-ct2/"
-            print("LOADING: "+modelPath+" GPU: "+gpu+" BS: "+str(beam_size)+" PTC="+str(patience)+" TEMP="+str(temperature))
-            compute_type="float16"# float16 int8_float16 int8
-            model = WhisperModel(modelPath, device=device,device_index=int(gpu), compute_type=compute_type)
-        elif whisperFound == "STD":
-            if(modelSize == None):
-                modelSize="medium"#"tiny"#"medium" #"large"
-            if(modelSize == "large"):
-                modelSize = "large"+whisperVersion #"large-v1" "large-v2" "large-v3"
-            print("LOADING: "+modelSize+" GPU:"+gpu+" BS: "+str(beam_size)+" PTC="+str(patience)+" TEMP="+str(temperature))
-            model = whisper.load_model(modelSize,device=torch.device("cuda:"+gpu)) #May be "cpu"
-        elif whisperFound == "SM4T":
-            print("LOADING: "+"seamlessM4T_large"+" GPU:"+gpu)
-            model = Translator("seamlessM4T_large", "vocoder_36langs", torch.device("cuda:"+gpu), torch.float16)
+        entry = registry.load(whisperFound.lower()+"-"+modelSize, default=True)
         print("LOADED")
         whisperLoaded = modelSize
     except Exception as e:
@@ -131,6 +176,31 @@ def loadModel(gpu: str,modelSize=None):
 def loadedModel():
     return whisperFound+" "+whisperLoaded
 
+def warmUpSteps(path: str):
+    """(stage, fn) pairs pushing the clip at `path` through every enabled stage, for warmup.Readiness."""
+    def ffmpeg():
+        pathWAV = path+".WAV"+".wav"
+        aCmd = "ffmpeg -y"+" -i \""+path+"\""+" -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathWAV+"\" > \""+pathWAV+".log\" 2>&1"
+        if tracing.system(aCmd, pathWAV) != 0:
+            raise IOError("ffmpeg failed, see "+pathWAV+".log")
+    def vad():
+        get_speech_timestamps(read_audio(path, sampling_rate=SAMPLING_RATE), modelVAD, sampling_rate=SAMPLING_RATE)
+    def demucs():
+        vocalSeparator.separate(path, path+".vocals.wav", device="cuda:"+str(cudaIdx) if device == "cuda" else "cpu")
+    def whisper():
+        #Every resident model, the default first
+        with registry.lock:
+            keys = [k for k in registry.entries if k != registry.defaultKey]
+        for key in [None]+keys:
+            transcribeMARK(path, dict(language="en", initial_prompt=""), mode=3, lngInput="en", modelKey=key)
+    steps = [("ffmpeg", ffmpeg), ("classify", lambda: classify(path))]
+    if(useSileroVAD):
+        steps.append(("vad", vad))
+    if(useDemucs):
+        steps.append(("demucs", demucs))
+    steps.append(("whisper", whisper))
+    return steps
+
 def getDuration(aLog:str):
     duration = None
     time = None
@@ -150,12 +220,6 @@ def getDuration(aLog:str):
         return sum(x * int(t) for x, t in zip([3600, 60, 1], time.split(":")))
     return None
 
-def formatTimeStamp(aT=0):
-    aH = int(aT/3600)
-    aM = int((aT%3600)/60)
-    aS = (aT%60)
-    return "%02d:%02d:%06.3f" % (aH,aM,aS)
-
 def getPrompt(lng:str):
     if(lng == "en"):
         aOk=""
@@ -193,13 +257,44 @@ def getPrompt(lng:str):
     #Not Already defined?
     return ""
 
-def transcribePrompt(path: str, lng: str, prompt=None, lngInput=None, isMusic=False, addSRT=False, truncDuration=TRUNC_DURATION, maxDuration=MAX_DURATION):
-    """Whisper transcribe with language detection and Gladia API for non-English."""
-
+def transcribePrompt(path: str, lng: str, prompt=None, lngInput=None, isMusic=False, addSRT=False, truncDuration=TRUNC_DURATION, maxDuration=MAX_DURATION, outputs=None, modelKey=None, profile=None, requestId=None, trace=False):
+    """Whisper transcribe with language detection and Gladia API for non-English.
+
+    Identical requests (same audio content and options) running at the same
+    time share a single run and receive the same result.
+    The request is traced (tracing.py) when `trace` is set or it is sampled.
+    """
+    with tracing.traced(requestId, force=trace) as request:
+        print("REQUEST="+request.id, flush=True)
+        key = requestKey(audioHash(path), lng=lng, prompt=prompt, lngInput=lngInput, isMusic=isMusic, addSRT=addSRT,
+                         truncDuration=truncDuration, maxDuration=maxDuration, outputs=outputs,
+                         modelKey=registry.normalizeKey(modelKey) if registry is not None else modelKey, profile=getProfile(profile)[0])
+        with tracing.span("transcribePrompt", lng=lng, lng_input=lngInput, music=isMusic, model=modelKey, profile=getProfile(profile)[0]):
+            return inFlight.run(key, transcribePromptOnce, path, lng, prompt, lngInput, isMusic, addSRT, truncDuration, maxDuration, outputs, modelKey, profile)
+
+def memoryPlan(path: str, isMusic=False, truncDuration=TRUNC_DURATION, profile=None):
+    """Estimated peak MB of transcribing `path`, and with chunked separation (None if that doesn't help)."""
+    profile = getProfile(profile)[1]
+    channels = sniff(path)[2] or 2
+    duration = min(probeDuration(path), float(truncDuration))
+    localSeparation = useDemucs and profile["demucs"] and vocalSeparator.name == "local"
+    return requestPlan(duration, channels, isMusic, localSeparation=localSeparation, vad=useSileroVAD and profile["vad"])
+
+def transcribePromptOnce(path: str, lng: str, prompt=None, lngInput=None, isMusic=False, addSRT=False, truncDuration=TRUNC_DURATION, maxDuration=MAX_DURATION, outputs=None, modelKey=None, profile=None):
     if lngInput is None:
         lngInput = lng
         print("Using output language as input language: " + lngInput)
     
+    if lngInput == "auto" or lng == "auto":
+        detected = detectLanguage(path, modelKey=modelKey, fallback=lng if lng != "auto" else "en")
+        if lngInput == "auto":
+            lngInput = detected
+        if lng == "auto":
+            #Transcribe in the spoken language
+            lng = detected
+        if prompt is None:
+            prompt = getPrompt(lng)
+    
     if prompt is None:
         if not isMusic:
             prompt = getPrompt(lng)
@@ -212,276 +307,477 @@ def transcribePrompt(path: str, lng: str, prompt=None, lngInput=None, isMusic=Fa
     print("LNG=" + lng, flush=True)
     print("PROMPT=" + prompt, flush=True)
     
-    opts = dict(language=lng, initial_prompt=prompt, word_timestamps=True)
-    return transcribeOpts(path, opts, lngInput, isMusic=isMusic, addSRT=addSRT, subEnd=truncDuration, maxDuration=maxDuration)
-
-def count_weird_words(text):
-    return text.count("Hãy đăng ký kênh") + text.count("subscribe cho")
-
-def transcribeOpts(path: str, opts: dict, lngInput=None, isMusic=False, onlySRT=False, addSRT=False, subBeg="0", subEnd=str(TRUNC_DURATION), maxDuration=MAX_DURATION, stretch=None, nbRun=1, remixFactor="0.3", speechnorm=True, max_line_width=80, max_line_count=2):
-    pathIn = path
-    pathClean = path
-    pathNoCut = path
-    
+    opts = dict(language=lng, initial_prompt=prompt)
+    #Queued, or separated in chunks, while concurrent requests would go over the worker's memory budget
+    with memoryScheduler.reserve(*memoryPlan(path, isMusic, truncDuration, profile)) as grant, \
+         tracing.span("transcribeOpts", outputs=",".join(sorted(planOutputs(outputs))), memory_mb=int(grant.estimateMB), chunk=grant.chunkSeconds):
+        return transcribeOpts(path, opts, lngInput, isMusic=isMusic, addSRT=addSRT, subEnd=truncDuration, maxDuration=maxDuration, outputs=outputs, modelKey=modelKey, profile=profile,
+                              separationChunk=grant.chunkSeconds)
+
+def detectLanguage(path: str, modelKey=None, fallback="en", excerptSeconds=EXCERPT_SECONDS):
+    """Spoken language of path, detected on a short speech excerpt and cached by audio hash."""
+    aHash = audioHash(path)
+    cached = languageCache.get(aHash)
+    if cached is not None:
+        language, probability = cached
+        print("LANGUAGE (cached)="+str(language)+" P="+str(probability), flush=True)
+        metrics.inc("language_detect_cache_hits_total")
+    else:
+        startTime = time.time()
+        language, probability = None, 0
+        try:
+            #Speech excerpt from the first minutes, at the rate Whisper consumes
+            pathLID = path+".LID.wav"
+            aCmd = "ffmpeg -y -i \""+path+"\""+" -t "+str(4*excerptSeconds)+" -ac 1 -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathLID+"\" > \""+pathLID+".log\" 2>&1"
+            print("CMD: "+aCmd)
+            tracing.system(aCmd, pathLID)
+            if(useSileroVAD):
+                wav = read_audio(pathLID, sampling_rate=SAMPLING_RATE)
+                speech_timestamps = get_speech_timestamps(wav, modelVAD, threshold=0.5, sampling_rate=SAMPLING_RATE)
+                if(len(speech_timestamps) > 0):
+                    wav = collect_chunks(speech_timestamps, wav)
+                save_audio(pathLID, wav[:excerptSeconds*SAMPLING_RATE], sampling_rate=SAMPLING_RATE)
+            with registry.acquire(modelKey) as entry:
+                with (lock if registry.device == "cuda" else entry.slots):
+                    language, probability = detectWithModel(entry, pathLID)
+            languageCache.put(aHash, (language, probability))
+            metrics.inc("language_detect_total", language=language)
+            metrics.observe("language_detect_seconds", time.time()-startTime)
+        except Exception as e:
+            print("Warning: can't detect language")
+            print(e)
+        print("T=",(time.time()-startTime))
+        print("LANGUAGE="+str(language)+" P="+str(probability), flush=True)
+    if language is None or probability < MIN_PROBABILITY:
+        print("Using fallback language: "+fallback)
+        metrics.inc("language_detect_fallback_total")
+        return fallback
+    return language
+
+def planOutputs(outputs=None, onlySRT=False, addSRT=False):
+    """Requested outputs, or the legacy onlySRT/addSRT flags mapped onto them."""
+    if outputs is not None:
+        return frozenset(outputs)
+    if(onlySRT):
+        return frozenset(("srt", "json", "words"))
+    if(addSRT):
+        return frozenset(("text", "srt", "json", "words"))
+    return frozenset(("text",))
+
+def count_weird_words(text, language=None):
+    return indexFor(language).count(text)
+
+def weirdCount(result, language=None):
+    """Hallucinated phrases in a pass; a pass aborted for them ranks below any complete pass."""
+    if result.aborted:
+        return float("inf")
+    return count_weird_words(result.text, language)
+
+def transcribeOpts(path: str, opts: dict, lngInput=None, isMusic=False, onlySRT=False, addSRT=False, subBeg="0", subEnd=str(TRUNC_DURATION), maxDuration=MAX_DURATION, stretch=None, nbRun=1, remixFactor="0.3", speechnorm=True, max_line_width=80, max_line_count=2, outputs=None, modelKey=None, profile=None, separationChunk=None, vadThreshold=VAD_THRESHOLD, silcutThreshold=SILCUT_THRESHOLD, marksMaxDuration=MARKS_MAX_DURATION):
+    outputs = planOutputs(outputs, onlySRT=onlySRT, addSRT=addSRT)
+    #Stages and decode parameters of the request profile, within what this process loaded
+    profileName, profile = getProfile(profile)
+    print("PROFILE="+profileName, flush=True)
+    useSeparation = useDemucs and profile["demucs"]
+    opts = dict(opts)
+    if("words" in outputs):
+        opts["word_timestamps"] = True
+    else:
+        #Word alignment is extra work on every pass, only pay for it on request
+        opts.pop("word_timestamps", None)
     initTime = time.time()
     
-    startTime = time.time()
-    duration = -1
-    try:
-        #Convert to WAV to avoid later possible decoding problem
-        pathWAV = pathIn+".WAV"+".wav"
-        aCmd = "ffmpeg -y"+" -i \""+pathIn+"\""+" -ss "+subBeg+" -to "+subEnd + " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathWAV+"\" > \""+pathWAV+".log\" 2>&1"
-        print("CMD: "+aCmd)
-        os.system(aCmd)
-        duration = getDuration(pathWAV+".log")
-        print("T=",(time.time()-startTime))
-        print("DURATION="+str(duration)+" subBeg="+str(subBeg)+" subEnd="+str(subEnd))
-        print("PATH="+pathWAV,flush=True)
-        pathIn = pathClean = pathWAV
-    except Exception as e:
-         print("Warning: can't convert to WAV")
-         print(e)
-
-    try:
-        if(stretch != None):
-            pathSTRETCH = pathIn+".STRETCH"+".wav"
-            #ffmpeg STRECH
-            aCmd = "ffmpeg -y -i \""+pathIn+"\""+" -t "+str(truncDuration) + " -filter:a \"atempo="+stretch+"\"" + " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathSTRETCH+"\" > \""+pathSTRETCH+".log\" 2>&1"
-            #sox STRECH
-            #aCmd = "sox \""+pathIn+"\""+" \""+pathSTRETCH+"\" tempo "+stretch+" > \""+pathSTRETCH+".log\" 2>&1"
-            #soundstretch STRECH
-            #aCmd = "soundstretch \""+pathIn+"\""+" \""+pathSTRETCH+"\" -tempo="+str(int(100*float(stretch)) - 100)+" > \""+pathSTRETCH+".log\" 2>&1"
-            #rubberband STRECH
-            #aCmd = "rubberband \""+pathIn+"\""+" \""+pathSTRETCH+"\" --tempo "+stretch+" > \""+pathSTRETCH+".log\" 2>&1"
+    #Preprocessing stages, each reading and producing named audio paths:
+    # source -decode-> wav -separate-> vocals (+separated, stems)
+    # vocals -silcut-> cut -vad-> clean, speech_seconds (speech)
+    # separated -norm-> norm -remix-> remix (music), separated -activity-> speech_seconds (music)
+    #Only the stages the requested outputs read are run, independent ones in parallel
+    def decode(source):
+        pathIn = source
+        duration = -1
+        startTime = time.time()
+        readyDuration = readyWavDuration(pathIn) if subBeg == "0" else None
+        if(readyDuration is not None and readyDuration <= float(subEnd)):
+            #Client pre-encoded 16 kHz mono PCM, nothing to trim: no conversion needed
+            duration = int(readyDuration)
+            print("PRE-ENCODED DURATION="+str(duration)+" PATH="+pathIn, flush=True)
+            metrics.inc("preencoded_inputs_total")
+        else:
+            try:
+                #Convert to WAV to avoid later possible decoding problem
+                pathWAV = pathIn+".WAV"+".wav"
+                aCmd = "ffmpeg -y"+" -i \""+pathIn+"\""+" -ss "+subBeg+" -to "+subEnd + " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathWAV+"\" > \""+pathWAV+".log\" 2>&1"
+                print("CMD: "+aCmd)
+                tracing.system(aCmd, pathWAV)
+                duration = getDuration(pathWAV+".log")
+                print("T=",(time.time()-startTime))
+                print("DURATION="+str(duration)+" subBeg="+str(subBeg)+" subEnd="+str(subEnd))
+                print("PATH="+pathWAV,flush=True)
+                pathIn = pathWAV
+            except Exception as e:
+                 print("Warning: can't convert to WAV")
+                 print(e)
+    
+        try:
+            if(stretch != None):
+                pathSTRETCH = pathIn+".STRETCH"+".wav"
+                #ffmpeg STRECH
+                aCmd = "ffmpeg -y -i \""+pathIn+"\""+" -t "+str(truncDuration) + " -filter:a \"atempo="+stretch+"\"" + " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathSTRETCH+"\" > \""+pathSTRETCH+".log\" 2>&1"
+                #sox STRECH
+                #aCmd = "sox \""+pathIn+"\""+" \""+pathSTRETCH+"\" tempo "+stretch+" > \""+pathSTRETCH+".log\" 2>&1"
+                #soundstretch STRECH
+                #aCmd = "soundstretch \""+pathIn+"\""+" \""+pathSTRETCH+"\" -tempo="+str(int(100*float(stretch)) - 100)+" > \""+pathSTRETCH+".log\" 2>&1"
+                #rubberband STRECH
+                #aCmd = "rubberband \""+pathIn+"\""+" \""+pathSTRETCH+"\" --tempo "+stretch+" > \""+pathSTRETCH+".log\" 2>&1"
+                print("CMD: "+aCmd)
+                tracing.system(aCmd, pathSTRETCH)
+                print("T=",(time.time()-startTime))
+                print("PATH="+pathWAV,flush=True)
+                pathIn = pathWAV = pathSTRETCH
+        except Exception as e:
+             print("Warning: can't STRETCH")
+             print(e)
+    
+        startTime = time.time()
+        try:
+            #Check for duration
+            aCmd = "ffmpeg -y -i \""+pathIn+"\" "+ " -f null - > \""+pathIn+".dur\" 2>&1"
             print("CMD: "+aCmd)
-            os.system(aCmd)
+            tracing.system(aCmd)
             print("T=",(time.time()-startTime))
-            print("PATH="+pathWAV,flush=True)
-            pathIn = pathClean = pathWAV = pathSTRETCH
-    except Exception as e:
-         print("Warning: can't STRETCH")
-         print(e)
-
-    startTime = time.time()
-    try:
-        #Check for duration
-        aCmd = "ffmpeg -y -i \""+pathIn+"\" "+ " -f null - > \""+pathIn+".dur\" 2>&1"
-        print("CMD: "+aCmd)
-        os.system(aCmd)
-        print("T=",(time.time()-startTime))
-        duration = getDuration(pathIn+".dur")
-        print("DURATION="+str(duration)+" max "+str(maxDuration))
-        if(duration > maxDuration):
-            return "[Too long ("+str(duration)+"s)]"
-    except Exception as e:
-         print("Warning: can't analyze duration")
-         print(e)
-
-    try:
-        if(useSpleeter):
+            duration = getDuration(pathIn+".dur")
+            print("DURATION="+str(duration)+" max "+str(maxDuration))
+        except Exception as e:
+             print("Warning: can't analyze duration")
+             print(e)
+        return pathIn, duration
+    
+    def separate(wav):
+        pathIn = wav
+        pathSeparated = None
+        stems = None
+        try:
+            if(useSpleeter):
+                startTime = time.time()
+                spleeterDir=pathIn+".spleeter"
+                if(not os.path.exists(spleeterDir)):
+                    os.mkdir(spleeterDir)
+                pathSpleeter=spleeterDir+"/"+os.path.splitext(os.path.basename(pathIn))[0]+"/vocals.wav"
+                separator.separate_to_file(pathIn, spleeterDir)
+                print("T=",(time.time()-startTime))
+                print("PATH="+pathSpleeter,flush=True)
+                pathIn = pathSpleeter
+        except Exception as e:
+             print("Warning: can't split vocals")
+             print(e)
+        
+        if(useSeparation and not isMusic):
+            #Speech only: separation would not help the passes that follow
+            metrics.inc("separation_skipped_total")
+        if(useSeparation and isMusic):
             startTime = time.time()
-            spleeterDir=pathIn+".spleeter"
-            if(not os.path.exists(spleeterDir)):
-                os.mkdir(spleeterDir)
-            pathSpleeter=spleeterDir+"/"+os.path.splitext(os.path.basename(pathIn))[0]+"/vocals.wav"
-            separator.separate_to_file(pathIn, spleeterDir)
-            print("T=",(time.time()-startTime))
-            print("PATH="+pathSpleeter,flush=True)
-            pathNoCut = pathIn = pathSpleeter
-    except Exception as e:
-         print("Warning: can't split vocals")
-         print(e)
+            try:
+                #demucsDir=pathIn+".demucs"
+                #if(not os.path.exists(demucsDir)):
+                #    os.mkdir(demucsDir)
+                pathDemucsVocals=pathIn+".vocals.wav" #demucsDir+"/htdemucs/"+os.path.splitext(os.path.basename(pathIn))[0]+"/vocals.wav"
+                pathDemucsDrums=pathIn+".drums.wav"
+                pathDemucsBass=pathIn+".bass.wav"
+                pathDemucsOther=pathIn+".other.wav"
+                #Demucs seems complex, using CLI cmd for now
+                #aCmd = "python -m demucs --two-stems=vocals -d "+device+":"+cudaIdx+" --out "+demucsDir+" "+pathIn
+                #print("CMD: "+aCmd)
+                #os.system(aCmd)
+                vocalSeparator.separate(pathIn,pathDemucsVocals,device="cuda:"+str(cudaIdx) if device == "cuda" else "cpu",chunkSeconds=separationChunk)
+                print("T=",(time.time()-startTime))
+                print("PATH="+pathDemucsVocals,flush=True)
+                pathIn = pathSeparated = pathDemucsVocals
+                stems = (pathDemucsDrums, pathDemucsBass, pathDemucsOther)
+                if not all(os.path.exists(stem) for stem in stems):
+                    #demucs_server only returns the vocals: remix from them alone
+                    stems = None
+            except Exception as e:
+                 print("Warning: can't split vocals")
+                 print(e)
+        return pathIn, pathSeparated, stems
     
-    if(useDemucs):
+    def silcut(vocals):
         startTime = time.time()
         try:
-            #demucsDir=pathIn+".demucs"
-            #if(not os.path.exists(demucsDir)):
-            #    os.mkdir(demucsDir)
-            pathDemucsVocals=pathIn+".vocals.wav" #demucsDir+"/htdemucs/"+os.path.splitext(os.path.basename(pathIn))[0]+"/vocals.wav"
-            pathDemucsDrums=pathIn+".drums.wav"
-            pathDemucsBass=pathIn+".bass.wav"
-            pathDemucsOther=pathIn+".other.wav"
-            #Demucs seems complex, using CLI cmd for now
-            #aCmd = "python -m demucs --two-stems=vocals -d "+device+":"+cudaIdx+" --out "+demucsDir+" "+pathIn
-            #print("CMD: "+aCmd)
-            #os.system(aCmd)
-            demucs_audio(pathIn=pathIn,model=modelDemucs,device="cuda:"+cudaIdx,pathVocals=pathDemucsVocals,pathOther=pathIn+".other.wav")
+            pathSILCUT = vocals+".SILCUT"+".wav"
+            aCmd = "ffmpeg -y -i \""+vocals+"\" -af \"silenceremove=start_periods=1:stop_periods=-1:start_threshold="+silcutThreshold+":stop_threshold="+silcutThreshold+":start_silence=0.2:stop_silence=0.2, loudnorm\" "+ " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathSILCUT+"\" > \""+pathSILCUT+".log\" 2>&1"
+            print("CMD: "+aCmd)
+            tracing.system(aCmd, pathSILCUT)
             print("T=",(time.time()-startTime))
-            print("PATH="+pathDemucsVocals,flush=True)
-            pathNoCut = pathIn = pathDemucsVocals
+            print("PATH="+pathSILCUT,flush=True)
+            return pathSILCUT
         except Exception as e:
-             print("Warning: can't split vocals")
+             print("Warning: can't filter blanks")
              print(e)
-
-    startTime = time.time()
-    try:
-        pathSILCUT = pathIn+".SILCUT"+".wav"
-        aCmd = "ffmpeg -y -i \""+pathIn+"\" -af \"silenceremove=start_periods=1:stop_periods=-1:start_threshold=-50dB:stop_threshold=-50dB:start_silence=0.2:stop_silence=0.2, loudnorm\" "+ " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathSILCUT+"\" > \""+pathSILCUT+".log\" 2>&1"
-        print("CMD: "+aCmd)
-        os.system(aCmd)
-        print("T=",(time.time()-startTime))
-        print("PATH="+pathSILCUT,flush=True)
-        pathIn = pathSILCUT
-    except Exception as e:
-         print("Warning: can't filter blanks")
-         print(e)
+        return vocals
     
-    try:
-        if(not isMusic and useSileroVAD):
+    def vad(cut):
+        try:
             startTime = time.time()
             
-            pathVAD = pathIn+".VAD.wav"
-            wav = read_audio(pathIn, sampling_rate=SAMPLING_RATE)
+            pathVAD = cut+".VAD.wav"
+            wav = read_audio(cut, sampling_rate=SAMPLING_RATE)
             #https://github.com/snakers4/silero-vad/blob/master/utils_vad.py#L161
-            speech_timestamps = get_speech_timestamps(wav, modelVAD,threshold=0.5,min_silence_duration_ms=500, sampling_rate=SAMPLING_RATE)
+            speech_timestamps = get_speech_timestamps(wav, modelVAD,threshold=vadThreshold,min_silence_duration_ms=500, sampling_rate=SAMPLING_RATE)
             save_audio(pathVAD,collect_chunks(speech_timestamps, wav), sampling_rate=SAMPLING_RATE)
             print("T=",(time.time()-startTime))
             print("PATH="+pathVAD,flush=True)
-            pathIn = pathVAD
-    except Exception as e:
-         print("Warning: can't filter noises")
-         print(e)
-
-    try:
-        if(float(remixFactor) >= 1):
-            pathREMIXN = pathClean
-        elif (float(remixFactor) <= 0 and useDemucs):
-            pathREMIXN = pathDemucsVocals;
-        elif (isMusic and useDemucs):
-            startTime = time.time()
-            
-            if(speechnorm):
-                pathNORM = pathDemucsVocals+".NORM.wav"
-                aCmd = ("ffmpeg -y -i \""+pathDemucsVocals+"\""
-                        #+ " -filter:a loudnorm"
-                        +" -af \"speechnorm=e=50:r=0.0005:l=1\""
-                        +" \""+pathNORM+"\" > \""+pathNORM+".log\" 2>&1")
-                print("CMD: "+aCmd)
-                os.system(aCmd)
-                print("T=",(time.time()-startTime))
-                print("PATH="+pathNORM,flush=True)
-            else:
-                pathNORM = pathDemucsVocals
-
-            pathREMIXN = pathNORM+".REMIX.wav"
-            aCmd = ("ffmpeg -y -i \""+pathNORM+"\" -i \""+pathDemucsDrums+"\" -i \""+pathDemucsBass+"\" -i \""+pathDemucsOther+"\""
+            return pathVAD, sum(t["end"] - t["start"] for t in speech_timestamps) / float(SAMPLING_RATE)
+        except Exception as e:
+             print("Warning: can't filter noises")
+             print(e)
+        return cut, None
+    
+    def activity(separated):
+        try:
+            if(separated is not None):
+                return vocalActivity(separated)
+        except Exception as e:
+             print("Warning: can't measure vocal activity")
+             print(e)
+        return None
+    
+    def norm(separated):
+        if(separated is None or not speechnorm):
+            return separated
+        startTime = time.time()
+        try:
+            pathNORM = separated+".NORM.wav"
+            aCmd = ("ffmpeg -y -i \""+separated+"\""
+                    #+ " -filter:a loudnorm"
+                    +" -af \"speechnorm=e=50:r=0.0005:l=1\""
+                    +" \""+pathNORM+"\" > \""+pathNORM+".log\" 2>&1")
+            print("CMD: "+aCmd)
+            if tracing.system(aCmd, pathNORM) != 0:
+                raise RuntimeError("ffmpeg failed, see "+pathNORM+".log")
+            print("T=",(time.time()-startTime))
+            print("PATH="+pathNORM,flush=True)
+            return pathNORM
+        except Exception as e:
+             print("Warning: can't normalize vocals")
+             print(e)
+        return separated
+    
+    def remix(norm, stems):
+        if(norm is None):
+            return None
+        if(stems is None):
+            #Vocals only (remote separation)
+            return norm
+        startTime = time.time()
+        try:
+            pathDemucsDrums, pathDemucsBass, pathDemucsOther = stems
+            pathREMIXN = norm+".REMIX.wav"
+            aCmd = ("ffmpeg -y -i \""+norm+"\" -i \""+pathDemucsDrums+"\" -i \""+pathDemucsBass+"\" -i \""+pathDemucsOther+"\""
                     +" -filter_complex amix=inputs=4:duration=longest:dropout_transition=0:weights=\"1 "+remixFactor+" "+remixFactor+" "+remixFactor+"\""
                     +" \""+pathREMIXN+"\" > \""+pathREMIXN+".log\" 2>&1")
             print("CMD: "+aCmd)
-            os.system(aCmd)
+            if tracing.system(aCmd, pathREMIXN) != 0:
+                raise RuntimeError("ffmpeg failed, see "+pathREMIXN+".log")
             print("T=",(time.time()-startTime))
             print("PATH="+pathREMIXN,flush=True)
-    except Exception as e:
-         print("Warning: can't remix")
-         print(e)
+            return pathREMIXN
+        except Exception as e:
+             print("Warning: can't remix")
+             print(e)
+        return None
+    
+    stages = [Stage("decode", decode, ["source"], ["wav", "duration"]),
+              Stage("separate", separate, ["wav"], ["vocals", "separated", "stems"]),
+              Stage("silcut", silcut, ["vocals"], ["cut"])]
+    clean = "cut"
+    if(not isMusic and useSileroVAD and profile["vad"]):
+        stages.append(Stage("vad", vad, ["cut"], ["clean", "speech_seconds"]))
+        clean = "clean"
+    if(useSeparation and isMusic):
+        stages.append(Stage("activity", activity, ["separated"], ["speech_seconds"]))
+    if(float(remixFactor) >= 1):
+        stages.append(Stage("remix", lambda wav: wav, ["wav"], ["remix"]))
+    elif(float(remixFactor) <= 0 and useSeparation and isMusic):
+        stages.append(Stage("remix", lambda separated: separated, ["separated"], ["remix"]))
+    elif(isMusic and useSeparation):
+        stages.append(Stage("norm", norm, ["separated"], ["norm"]))
+        stages.append(Stage("remix", remix, ["norm", "stems"], ["remix"]))
+    else:
+        stages.append(Stage("remix", lambda: None, [], ["remix"]))
+    graph = StageGraph(stages, values={"source": path})
+    
+    duration = graph.run("duration")
+    if(duration > maxDuration):
+        return TranscriptionResult(text="[Too long ("+str(duration)+"s)]", outputs=outputs)
+    
+    #Values read by the passes below
+    textOnly = outputs.isdisjoint(TIMED_OUTPUTS)
+    if(textOnly):
+        targets = [clean]
+    elif(isMusic and not whisperVersion == "-v3"):
+        targets = ["remix", "vocals", "wav"]
+    else:
+        targets = ["vocals"]
+    if("speech_seconds" in graph.producers):
+        targets.append("speech_seconds")
+    graph.run(*targets)
+    #Seconds of speech or vocals found by VAD or in the separated vocals, if measured
+    speechSeconds = graph.values.get("speech_seconds")
+    pathClean = graph.values["wav"]
+    pathNoCut = graph.values["vocals"]
+    pathREMIXN = graph.values.get("remix")
+    pathIn = graph.values.get(clean)
+    
+    if(speechSeconds is not None):
+        #Every pass on silence or an instrumental is a chance to hallucinate
+        noSpeech = speechSeconds < NO_SPEECH_SECONDS
+        print("SPEECH="+str(round(speechSeconds, 2))+"s"+(" NO SPEECH" if noSpeech else ""), flush=True)
+        metrics.inc("speech_checks_total", result="no_speech" if noSpeech else "speech", audio="music" if isMusic else "speech")
+        if(noSpeech):
+            result = TranscriptionResult(outputs=outputs)
+            result.no_speech = True
+            return result
 
     mode=1
-    if(duration > 30):
-        print("NOT USING MARKS FOR DURATION > 30s")
+    if(duration > marksMaxDuration):
+        print("NOT USING MARKS FOR DURATION > "+str(marksMaxDuration)+"s")
         mode=0
     
+    #Passes already run in this request, keyed by audio input, mode and early abort
+    passes = {}
+    def transcribePass(aPath, aMode, abortAbove=None, stop=None):
+        key = (aPath, aMode, abortAbove)
+        if key in passes:
+            print("REUSING PASS ["+str(aMode)+"] PATH="+aPath)
+        else:
+            monitor = None
+            if(abortAbove is not None):
+                monitor = HallucinationMonitor(indexFor(lngInput), abortAbove, stop)
+            #Cascade candidates are numbered in the order they run
+            with tracing.span("candidate", index=len(passes)+1, input=tracing.pathVariant(aPath), mode=aMode, abort_above=abortAbove) as args:
+                passes[key] = transcribeMARK(aPath, opts, mode=aMode, lngInput=lngInput, isMusic=isMusic,
+                                             nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count, modelKey=modelKey,
+                                             monitor=monitor, profile=profile)
+                args.update(chars=len(passes[key].text), aborted=passes[key].aborted)
+        return passes[key]
+    
     startTime = time.time()
-    if(onlySRT):
-        result = {}
-        result["text"] = ""
+    if(textOnly):
+        #Text only: marker pass on the cleanest input, no timestamps needed
+        result = transcribePass(pathIn, mode)
+        if len(result.text) <= 0:
+            result.text = "--"
     else:
-        result = transcribeMARK(pathIn, opts, mode=mode, lngInput=lngInput, isMusic=isMusic,
-                                nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)
-        if len(result["text"]) <= 0:
-            result["text"] = "--"
-    
-    if(onlySRT or addSRT):
+        #A single timed pass provides text, subtitles and segments
         #Better timestamps using original music clip
         if(isMusic
                #V3 is very bad with music!?
                and not whisperVersion == "-v3"
                ):
             if(pathREMIXN is not None):
-                resultSRT = transcribeMARK(pathREMIXN, opts, mode=3, lngInput=lngInput, isMusic=isMusic,
-                                           nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)
-                
-                weird_word_count_1 = count_weird_words(resultSRT["srt"])
                 weird_word_count_threshold = 2
+                #Candidates with a next candidate stop decoding as soon as they cross the threshold
+                cascade = lngInput.lower() == 'vi' and profile["cascade"]
+                abortAbove = weird_word_count_threshold if cascade else None
+                resultSRT = transcribePass(pathREMIXN, 3, abortAbove)
+                
+                weird_word_count_1 = weirdCount(resultSRT, lngInput)
                 # special case for Vietnamese
-                if lngInput.lower() == 'vi' and weird_word_count_1 > weird_word_count_threshold:
+                if cascade:
+                    metrics.inc("vietnamese_cascade_total")
+                if cascade and weird_word_count_1 > weird_word_count_threshold:
                     print("Vietnamese special case")
                     print("weird_word_count_1 = ", weird_word_count_1)
-                    resultSRT2 = transcribeMARK(pathNoCut, opts, mode=3, lngInput=lngInput, isMusic=isMusic,
-                                               nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)   
-                    weird_word_count_2 = count_weird_words(resultSRT2["srt"])
+                    #Only this candidate reads the silence-cut input
+                    pathIn = graph.run(clean)
+                    gladiaPath = pathIn if "SILCUT" not in pathIn else pathREMIXN
+                    hedge = None
+                    stop = None
+                    if gladiaHedging and useGladia:
+                        #High risk: start the remote fallback now, local candidates stop if it is accepted first
+                        hedge = GladiaHedge(getGladiaClient(), gladiaPath, lngInput, opts["language"],
+                                            accept=lambda r: count_weird_words(r["text"], lngInput) <= weird_word_count_threshold)
+                        stop = hedge.accepted
+                        metrics.inc("gladia_hedge_started_total")
+                    resultSRT2 = transcribePass(pathNoCut, 3, abortAbove, stop)
+                    weird_word_count_2 = weirdCount(resultSRT2, lngInput)
                     print("weird_word_count_2 = ", weird_word_count_2)
                     if weird_word_count_2 < weird_word_count_1:
                         resultSRT = resultSRT2
                     if weird_word_count_2 > weird_word_count_threshold:
-                        if "SILCUT" not in pathIn:
-                            resultSRT3 = transcribeMARK(pathIn, opts, mode=3, lngInput=lngInput, isMusic=isMusic,
-                                                nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)
+                        if "SILCUT" not in pathIn and not (stop is not None and stop.is_set()):
+                            resultSRT3 = transcribePass(pathIn, 3, abortAbove, stop)
                         else:
                             resultSRT3 = resultSRT2
                         
-                        weird_word_count_3 = count_weird_words(resultSRT3["srt"])
+                        weird_word_count_3 = weirdCount(resultSRT3, lngInput)
                         print("weird_word_count_3 = ", weird_word_count_3)
                         if weird_word_count_3 < weird_word_count_2:
                             resultSRT = resultSRT3
                         if weird_word_count_3 > weird_word_count_threshold:
-                            if "SILCUT" not in pathIn:
-                                resultSRT4 = transcribe_with_gladia(pathIn, lngInput, opts["language"])
+                            if not useGladia:
+                                #Offline: no remote candidate, on to the last local one
+                                weird_word_count_4 = weird_word_count_3
                             else:
-                                resultSRT4 = transcribe_with_gladia(pathREMIXN, lngInput, opts["language"])
-                            
-                            resultSRT4 = json.loads(resultSRT4)
-                            weird_word_count_4 = count_weird_words(resultSRT4["text"])
-                            print("weird_word_count_4 = ", weird_word_count_4)
-                            if weird_word_count_4 < weird_word_count_3:
-                                resultSRT = resultSRT4
+                                if hedge is not None:
+                                    neededTime = time.time()
+                                    resultSRT4 = hedge.wait(getGladiaClient().pollTimeout)
+                                    metrics.inc("gladia_hedge_used_total")
+                                    #Remote time already spent while local candidates were running
+                                    metrics.observe("gladia_hedge_saved_seconds", min(neededTime, hedge.finishTime or neededTime) - hedge.startTime)
+                                else:
+                                    resultSRT4 = json.loads(transcribe_with_gladia(gladiaPath, lngInput, opts["language"]))
+                                resultSRT4 = TranscriptionResult.from_dict(resultSRT4)
+                                weird_word_count_4 = weirdCount(resultSRT4, lngInput)
+                                if not resultSRT4.text.strip():
+                                    #Failed or empty remote result: never a winner, on to the last local candidate
+                                    weird_word_count_4 = float("inf")
+                                print("weird_word_count_4 = ", weird_word_count_4)
+                                if weird_word_count_4 < weird_word_count_3:
+                                    resultSRT = resultSRT4
                             if weird_word_count_4 > weird_word_count_threshold:
-                                resultSRT5 = transcribeMARK(pathClean, opts, mode=3, lngInput=lngInput, isMusic=isMusic,
-                                            nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)
-                                weird_word_count_5 = count_weird_words(resultSRT5["srt"])
+                                #Last candidate: always decoded to the end
+                                resultSRT5 = transcribePass(pathClean, 3)
+                                weird_word_count_5 = weirdCount(resultSRT5, lngInput)
                                 print("weird_word_count_5 = ", weird_word_count_5)
                                 if weird_word_count_5 < weird_word_count_4:
                                     resultSRT = resultSRT5
+                        elif hedge is not None:
+                            hedge.cancel()
+                            metrics.inc("gladia_hedge_cancelled_total")
+                    elif hedge is not None:
+                        hedge.cancel()
+                        metrics.inc("gladia_hedge_cancelled_total")
             else:
-                resultSRT = transcribeMARK(pathClean, opts, mode=3, lngInput=lngInput, isMusic=isMusic,
-                                           nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)
+                resultSRT = transcribePass(pathClean, 3)
         else:
-            resultSRT = transcribeMARK(pathNoCut, opts, mode=3, lngInput=lngInput, isMusic=isMusic,
-                                       nbRun=nbRun, max_line_width=max_line_width, max_line_count=max_line_count)
-        # Ensure resultSRT is a dictionary before accessing its keys
-        if isinstance(resultSRT, dict):
-            result = {
-                "srt": resultSRT.get("srt", ""),
-                "text": resultSRT.get("text", ""),
-                "json": resultSRT.get("json", [])
-            }
+            resultSRT = transcribePass(pathNoCut, 3)
+        # Ensure resultSRT is a TranscriptionResult before accessing its fields
+        if isinstance(resultSRT, TranscriptionResult):
+            result = resultSRT
         else:
-            print(f"Warning: resultSRT is not a dictionary. Type: {type(resultSRT)}")
+            print(f"Warning: resultSRT is not a TranscriptionResult. Type: {type(resultSRT)}")
             print("resultSRT = ", resultSRT)
-            result = {
-                "srt": "",
-                "text": resultSRT.get("text", ""),
-                "json": []
-            }
-    else:
-        result = {
-            "srt": "",
-            "text": result.get("text", ""),
-            "json": result.get("json", [])
-        }
+            result = TranscriptionResult()
   
-    result["json"] = split_transcription(result["json"])
+    result.outputs = outputs
+    result.max_line_width = max_line_width
+    result.max_line_count = max_line_count
+    result.segments = result.segments.split_sentences()
     
 
+    print("STAGES "+" ".join(name+"="+str(round(t, 3)) for name, t in graph.timings.items())+" SKIPPED "+",".join(graph.skipped()), flush=True)
     print("T=",(time.time()-initTime))
-    if(len(result["text"]) > 0):
-        print("s/c=",(time.time()-initTime)/len(result["text"]))
-    print("c/s=",len(result["text"])/(time.time()-initTime))
+    if(len(result.text) > 0):
+        print("s/c=",(time.time()-initTime)/len(result.text))
+    print("c/s=",len(result.text)/(time.time()-initTime))
     
-    return json.dumps(result)
+    return result
 
-def transcribeMARK(path: str, opts: dict, mode=1, lngInput=None, aLast=None, isMusic=False, nbRun=1, max_line_width=80, max_line_count=2):
+def transcribeMARK(path: str, opts: dict, mode=1, lngInput=None, aLast=None, isMusic=False, nbRun=1, max_line_width=80, max_line_count=2, modelKey=None, monitor=None, profile=None):
     print("transcribeMARK(): "+path)
+    profile = profile or getProfile()[1]
     pathIn = path
     
     lng = opts["language"]
@@ -498,7 +794,12 @@ def transcribeMARK(path: str, opts: dict, mode=1, lngInput=None, aLast=None, isM
         #Markers are not really interesting with music
         mode = 0
     
-    if(whisperFound == "SM4T"):
+    if(not profile["markers"] and mode != 3):
+        #Profile trades the marker confirmation passes for latency
+        mode = 0
+    
+    backend = registry.normalizeKey(modelKey).split("-")[0].upper()
+    if(backend == "SM4T"):
         #Not marker with SM4T
         mode = 0
     
@@ -525,19 +826,20 @@ def transcribeMARK(path: str, opts: dict, mode=1, lngInput=None, aLast=None, isM
                 pathMRK = pathIn+".MRK"+".wav"
                 aCmd = "ffmpeg -y -i "+mark1+" -i \""+pathIn+"\" -i "+mark2+" -filter_complex \"[0:a][1:a][2:a]concat=n=3:v=0:a=1[a]\" -map \"[a]\" -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathMRK+"\" > \""+pathMRK+".log\" 2>&1"
                 print("CMD: "+aCmd)
-                os.system(aCmd)
+                tracing.system(aCmd, pathMRK)
                 print("T=",(time.time()-startTime))
                 print("["+str(mode)+"] PATH="+pathMRK,flush=True)
                 pathIn = pathMRK
             
             if(useCompressor
+                and profile["compressor"]
                 and not isMusic
                 ):
                 startTime = time.time()
                 pathCPS = pathIn+".CPS"+".wav"
                 aCmd = "ffmpeg -y -i \""+pathIn+"\" -af \"speechnorm=e=50:r=0.0005:l=1\" "+ " -c:a pcm_s16le -ar "+str(SAMPLING_RATE)+" \""+pathCPS+"\" > \""+pathCPS+".log\" 2>&1"
                 print("CMD: "+aCmd)
-                os.system(aCmd)
+                tracing.system(aCmd, pathCPS)
                 print("T=",(time.time()-startTime))
                 print("["+str(mode)+"] PATH="+pathCPS,flush=True)
                 pathIn = pathCPS
@@ -545,275 +847,165 @@ def transcribeMARK(path: str, opts: dict, mode=1, lngInput=None, aLast=None, isM
              print("Warning: can't add markers")
              print(e)
     
-    def format_srt_text(text, max_width, max_lines):
-        words = text.split()
-        lines = []
-        current_line = []
-        current_length = 0
-
-        for word in words:
-            if current_length + len(word) + 1 > max_width:
-                lines.append(' '.join(current_line))
-                current_line = [word]
-                current_length = len(word)
-            else:
-                current_line.append(word)
-                current_length += len(word) + 1
-
-        if current_line:
-            lines.append(' '.join(current_line))
-
-        return '\n'.join(lines[:max_lines])
-
     startTime = time.time()
-    lock.acquire()
     try:
-        transcribe_options = dict(**opts)  # avoid adding beam_size opt several times
-        if beam_size > 1:
-            transcribe_options["beam_size"] = beam_size
-        if patience > 0:
-            transcribe_options["patience"] = patience
-        if temperature > 0:
-            transcribe_options["temperature"] = temperature
-
-        # Check if both input and target languages are non-English and different
-        # if lngInput and lng and lngInput.lower() == 'vi' :
-        #     # Use Gladia API directly
-        #     gladia_result = transcribe_with_gladia(pathIn, lngInput, lng)
-        #     result = json.loads(gladia_result)
-        # elif whisperFound == "FSTR":
-        if whisperFound == "FSTR":
-            result = {"text": "", "srt": "", "json": []}
-            multiRes = ""
-            for r in range(nbRun):
-                print("RUN: "+str(r))
-                segments, info = model.transcribe(pathIn,**transcribe_options)
-                resSegs = []
-                json_segments = []
-                if(mode == 3):
-                    aSegCount = 0
-                    for segment in segments:
-                        aSegCount += 1
-                        formatted_text = format_srt_text(segment.text.strip(), max_line_width, max_line_count)
-                        srt_entry = f"{aSegCount}\n{formatTimeStamp(segment.start)} --> {formatTimeStamp(segment.end)}\n{formatted_text}\n\n"
-                        resSegs.append(srt_entry)
-                        json_segment = {
-                            "start": segment.start,
-                            "end": segment.end,
-                            "sentence": segment.text.strip(),
-                            "words": []
-                        }
-                        if "word_timestamps" in transcribe_options:
-                            for word in segment.words:
-                                json_segment["words"].append({
-                                    "start": word.start,
-                                    "end": word.end,
-                                    "text": word.word.strip()
-                                })
-                        json_segments.append(json_segment)
-                else:
-                    for segment in segments:
-                        resSegs.append(segment.text)
-                        json_segment = {
-                            "start": segment.start,
-                            "end": segment.end,
-                            "sentence": segment.text.strip(),
-                            "words": []
-                        }
-                        if "word_timestamps" in transcribe_options:
-                            for word in segment.words:
-                                json_segment["words"].append({
-                                    "start": word.start,
-                                    "end": word.end,
-                                    "text": word.word.strip()
-                                })
-                        json_segments.append(json_segment)
-                
-                result["text"] += "".join(resSegs)
-                result["srt"] += "".join(resSegs) if mode == 3 else ""
-                result["json"].extend(json_segments)
-                if(r > 0):
-                    multiRes += "=====\n"
-                multiRes += result["text"]
-            
-            if(nbRun > 1):
-                result["text"] = multiRes
-        elif whisperFound == "SM4T":
-            src_lang = lang2to3[lngInput];
-            tgt_lang = lang2to3[lng];
-            # S2TT
-            #translated_text, _, _ = translator.predict(<path_to_input_audio>, "s2tt", <tgt_lang>)
-            translated_text, _, _ = model.predict(pathIn, "s2tt", tgt_lang)
-            result = {
-                "text": str(translated_text),
-                "srt": "",
-                "json": []
-            }
-        else:
-            transcribe_options = dict(task="transcribe", **transcribe_options)
-            multiRes = ""
-            result = {"text": "", "srt": "", "json": []}
-            for r in range(nbRun):
-                print("RUN: "+str(r))
-                whisper_result = model.transcribe(pathIn, **transcribe_options)
-                if(mode == 3):
-                    srt_segments = []
-                    for i, segment in enumerate(whisper_result["segments"], start=1):
-                        formatted_text = format_srt_text(segment['text'].strip(), max_line_width, max_line_count)
-                        srt_entry = f"{i}\n{formatTimeStamp(segment['start'])} --> {formatTimeStamp(segment['end'])}\n{formatted_text}\n\n"
-                        srt_segments.append(srt_entry)
-                    result["srt"] += "".join(srt_segments)
-                
-                result["text"] += whisper_result["text"]
-                for segment in whisper_result["segments"]:
-                    json_segment = {
-                        "start": segment["start"],
-                        "end": segment["end"],
-                        "sentence": segment["text"].strip(),
-                        "words": [{"start": word["start"], "end": word["end"], "text": word["word"]} for word in segment.get("words", [])]
-                    }
-                    result["json"].append(json_segment)
-                
-                if(r > 0):
-                    multiRes += "=====\n"
-                multiRes += result["text"]
-            
-            if(nbRun > 1):
-                result["text"] = multiRes
-        
+        with tracing.span("inference", mode=mode, input=tracing.pathVariant(pathIn), model=modelKey, retry=aLast is not None) as args, \
+             registry.acquire(modelKey) as entry:
+            #One pass at a time on GPU; on CPU as many as the model has workers
+            with (lock if registry.device == "cuda" else entry.slots):
+                args["waited"] = round(time.time() - startTime, 3)
+                result = transcribeModel(entry, pathIn, opts, lngInput, nbRun, monitor, profile)
+            args.update(backend=entry.backend, chars=len(result.text), aborted=result.aborted)
+        result.max_line_width = max_line_width
+        result.max_line_count = max_line_count
         print("T=",(time.time()-startTime))
-        print("TRANS="+result["text"],flush=True)
+        print("TRANS="+result.text,flush=True)
     except Exception as e: 
         print(e)
         traceback.print_exc()
-        lock.release()
-        result = {"text": "", "srt": "", "json": []}
-    
-    lock.release()
+        result = TranscriptionResult()
     
     if(mode == 0 or mode == 3):
         return result
         #Too restrictive
-        #if(result["text"] == aLast):
+        #if(result.text == aLast):
         #    #Only if confirmed
         #    return result
-        #result["text"] = ""
+        #result.text = ""
         #return result
     
     aWhisper="(Whisper|Wisper|Wyspę|Wysper|Wispa|Уіспер|Ου ίσπερ|위스퍼드|ウィスパー|विस्पर|विसपर)"
     aOk="(o[.]?k[.]?|okay|oké|okej|Окей|οκέι|окэй|オーケー|ओके)"
     aSep="[.,!? ]*"
     if(mode == 1):
-        aCleaned = re.sub(r"(^ *"+aWhisper+aSep+aOk+aSep+"|"+aOk+aSep+aWhisper+aSep+" *$)", "", result["text"], 2, re.IGNORECASE)
-        if(re.match(r"^ *("+aOk+"|"+aSep+"|"+aWhisper+")*"+aWhisper+"("+aOk+"|"+aSep+"|"+aWhisper+")* *$", result["text"], re.IGNORECASE)):
+        aCleaned = re.sub(r"(^ *"+aWhisper+aSep+aOk+aSep+"|"+aOk+aSep+aWhisper+aSep+" *$)", "", result.text, 2, re.IGNORECASE)
+        if(re.match(r"^ *("+aOk+"|"+aSep+"|"+aWhisper+")*"+aWhisper+"("+aOk+"|"+aSep+"|"+aWhisper+")* *$", result.text, re.IGNORECASE)):
             #Empty sound ?
-            return transcribeMARK(path, opts, mode=2,lngInput=lngInput,aLast="")
+            return transcribeMARK(path, opts, mode=2,lngInput=lngInput,aLast="",modelKey=modelKey,profile=profile)
         
-        if(re.match(r"^ *"+aWhisper+aSep+aOk+aSep+".*"+aOk+aSep+aWhisper+aSep+" *$", result["text"], re.IGNORECASE)):
+        if(re.match(r"^ *"+aWhisper+aSep+aOk+aSep+".*"+aOk+aSep+aWhisper+aSep+" *$", result.text, re.IGNORECASE)):
             #GOOD!
-            result["text"] = aCleaned
+            result.text = aCleaned
             return result
         
-        return transcribeMARK(path, opts, mode=2,lngInput=lngInput,aLast=aCleaned)
+        return transcribeMARK(path, opts, mode=2,lngInput=lngInput,aLast=aCleaned,modelKey=modelKey,profile=profile)
     
     if(mode == 2):
-        aCleaned = re.sub(r"(^ *"+aOk+aSep+aWhisper+aSep+"|"+aWhisper+aSep+aOk+aSep+" *$)", "", result["text"], 2, re.IGNORECASE)
+        aCleaned = re.sub(r"(^ *"+aOk+aSep+aWhisper+aSep+"|"+aWhisper+aSep+aOk+aSep+" *$)", "", result.text, 2, re.IGNORECASE)
         if(aCleaned == aLast):
             #CONFIRMED!
-            result["text"] = aCleaned
+            result.text = aCleaned
             return result
             
-        if(re.match(r"^ *("+aOk+"|"+aSep+"|"+aWhisper+")*"+aWhisper+"("+aOk+"|"+aSep+"|"+aWhisper+")* *$", result["text"], re.IGNORECASE)):
+        if(re.match(r"^ *("+aOk+"|"+aSep+"|"+aWhisper+")*"+aWhisper+"("+aOk+"|"+aSep+"|"+aWhisper+")* *$", result.text, re.IGNORECASE)):
             #Empty sound ? 
-            result["text"] = ""
+            result.text = ""
             return result
         
-        if(re.match(r"^ *"+aOk+aSep+aWhisper+aSep+".*"+aWhisper+aSep+aOk+aSep+" *$", result["text"], re.IGNORECASE)):
+        if(re.match(r"^ *"+aOk+aSep+aWhisper+aSep+".*"+aWhisper+aSep+aOk+aSep+" *$", result.text, re.IGNORECASE)):
             #GOOD!
-            result["text"] = aCleaned
+            result.text = aCleaned
             return result
         
-        return transcribeMARK(path, opts, mode=0,lngInput=lngInput,aLast=aCleaned)
+        return transcribeMARK(path, opts, mode=0,lngInput=lngInput,aLast=aCleaned,modelKey=modelKey,profile=profile)
 
-import requests
-def transcribe_with_gladia(audio_path, source_lang, target_lang):
-    upload_url = "https://api.gladia.io/v2/upload"
-    transcribe_url = "https://api.gladia.io/v2/pre-recorded"
-    
-    headers = {
-        "x-gladia-key": "aac97688-7e14-4274-8e03-cbf2a8212828"
-    }
+def transcribeModel(entry, pathIn: str, opts: dict, lngInput: str, nbRun=1, monitor=None, profile=None):
+    """Run one inference pass with a registry model entry.
 
-    try:
-        # Step 1: Upload the file
-        with open(audio_path, "rb") as audio_file:
-            print("audio_path: "+ audio_path)
-            files = {"audio": (os.path.basename(audio_path), audio_file, "audio/mpeg")}
-            upload_response = requests.post(upload_url, files=files, headers=headers)
-        
-        if upload_response.status_code != 200:
-            print(f"Error uploading file: {upload_response.status_code}")
-            print(upload_response.text)
-            return json.dumps({"text": "", "srt": "", "json": []})
-
-        upload_result = upload_response.json()
-        audio_url = upload_result["audio_url"]
-
-        # Step 2: Request transcription
-        transcribe_headers = {
-            "x-gladia-key": "aac97688-7e14-4274-8e03-cbf2a8212828",
-            "Content-Type": "application/json"
-        }
+    With a HallucinationMonitor, decoding stops at the first segment that
+    crosses its threshold and the result is marked aborted.
+    """
+    lng = opts["language"]
+
+    #Decode parameters of the request profile, else the module defaults
+    decode = profile or dict(beam_size=beam_size, patience=patience, temperature=temperature)
+    transcribe_options = dict(**opts)  # avoid adding beam_size opt several times
+    if decode["beam_size"] > 1:
+        transcribe_options["beam_size"] = decode["beam_size"]
+    if decode["patience"] > 0:
+        transcribe_options["patience"] = decode["patience"]
+    if decode["temperature"] > 0:
+        transcribe_options["temperature"] = decode["temperature"]
+
+    # Check if both input and target languages are non-English and different
+    # if lngInput and lng and lngInput.lower() == 'vi' :
+    #     # Use Gladia API directly
+    #     gladia_result = transcribe_with_gladia(pathIn, lngInput, lng)
+    #     result = json.loads(gladia_result)
+    # elif entry.backend == "FSTR":
+    if entry.backend == "FSTR":
+        result = TranscriptionResult()
+        multiRes = ""
+        withWords = transcribe_options.get("word_timestamps", False)
+        for r in range(nbRun):
+            print("RUN: "+str(r))
+            segments, info = entry.model.transcribe(pathIn,**transcribe_options)
+            resSegs = []
+            for segment in segments:
+                resSegs.append(segment.text)
+                result.segments.append(segment.start, segment.end, segment.text.strip(),
+                                       ((word.start, word.end, word.word.strip()) for word in segment.words) if withWords else ())
+                if(monitor != None and monitor.feed(segment.text)):
+                    #Segments are decoded lazily: leaving the loop stops the pass
+                    if(monitor.preempted()):
+                        print("ABORTED: remote result accepted at "+formatTimeStamp(segment.end), flush=True)
+                        metrics.inc("gladia_hedge_preempted_total")
+                    else:
+                        print("ABORTED: "+str(monitor.count)+" hallucinated phrases at "+formatTimeStamp(segment.end), flush=True)
+                        metrics.inc("hallucination_aborts_total")
+                    result.aborted = True
+                    break
+            
+            result.text += "".join(resSegs)
+            if(r > 0):
+                multiRes += "=====\n"
+            multiRes += result.text
+            if(result.aborted):
+                break
         
-        payload = {
-            "audio_url": audio_url,
-            "detect_language": True,
-            "language": source_lang,
-            "translation": True,
-            "translation_config": {
-                "target_languages": [target_lang],
-                "model": "base",
-                "match_original_utterances": True
-            },
-            "diarization": True,
-            "subtitles": True,
-            "subtitles_config": {
-                "formats": ["srt"],
-            },
-        }
-
-        transcribe_response = requests.post(transcribe_url, json=payload, headers=transcribe_headers)
-        if transcribe_response.status_code == 200 or transcribe_response.status_code == 201:
-            transcribe_result = transcribe_response.json()
-            result_url = transcribe_result["result_url"]
+        if(nbRun > 1):
+            result.text = multiRes
+    elif entry.backend == "SM4T":
+        src_lang = lang2to3[lngInput];
+        tgt_lang = lang2to3[lng];
+        # S2TT
+        #translated_text, _, _ = translator.predict(<path_to_input_audio>, "s2tt", <tgt_lang>)
+        translated_text, _, _ = entry.model.predict(pathIn, "s2tt", tgt_lang)
+        result = TranscriptionResult(text=str(translated_text))
+    else:
+        transcribe_options = dict(task="transcribe", **transcribe_options)
+        multiRes = ""
+        result = TranscriptionResult()
+        for r in range(nbRun):
+            print("RUN: "+str(r))
+            whisper_result = entry.model.transcribe(pathIn, **transcribe_options)
+            result.text += whisper_result["text"]
+            if(monitor != None and monitor.feed(whisper_result["text"])):
+                #Standard Whisper decodes eagerly, only later runs can be skipped
+                result.aborted = True
+            for segment in whisper_result["segments"]:
+                result.segments.append(segment["start"], segment["end"], segment["text"].strip(),
+                                       ((word["start"], word["end"], word["word"]) for word in segment.get("words", [])))
             
-            # Step 3: Fetch the result with polling
-            max_attempts = 12  # 1 minute total (5 seconds * 12)
-            attempts = 0
-            while attempts < max_attempts:
-                result_response = requests.get(result_url, headers=headers)
-                
-                if result_response.status_code == 200 or result_response.status_code == 201:
-                    gladia_result = result_response.json()
-                    
-                    if gladia_result.get("status") == "done":
-                        formatted_result = convert_gladia_to_internal_format(gladia_result)
-                        return json.dumps(formatted_result)
-                    else:
-                        print(f"Gladia result not ready. Status: {gladia_result.get('status')}. Waiting 5 seconds...")
-                        time.sleep(5)
-                        attempts += 1
-                else:
-                    print(f"Error fetching result from Gladia API: {result_response.status_code}")
-                    print(result_response.text)
-                    return json.dumps({"text": "", "srt": "", "json": []})
-
-            print("Max attempts reached. Gladia result not ready.")
-            return json.dumps({"text": "", "srt": "", "json": []})
-        else:
-            print(f"Error requesting transcription from Gladia API: {transcribe_response.status_code}")
-            print(transcribe_response.text)
-            return json.dumps({"text": "", "srt": "", "json": []})
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Gladia API: {e}")
-        return json.dumps({"text": "", "srt": "", "json": []})
\ No newline at end of file
+            if(r > 0):
+                multiRes += "=====\n"
+            multiRes += result.text
+            if(result.aborted):
+                break
+        
+        if(nbRun > 1):
+            result.text = multiRes
+    
+    return result
+
+gladiaClient = None
+def getGladiaClient():
+    global gladiaClient
+    if gladiaClient is None:
+        gladiaClient = GladiaClient()
+    return gladiaClient
+
+def transcribe_with_gladia(audio_path, source_lang, target_lang, client=None):
+    """Gladia transcription as an internal-format JSON string, empty result on failure."""
+    client = client or getGladiaClient()
+    return json.dumps(client.transcribe(audio_path, source_lang, target_lang))
@@ -0,0 +1,288 @@
+import gzip
+import json
+import math
+from array import array
+
+from json_util import contains_weird_words
+
+try:
+    #Optional fast encoder
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    #Optional brotli response compression
+    import brotli
+except ImportError:
+    brotli = None
+
+_encode_str = json.encoder.encode_basestring_ascii
+
+def _encode_float(value):
+    """JSON number; null for NaN and infinities, as orjson writes them (they are not valid JSON)."""
+    return repr(value) if math.isfinite(value) else "null"
+
+class SegmentTable:
+    """Column storage for timed segments and their words.
+
+    Segment i owns the words in [word_offsets[i], word_offsets[i+1]).
+    """
+
+    __slots__ = ("starts", "ends", "sentences", "word_offsets", "word_starts", "word_ends", "word_texts")
+
+    def __init__(self):
+        self.starts = array("d")
+        self.ends = array("d")
+        self.sentences = []
+        self.word_offsets = array("I", [0])
+        self.word_starts = array("d")
+        self.word_ends = array("d")
+        self.word_texts = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, end, sentence, words=()):
+        """Append one segment; words is an iterable of (start, end, text)."""
+        self.starts.append(start)
+        self.ends.append(end)
+        self.sentences.append(sentence)
+        for wStart, wEnd, wText in words:
+            self.word_starts.append(wStart)
+            self.word_ends.append(wEnd)
+            self.word_texts.append(wText)
+        self.word_offsets.append(len(self.word_texts))
+
+    def extend(self, other):
+        base = len(self.word_texts)
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+        self.sentences.extend(other.sentences)
+        self.word_offsets.extend(base + o for o in other.word_offsets[1:])
+        self.word_starts.extend(other.word_starts)
+        self.word_ends.extend(other.word_ends)
+        self.word_texts.extend(other.word_texts)
+
+    def word_range(self, i):
+        return range(self.word_offsets[i], self.word_offsets[i + 1])
+
+    @classmethod
+    def from_list(cls, segments):
+        table = cls()
+        for seg in segments:
+            table.append(seg.get("start", 0), seg.get("end", 0), seg.get("sentence", ""),
+                         ((w.get("start", 0), w.get("end", 0), w.get("text", "")) for w in seg.get("words", [])))
+        return table
+
+    def to_list(self):
+        ws, we, wt = self.word_starts, self.word_ends, self.word_texts
+        return [{
+            "start": self.starts[i],
+            "end": self.ends[i],
+            "sentence": self.sentences[i],
+            "words": [{"start": ws[j], "end": we[j], "text": wt[j]} for j in self.word_range(i)]
+        } for i in range(len(self))]
+
+    def split_sentences(self):
+        """Same splitting as json_util.split_transcription, on the compact columns."""
+        out = SegmentTable()
+        ws, we, wt = self.word_starts, self.word_ends, self.word_texts
+        for i in range(len(self)):
+            sentence = self.sentences[i]
+            words = self.word_range(i)
+            if contains_weird_words(sentence):
+                sentence = ""
+                words = range(0)
+            if ',' not in sentence and '.' not in sentence:
+                out.append(self.starts[i], self.ends[i], sentence, ((ws[j], we[j], wt[j]) for j in words))
+                continue
+            if not words:
+                #No word timestamps (words not requested): keep the segment whole
+                out.append(self.starts[i], self.ends[i], sentence, ())
+                continue
+            current = []
+            emitted = 0
+            for j in words:
+                current.append(j)
+                aText = wt[j].strip()
+                if (aText.endswith(',') or aText.endswith('.')) and len(current) >= 3:
+                    out.append(ws[current[0]], we[current[-1]], ' '.join(wt[k] for k in current).strip(),
+                               ((ws[k], we[k], wt[k]) for k in current))
+                    emitted += 1
+                    current = []
+            if not current:
+                continue
+            if emitted and len(current) < 3:
+                #Append short remaining part to the last sentence
+                out.ends[-1] = we[current[-1]]
+                out.sentences[-1] += ' ' + ' '.join(wt[k] for k in current)
+                for k in current:
+                    out.word_starts.append(ws[k])
+                    out.word_ends.append(we[k])
+                    out.word_texts.append(wt[k])
+                out.word_offsets[-1] = len(out.word_texts)
+            else:
+                out.append(ws[current[0]], we[current[-1]], ' '.join(wt[k] for k in current).strip(),
+                           ((ws[k], we[k], wt[k]) for k in current))
+        return out
+
+    def encode_json(self, parts):
+        """Append the JSON encoding of the segment list to parts."""
+        ws, we, wt = self.word_starts, self.word_ends, self.word_texts
+        parts.append("[")
+        for i in range(len(self)):
+            if i:
+                parts.append(",")
+            parts.append('{"start":%s,"end":%s,"sentence":%s,"words":['
+                         % (_encode_float(self.starts[i]), _encode_float(self.ends[i]), _encode_str(self.sentences[i])))
+            parts.append(",".join(['{"start":%s,"end":%s,"text":%s}' % (_encode_float(ws[j]), _encode_float(we[j]), _encode_str(wt[j]))
+                                    for j in self.word_range(i)]))
+            parts.append("]}")
+        parts.append("]")
+
+
+OUTPUTS = ("text", "srt", "vtt", "json", "words")
+DEFAULT_OUTPUTS = frozenset(("text", "srt", "json", "words"))
+TIMED_OUTPUTS = frozenset(("srt", "vtt", "json", "words"))
+
+def parse_outputs(value):
+    """Parse a comma separated list of requested outputs, e.g. "text,srt"."""
+    if not value:
+        return DEFAULT_OUTPUTS
+    if isinstance(value, str):
+        value = value.split(",")
+    outputs = frozenset(v.strip().lower() for v in value if v.strip())
+    unknown = outputs.difference(OUTPUTS)
+    if unknown:
+        raise ValueError("Unknown output(s): "+", ".join(sorted(unknown)))
+    return outputs
+
+def formatTimeStamp(aT=0):
+    aH = int(aT/3600)
+    aM = int((aT%3600)/60)
+    aS = (aT%60)
+    return "%02d:%02d:%06.3f" % (aH,aM,aS)
+
+def format_srt_text(text, max_width, max_lines):
+    words = text.split()
+    lines = []
+    current_line = []
+    current_length = 0
+
+    for word in words:
+        if current_length + len(word) + 1 > max_width:
+            lines.append(' '.join(current_line))
+            current_line = [word]
+            current_length = len(word)
+        else:
+            current_line.append(word)
+            current_length += len(word) + 1
+
+    if current_line:
+        lines.append(' '.join(current_line))
+
+    return '\n'.join(lines[:max_lines])
+
+
+class TranscriptionResult:
+    """Pipeline output, serialized once at response time.
+
+    Subtitles are rendered on demand from cues, the unsplit pass segments,
+    so only the requested outputs are ever built.
+    """
+
+    __slots__ = ("text", "_srt", "segments", "cues", "outputs", "max_line_width", "max_line_count", "aborted", "no_speech")
+
+    def __init__(self, text="", srt=None, segments=None, outputs=DEFAULT_OUTPUTS):
+        self.text = text
+        self._srt = srt or None
+        self.segments = segments if segments is not None else SegmentTable()
+        self.cues = self.segments
+        self.outputs = outputs
+        self.max_line_width = 80
+        self.max_line_count = 2
+        #Decoding stopped early, e.g. too many hallucinated phrases
+        self.aborted = False
+        #No speech or vocals found, no pass was run
+        self.no_speech = False
+
+    @property
+    def srt(self):
+        if self._srt is None:
+            self._srt = "".join("%d\n%s --> %s\n%s\n\n" % (i+1, formatTimeStamp(start), formatTimeStamp(end), text)
+                                for i, (start, end, text) in enumerate(self._cue_lines()))
+        return self._srt
+
+    @srt.setter
+    def srt(self, value):
+        self._srt = value or None
+
+    @property
+    def vtt(self):
+        return "WEBVTT\n\n" + "".join("%s --> %s\n%s\n\n" % (formatTimeStamp(start), formatTimeStamp(end), text)
+                                      for start, end, text in self._cue_lines())
+
+    def _cue_lines(self):
+        cues = self.cues
+        for i in range(len(cues)):
+            yield cues.starts[i], cues.ends[i], format_srt_text(cues.sentences[i], self.max_line_width, self.max_line_count)
+
+    @classmethod
+    def from_dict(cls, data, outputs=DEFAULT_OUTPUTS):
+        srt = data.get("srt", "")
+        if not isinstance(srt, str):
+            srt = ""
+        return cls(data.get("text", ""), srt, SegmentTable.from_list(data.get("json", [])), outputs)
+
+    def to_dict(self):
+        result = {}
+        if "srt" in self.outputs:
+            result["srt"] = self.srt
+        if "vtt" in self.outputs:
+            result["vtt"] = self.vtt
+        if "text" in self.outputs:
+            result["text"] = self.text
+        if "json" in self.outputs or "words" in self.outputs:
+            result["json"] = self.segments.to_list()
+        if self.no_speech:
+            result["no_speech"] = True
+        return result
+
+    def to_json(self):
+        """Serialize to UTF-8 JSON bytes, without building intermediate dicts unless orjson is present."""
+        if orjson is not None:
+            return orjson.dumps(self.to_dict())
+        parts = []
+        for key in ("srt", "vtt", "text"):
+            if key in self.outputs:
+                parts.append(',"%s":%s' % (key, _encode_str(getattr(self, key))))
+        if "json" in self.outputs or "words" in self.outputs:
+            parts.append(',"json":')
+            self.segments.encode_json(parts)
+        if self.no_speech:
+            parts.append(',"no_speech":true')
+        if parts:
+            parts[0] = parts[0][1:]
+        return ("{" + "".join(parts) + "}").encode("ascii")
+
+    def encode(self, compression=None):
+        """Return (body, content_encoding); content_encoding is None when uncompressed."""
+        body = self.to_json()
+        compression = negotiate_compression(compression)
+        if compression == "br":
+            return brotli.compress(body, quality=4), "br"
+        if compression == "gzip":
+            return gzip.compress(body, compresslevel=5), "gzip"
+        return body, None
+
+def negotiate_compression(accepted):
+    """Pick br or gzip from an Accept-Encoding style value, or None."""
+    if not accepted:
+        return None
+    accepted = [a.split(";")[0].strip().lower() for a in accepted.split(",")]
+    if "br" in accepted and brotli is not None:
+        return "br"
+    if "gzip" in accepted or "br" in accepted:
+        return "gzip"
+    return None
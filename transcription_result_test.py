@@ -0,0 +1,126 @@
+import gzip
+import json
+import unittest
+
+import transcription_result
+from json_util import split_transcription
+from transcription_result import SegmentTable, TranscriptionResult, negotiate_compression, parse_outputs
+
+SEGMENTS = [
+    {
+        "start": 0.0,
+        "end": 2.5,
+        "sentence": "Hello there, this is a test. Ok",
+        "words": [
+            {"start": 0.0, "end": 0.3, "text": "Hello"},
+            {"start": 0.3, "end": 0.5, "text": "there,"},
+            {"start": 0.5, "end": 0.7, "text": "this"},
+            {"start": 0.7, "end": 0.9, "text": "is"},
+            {"start": 0.9, "end": 1.1, "text": "a"},
+            {"start": 1.1, "end": 1.5, "text": "test."},
+            {"start": 1.6, "end": 2.5, "text": "Ok"}
+        ]
+    },
+    {
+        "start": 2.6,
+        "end": 3.5,
+        "sentence": "Hãy đăng ký kênh",
+        "words": [{"start": 2.6, "end": 3.5, "text": "Hãy"}]
+    },
+    {
+        "start": 3.6,
+        "end": 4.0,
+        "sentence": "Xin chào",
+        "words": [{"start": 3.6, "end": 4.0, "text": "Xin"}, {"start": 3.8, "end": 4.0, "text": "chào"}]
+    }
+]
+
+class TestSegmentTable(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(SegmentTable.from_list(SEGMENTS).to_list(), SEGMENTS)
+
+    def test_split_matches_json_util(self):
+        expected = split_transcription(json.loads(json.dumps(SEGMENTS)))
+        self.assertEqual(SegmentTable.from_list(SEGMENTS).split_sentences().to_list(), expected)
+
+    def test_split_without_words(self):
+        #outputs=text,json: no word timestamps, segments are kept whole
+        segments = [dict(seg, words=[]) for seg in SEGMENTS]
+        result = TranscriptionResult("Hello", segments=SegmentTable.from_list(segments).split_sentences(),
+                                     outputs=parse_outputs("text,json"))
+        self.assertEqual([seg["sentence"] for seg in json.loads(result.to_json())["json"]],
+                         ["Hello there, this is a test. Ok", "", "Xin chào"])
+
+    def test_extend_rebases_word_offsets(self):
+        table = SegmentTable.from_list(SEGMENTS[:1])
+        table.extend(SegmentTable.from_list(SEGMENTS[2:]))
+        self.assertEqual(table.to_list(), [SEGMENTS[0], SEGMENTS[2]])
+
+class TestTranscriptionResult(unittest.TestCase):
+    def setUp(self):
+        self.result = TranscriptionResult("Hello", "1\n00:00:00.000 --> 00:00:02.500\nHello\n\n",
+                                          SegmentTable.from_list(SEGMENTS))
+
+    def test_builtin_encoder_matches_dict(self):
+        saved = transcription_result.orjson
+        transcription_result.orjson = None
+        try:
+            body = self.result.to_json()
+        finally:
+            transcription_result.orjson = saved
+        self.assertEqual(json.loads(body), self.result.to_dict())
+
+    def test_builtin_encoder_non_finite_times(self):
+        segments = [{"start": float("nan"), "end": float("inf"), "sentence": "Hello",
+                     "words": [{"start": float("-inf"), "end": 0.5, "text": "Hello"}]}]
+        result = TranscriptionResult("Hello", segments=SegmentTable.from_list(segments), outputs=parse_outputs("json"))
+        saved = transcription_result.orjson
+        transcription_result.orjson = None
+        try:
+            body = result.to_json()
+        finally:
+            transcription_result.orjson = saved
+        def reject(constant):
+            raise ValueError("invalid JSON constant "+constant)
+        #null like orjson, where json.dumps would write NaN/Infinity
+        expected = [{"start": None, "end": None, "sentence": "Hello", "words": [{"start": None, "end": 0.5, "text": "Hello"}]}]
+        self.assertEqual(json.loads(body, parse_constant=reject), {"json": expected})
+        self.assertEqual(body, json.dumps({"json": expected}, separators=(",", ":")).encode("ascii"))
+
+    def test_gzip(self):
+        body, encoding = self.result.encode("gzip")
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), self.result.to_dict())
+
+    def test_outputs_select_keys(self):
+        self.result.outputs = parse_outputs("text,vtt")
+        self.assertEqual(json.loads(self.result.to_json()), {"text": "Hello", "vtt": self.result.vtt})
+        with self.assertRaises(ValueError):
+            parse_outputs("text,pdf")
+
+    def test_no_speech_flag(self):
+        result = TranscriptionResult(outputs=parse_outputs("text,json"))
+        result.no_speech = True
+        saved = transcription_result.orjson
+        transcription_result.orjson = None
+        try:
+            body = result.to_json()
+        finally:
+            transcription_result.orjson = saved
+        self.assertEqual(json.loads(body), {"text": "", "json": [], "no_speech": True})
+        self.assertEqual(result.to_dict(), json.loads(body))
+        self.assertNotIn("no_speech", self.result.to_dict())
+
+    def test_subtitles_rendered_from_cues(self):
+        result = TranscriptionResult("Xin chào", segments=SegmentTable.from_list(SEGMENTS[2:]))
+        self.assertEqual(result.srt, "1\n00:00:03.600 --> 00:00:04.000\nXin chào\n\n")
+        self.assertEqual(result.vtt, "WEBVTT\n\n00:00:03.600 --> 00:00:04.000\nXin chào\n\n")
+
+    def test_negotiate_compression(self):
+        self.assertIsNone(negotiate_compression(None))
+        self.assertIsNone(negotiate_compression("identity"))
+        self.assertEqual(negotiate_compression("deflate, gzip;q=0.8"), "gzip")
+        self.assertIn(negotiate_compression("br"), ("br", "gzip"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from metrics import metrics
+
+#Stages pushed through at startup: "all", "none" (or "0"), or a comma separated list
+WARMUP_STAGES = os.environ.get("WHISPERHALLU_WARMUP", "all")
+#Length of the synthetic warm-up clip
+WARMUP_SECONDS = float(os.environ.get("WHISPERHALLU_WARMUP_SECONDS", "3"))
+#Worker processes that must have warmed up before /ready answers 200
+READY_WORKERS = int(os.environ.get("WHISPERHALLU_READY_WORKERS", "1"))
+
+def synthClip(seconds=WARMUP_SECONDS, rate=16000, channels=1):
+    """Temporary 16-bit WAV of voice-like syllables: harmonics of a gliding pitch, 4 per second, with short pauses.
+
+    Loud enough for VAD and the vocal activity check, so warm-up goes through
+    the same stages as a request instead of exiting early on silence.
+    """
+    t = np.arange(int(seconds * rate)) / float(rate)
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(h * phase) / h for h in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    samples = 0.2 * voice * envelope + np.random.default_rng(0).normal(0, 0.003, len(t))
+    data = (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+    fd, path = tempfile.mkstemp(suffix=".warmup.wav")
+    os.close(fd)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.repeat(data, channels).tobytes())
+    return path
+
+def enabledStages(stages=WARMUP_STAGES):
+    """None for every stage, else the set of stage names to warm up."""
+    stages = stages.strip().lower()
+    if stages in ("", "all", "1"):
+        return None
+    if stages in ("none", "0"):
+        return set()
+    return {s.strip() for s in stages.split(",") if s.strip()}
+
+class Readiness:
+    """Warm-up state of one server process, published as the warmup_<server> metrics section.
+
+    The server process serves /ready from the sections of all its workers,
+    since LitServe runs setup() in worker processes.
+    """
+
+    def __init__(self, server, stages=WARMUP_STAGES):
+        self.server = server
+        self.enabled = enabledStages(stages)
+        self.state = "loading"
+        self.timings = {}
+        self.errors = {}
+        self.publish()
+
+    def publish(self):
+        metrics.section("warmup_"+self.server, {"state": self.state, "timings": dict(self.timings), "errors": dict(self.errors)})
+
+    def run(self, steps):
+        """Run the enabled (name, fn) steps in order, timing each, then report ready.
+
+        A failing step is reported and skipped: the request path will hit the
+        same error, keeping the worker out of rotation would not help.
+        """
+        self.state = "warming"
+        self.publish()
+        for name, fn in steps:
+            if self.enabled is not None and name not in self.enabled:
+                continue
+            startTime = time.time()
+            try:
+                fn()
+            except Exception as e:
+                print("Warning: warm-up of "+name+" failed")
+                print(e)
+                self.errors[name] = str(e)
+            self.timings[name] = round(time.time() - startTime, 3)
+            metrics.observe("warmup_seconds", self.timings[name], stage=name, server=self.server)
+            print("WARMUP "+name+" T="+str(self.timings[name]), flush=True)
+            self.publish()
+        self.state = "ready"
+        self.publish()
+
+def readiness(sections, server, expected=READY_WORKERS):
+    """(ready, report) from collect()["sections"]: ready once `expected` workers have warmed up."""
+    workers = sections.get("warmup_"+server, {})
+    ready = len(workers) >= expected and all(w["state"] == "ready" for w in workers.values())
+    return ready, {"ready": ready, "workers": workers}
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import metrics
+from audio_classifier import vocalActivity
+from warmup import Readiness, enabledStages, readiness, synthClip
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(metrics.metrics, "metricsDir", tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_clip_is_not_silence(self):
+        path = synthClip(seconds=2, rate=44100, channels=2)
+        self.addCleanup(os.unlink, path)
+        #Passes the no-speech check, so warm-up reaches the Whisper pass
+        self.assertGreater(vocalActivity(path), 1.0)
+
+    def test_enabled_stages(self):
+        self.assertIsNone(enabledStages("all"))
+        self.assertEqual(enabledStages("0"), set())
+        self.assertEqual(enabledStages("vad, whisper"), {"vad", "whisper"})
+
+    def test_ready_after_enabled_steps(self):
+        runs = []
+        state = Readiness("test", stages="vad,whisper,demucs")
+        self.assertFalse(readiness(metrics.collect(metrics.metrics.metricsDir)["sections"], "test")[0])
+        def fail():
+            raise IOError("no demucs server")
+        state.run([("ffmpeg", lambda: runs.append("ffmpeg")), ("vad", lambda: runs.append("vad")),
+                   ("demucs", fail), ("whisper", lambda: runs.append("whisper"))])
+        self.assertEqual(runs, ["vad", "whisper"])
+        ready, report = readiness(metrics.collect(metrics.metrics.metricsDir)["sections"], "test")
+        self.assertTrue(ready)
+        worker = report["workers"][str(os.getpid())]
+        self.assertEqual(set(worker["timings"]), {"vad", "demucs", "whisper"})
+        self.assertEqual(worker["errors"], {"demucs": "no demucs server"})
+        self.assertFalse(readiness(metrics.collect(metrics.metrics.metricsDir)["sections"], "test", expected=2)[0])
+
+if __name__ == '__main__':
+    unittest.main()
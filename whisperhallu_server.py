@@ -1,50 +1,280 @@
 import litserve as ls
+import asyncio
+import json
+import multiprocessing
 import os
+import glob
+import hashlib
 import tempfile
-from fastapi import Response, HTTPException
+import time
+from fastapi import Request, Response, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydub import AudioSegment
 import torch
+import transcribeHallu
 from transcribeHallu import loadModel, transcribePrompt
-import json
+from transcription_result import parse_outputs
+from model_registry import parseModelKey
+from metrics import collect, metrics
+from job_queue import JobQueue, JobWorkerPool
+from admission import UPLOAD_BYTES_PER_SECOND, Overloaded, admit, estimateCost, probeDuration, sizeClass, uploadCost
+from coalesce import AsyncInFlight, requestKey
+from audio_format import TARGETS, sniffBytes
+from audio_classifier import classify
+from profiles import getProfile
+from language_id import audioHash
+from warmup import Readiness, readiness, synthClip
+from tracing import newRequestId
 import requests
 
+# Job worker threads, also used to turn the backlog into a Retry-After delay
+# Opt-in: the job worker process loads its own Whisper, Demucs and VAD models next to the LitServe worker's
+JOB_WORKERS = int(os.environ.get("WHISPERHALLU_JOB_WORKERS", "0"))
+# Seconds between checks for finished batch items
+BATCH_POLL_INTERVAL = 0.5
+# Seconds a /batch stream waits for its items; unfinished ones then get a failed line with their job id
+BATCH_TIMEOUT = float(os.environ.get("WHISPERHALLU_BATCH_TIMEOUT", "3600"))
+
+def storeAudio(audio_data):
+    """Save uploaded audio for transcription.
+
+    WAV, FLAC and Opus (e.g. pre-encoded by hallu_client.py --preencode) are
+    kept as they are, ffmpeg reads them directly. Anything else is converted to WAV.
+    """
+    container, rate, channels = sniffBytes(audio_data)
+    if container in ("wav", "flac", "opus"):
+        with tempfile.NamedTemporaryFile(delete=False, suffix="."+container) as f:
+            f.write(audio_data)
+        metrics.inc("preencoded_uploads_total" if rate == TARGETS["whisper"]["rate"] and channels == 1 else "lossless_uploads_total", format=container)
+        return f.name
+
+    # Create a temporary file for the original upload
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".upload") as temp_file:
+        temp_file.write(audio_data)
+    try:
+        # Convert to WAV, ffmpeg detects the input format
+        audio = AudioSegment.from_file(temp_file.name)
+        wav_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
+        audio.export(wav_file.name, format="wav")
+        return wav_file.name
+    finally:
+        os.unlink(temp_file.name)
+
+def parseIsMusic(value):
+    """Request override of the music/speech classifier: true/false, or None for "auto"."""
+    if value is None or str(value).lower() in ("", "auto"):
+        return None
+    if str(value).lower() in ("1", "true", "yes", "music"):
+        return True
+    if str(value).lower() in ("0", "false", "no", "speech"):
+        return False
+    raise ValueError("is_music must be true, false or auto")
+
+def describeAudio(request_data, isMusic=None):
+    """Probe the decoded audio and attach its duration, music/speech class, estimated cost and size class."""
+    duration = probeDuration(request_data["file_path"])
+    if isMusic is None:
+        # Only music goes through Demucs and the music passes
+        startTime = time.time()
+        try:
+            audio_class, score = classify(request_data["file_path"], duration)
+            print("AUDIO CLASS="+audio_class+" score="+str(round(score, 2)), flush=True)
+        except Exception as e:
+            print("Warning: can't classify audio, assuming music")
+            print(e)
+            audio_class = "unknown"
+        metrics.observe("classify_seconds", time.time() - startTime)
+        metrics.inc("audio_class_total", label=audio_class, source="auto")
+        isMusic = audio_class in ("music", "unknown")
+    else:
+        audio_class = "music" if isMusic else "speech"
+        metrics.inc("audio_class_total", label=audio_class, source="override")
+    request_data.update(duration=duration, is_music=isMusic, audio_class=audio_class,
+                        cost=estimateCost(duration, isMusic), size_class=sizeClass(duration))
+    return request_data
+
+def admitRequest(request_data, backlog):
+    """429 with Retry-After when the estimated backlog is over WHISPERHALLU_MAX_BACKLOG."""
+    try:
+        admit(request_data["cost"], backlog, JOB_WORKERS)
+    except Overloaded as e:
+        metrics.inc("requests_rejected_total", size_class=request_data["size_class"])
+        os.unlink(request_data["file_path"])
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retryAfter)})
+    return request_data
+
+def warmUp(readiness_state):
+    """Push a synthetic clip through every enabled stage so the first request doesn't pay for cold starts."""
+    clip = synthClip()
+    try:
+        readiness_state.run(transcribeHallu.warmUpSteps(clip))
+    finally:
+        for path in glob.glob(clip+"*"):
+            os.unlink(path)
+
+def readyRoute(server):
+    """GET /ready: 200 once the workers of `server` have warmed up, else 503, with per-stage warm-up timings."""
+    def ready():
+        is_ready, report = readiness(collect()["sections"], server)
+        return JSONResponse(report, status_code=200 if is_ready else 503)
+    return ready
+
+def addAdmission(app, queue):
+    """429 on POST /predict before LitServe queues it, so requests waiting for a worker count in the backlog.
+
+    Their cost is estimated from Content-Length, as the upload is not decoded yet, and held
+    in the shared backlog until the response is sent.
+    """
+    @app.middleware("http")
+    async def admitPredict(request: Request, call_next):
+        if request.method != "POST" or request.url.path != "/predict":
+            return await call_next(request)
+        contentLength = int(request.headers.get("content-length") or 0)
+        cost = uploadCost(contentLength)
+        # Jobs only hold up /predict when a job worker process is running them
+        backlog = await run_in_threadpool(queue.backlog, JOB_WORKERS > 0)
+        try:
+            admit(cost, backlog, JOB_WORKERS)
+        except Overloaded as e:
+            metrics.inc("requests_rejected_total", size_class=sizeClass(contentLength / UPLOAD_BYTES_PER_SECOND))
+            return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retryAfter)})
+        request_id = newRequestId()
+        await run_in_threadpool(queue.addActive, request_id, cost)
+        try:
+            return await call_next(request)
+        finally:
+            await run_in_threadpool(queue.removeActive, request_id)
+
+class PredictCoalescing:
+    """ASGI middleware: concurrent identical POST /predict requests share one transcription.
+
+    Every /predict goes through the server process before LitServe hands it to a
+    worker, so duplicates are joined here whichever worker would have taken them.
+    The key is the uploaded audio (or URL) and every form field; traced requests run on their own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.inflight = AsyncInFlight(counter="predict_coalesced_total")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/predict":
+            return await self.app(scope, receive, send)
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+
+        def replay():
+            # The buffered body once, then the client's own messages (disconnect)
+            sent = []
+            async def receiveAgain():
+                if sent:
+                    return await receive()
+                sent.append(True)
+                return {"type": "http.request", "body": body, "more_body": False}
+            return receiveAgain
+
+        async def forward():
+            start, chunks = {}, []
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    start.update(message)
+                elif message["type"] == "http.response.body":
+                    chunks.append(message.get("body", b""))
+            await self.app(scope, replay(), capture)
+            return start, b"".join(chunks)
+
+        key = await self.key(scope, replay())
+        start, content = await (forward() if key is None else self.inflight.run(key, forward))
+        await send(start)
+        await send({"type": "http.response.body", "body": content})
+
+    async def key(self, scope, receive):
+        """Coalescing key of a /predict form, None if it can't be read (the worker answers it)."""
+        try:
+            form = await Request(scope, receive).form()
+        except Exception:
+            return None
+        try:
+            if str(form.get("trace", "")).lower() in ("1", "true", "yes"):
+                return None
+            upload = form.get("content")
+            if form.get("url"):
+                digest = "url:"+form.get("url")
+            elif upload is not None and not isinstance(upload, str):
+                digest = await run_in_threadpool(lambda: hashlib.sha1(upload.file.read()).hexdigest())
+            else:
+                return None
+            return requestKey(digest, **{k: v for k, v in form.items() if k != "content"})
+        finally:
+            await form.close()
+
 class WhisperHalluAPI(ls.LitAPI):
+    # Name of the warm-up state reported to /ready; the job worker process reports its own
+    warmup_server = "whisperhallu"
+    # Requests transcribed at once: LitServe hands a worker one at a time, job workers run several
+    concurrency = 1
+
     def setup(self, device):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # Not ready until the models are loaded and warmed up
+        self.readiness = Readiness(self.warmup_server)
+        # LitServe passes "cpu", "cuda" or "cuda:<idx>"
+        self.device = torch.device(device if device != "cuda" or torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
-        self.model_size = "medium"
-        loadModel("0", modelSize=self.model_size)
+        self.model_size = os.environ.get("WHISPERHALLU_MODEL", "medium")
+        budget = os.environ.get("WHISPERHALLU_MODEL_BUDGET_MB")
+        loadModel(str(self.device.index or 0), modelSize=self.model_size, budgetMB=int(budget) if budget else None,
+                  aDevice=self.device.type, autotune=os.environ.get("WHISPERHALLU_CPU_AUTOTUNE", "1") == "1", concurrency=self.concurrency)
+        # Extra models to keep warm, e.g. "large,std-medium"
+        for key in os.environ.get("WHISPERHALLU_PRELOAD_MODELS", "").split(","):
+            if key.strip():
+                transcribeHallu.registry.load(key)
+        warmUp(self.readiness)
 
     def decode_request(self, request):
+        # Admitted by addAdmission() before it was queued
+        return self.read_request(request)
+
+    def read_request(self, request):
         # Get the URL from the request, if present
         url = request.get("url")
 
         # Get lng and lng_input from the request, with default values
+        # "auto" detects the spoken language before transcription
         lng = request.get("lng", "en")
         lng_input = request.get("lng_input", "en")
 
+        # Optional response compression: "gzip", "br" or an Accept-Encoding style list
+        compression = request.get("compression")
+
+        # Requested outputs, e.g. "text,srt"; only the passes they need are run
+        # Optional model, e.g. "large", "fstr-medium", "std-large" or "sm4t"
+        # is_music: true/false skips the music/speech classifier, "auto" (default) runs it
+        # Optional profile: fast, balanced (default) or accurate; its model applies unless model is given
+        # trace=true writes a Chrome trace of this request (WHISPERHALLU_TRACE_DIR), else WHISPERHALLU_TRACE_RATE samples
+        trace = str(request.get("trace", "")).lower() in ("1", "true", "yes")
+        try:
+            outputs = parse_outputs(request.get("outputs"))
+            is_music = parseIsMusic(request.get("is_music"))
+            profile, settings = getProfile(request.get("profile"))
+            model = request.get("model") or settings["model"]
+            if model:
+                backend, size = parseModelKey(model, transcribeHallu.whisperFound)
+                model = backend.lower()+"-"+size
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         if url:
             # If URL is provided, download the file
             try:
                 response = requests.get(url)
                 response.raise_for_status()
                 
-                # Create a temporary file with a .mp3 extension
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-                
-                # Write the downloaded content to the temporary file
-                with open(temp_file.name, "wb") as f:
-                    f.write(response.content)
-                
-                # Convert MP3 to WAV
-                audio = AudioSegment.from_mp3(temp_file.name)
-                wav_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-                audio.export(wav_file.name, format="wav")
-                
-                # Clean up the temporary MP3 file
-                os.unlink(temp_file.name)
-                
-                return {"file_path": wav_file.name, "lng": lng, "lng_input": lng_input}
+                return describeAudio({"file_path": storeAudio(response.content), "lng": lng, "lng_input": lng_input, "outputs": outputs, "model": model, "profile": profile, "compression": compression, "request_id": newRequestId(), "trace": trace}, is_music)
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Error downloading or processing file from URL: {str(e)}")
 
@@ -53,26 +283,13 @@ class WhisperHalluAPI(ls.LitAPI):
         if audio_file is None:
             raise HTTPException(status_code=400, detail="No audio file or URL found in the request.")
 
-        # Create a temporary file with a .mp3 extension
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        
         # Read the file content
         audio_data = audio_file.read()
         
-        # Write the audio data to the temporary file
-        with open(temp_file.name, "wb") as f:
-            f.write(audio_data)
-        
-        # Convert MP3 to WAV
         try:
-            audio = AudioSegment.from_mp3(temp_file.name)
-            wav_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-            audio.export(wav_file.name, format="wav")
-            
-            # Clean up the temporary MP3 file
-            os.unlink(temp_file.name)
-            print("wav_file.name: ", wav_file.name)
-            return {"file_path": wav_file.name, "lng": lng, "lng_input": lng_input}
+            file_path = storeAudio(audio_data)
+            print("file_path: ", file_path)
+            return describeAudio({"file_path": file_path, "lng": lng, "lng_input": lng_input, "outputs": outputs, "model": model, "profile": profile, "compression": compression, "request_id": newRequestId(), "trace": trace}, is_music)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error processing audio file: {str(e)}")
 
@@ -83,27 +300,176 @@ class WhisperHalluAPI(ls.LitAPI):
             lng_input = request_data.get("lng_input", "en")
 
             # Set up transcription parameters
-            isMusic = True
+            isMusic = request_data.get("is_music", True)
             prompt = "Whisper, Ok. A pertinent sentence for your purpose in your language. Ok, Whisper. Whisper, Ok. Ok, Whisper. Whisper, Ok. Please find here, an unlikely ordinary sentence. This is to avoid a repetition to be deleted. Ok, Whisper. "
+            if lng == "auto":
+                # Prompt in the detected language
+                prompt = None
 
             # Perform transcription
-            result = transcribePrompt(path=file_path, addSRT=True, lng=lng, prompt=prompt, lngInput=lng_input, isMusic=isMusic)
+            startTime = time.time()
+            profile = request_data.get("profile")
+            result = transcribePrompt(path=file_path, lng=lng, prompt=prompt, lngInput=lng_input, isMusic=isMusic, outputs=request_data.get("outputs"), modelKey=request_data.get("model"), profile=profile,
+                                      requestId=request_data.get("request_id"), trace=request_data.get("trace", False))
+            metrics.observe("predict_seconds", time.time() - startTime, size_class=request_data.get("size_class", "unknown"))
+            # Per profile and audio length, so customers can compare speed and accuracy
+            metrics.observe("profile_seconds", time.time() - startTime, profile=getProfile(profile)[0], size_class=request_data.get("size_class", "unknown"))
 
-            return result
+            return result, request_data.get("compression"), request_data.get("request_id")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error transcribing audio: {str(e)}")
 
-    def encode_response(self, transcription):
+    def encode_response(self, output):
         try:
-            # Parse the JSON string returned by transcribePrompt
-            transcription_data = json.loads(transcription)
-            
-            # Return the transcription as JSON
-            return Response(content=json.dumps(transcription_data), media_type="application/json")
+            transcription, compression, request_id = output
+
+            # Serialize the TranscriptionResult once, compressed if the client asked for it
+            content, content_encoding = transcription.encode(compression)
+            # Request id: REQUEST= in the logs and the name of its trace file
+            headers = {"X-Request-Id": request_id} if request_id else {}
+            if content_encoding:
+                headers["Content-Encoding"] = content_encoding
+            return Response(content=content, media_type="application/json", headers=headers)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error encoding response: {str(e)}")
 
+def runJobWorkers(workers, device):
+    """Job worker process: its own model, pulling submitted jobs from the queue."""
+    api = WhisperHalluAPI()
+    api.warmup_server = "jobs"
+    api.concurrency = workers
+    api.setup(device)
+    def handler(params):
+        params["outputs"] = parse_outputs(params.get("outputs"))
+        result, compression, _request_id = api.predict(params)
+        return result.encode(compression)
+    JobWorkerPool(JobQueue(), handler, workers=workers).run()
+
+def addJobRoutes(app, api, queue, workers=JOB_WORKERS):
+    """Asynchronous jobs: POST /jobs, then GET /jobs/{id} until done and GET /jobs/{id}/result.
+
+    POST /batch queues many files and URLs at once and streams their results as NDJSON.
+    Without job workers nothing would run them, so every route answers 503.
+    """
+    if workers <= 0:
+        def jobsDisabled():
+            raise HTTPException(status_code=503, detail="Jobs are disabled: set WHISPERHALLU_JOB_WORKERS to 1 or more")
+        app.add_api_route("/jobs", jobsDisabled, methods=["POST"])
+        app.add_api_route("/jobs/{job_id}", jobsDisabled, methods=["GET"])
+        app.add_api_route("/jobs/{job_id}/result", jobsDisabled, methods=["GET"])
+        app.add_api_route("/batch", jobsDisabled, methods=["POST"])
+        return
+
+    def enqueue(params, callbackUrl=None, resultUrl=None):
+        params["outputs"] = sorted(params["outputs"])
+        # Same audio and options as a queued or running job: share it
+        key = requestKey(audioHash(params["file_path"]), lng=params["lng"], lng_input=params["lng_input"],
+                         outputs=params["outputs"], model=params["model"], compression=params["compression"],
+                         is_music=params["is_music"], profile=params["profile"])
+        if not queue.pending(key):
+            admitRequest(params, queue.backlog())
+        return queue.submit(params, callbackUrl=callbackUrl, resultUrl=resultUrl,
+                            cost=params["cost"], sizeClass=params["size_class"], key=key)
+
+    async def submitJob(request: Request):
+        form = await request.form()
+        params = await run_in_threadpool(api.read_request, form)
+        jobId = await run_in_threadpool(enqueue, params, form.get("callback_url") or None, str(request.base_url)+"jobs/{id}/result")
+        return {"id": jobId, "status": "queued"}
+
+    def enqueueItem(item):
+        try:
+            params = api.read_request(item)
+            # Items are embedded in the stream as plain JSON
+            params["compression"] = None
+            return enqueue(params), None
+        except HTTPException as e:
+            error = {"status": "failed", "code": e.status_code, "error": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+            return None, error
+
+    async def submitBatch(request: Request):
+        form = await request.form()
+        options = {k: v for k, v in form.items() if k not in ("content", "url")}
+        items = [("content", upload, upload.filename) for upload in form.getlist("content")]
+        items += [("url", url, url) for url in form.getlist("url")]
+        if not items:
+            raise HTTPException(status_code=400, detail="No audio file or URL found in the request.")
+        metrics.inc("batch_items_total", len(items))
+        queued = await asyncio.gather(*(run_in_threadpool(enqueueItem, dict(options, **{field: value})) for field, value, _name in items))
+
+        async def stream():
+            pending = {}
+            for index, ((_field, _value, name), (jobId, error)) in enumerate(zip(items, queued)):
+                if error is not None:
+                    yield json.dumps(dict(index=index, name=name, **error))+"\n"
+                else:
+                    pending.setdefault(jobId, []).append((index, name))
+            # Results in completion order; the result body is embedded as is
+            deadline = time.time() + BATCH_TIMEOUT
+            while pending:
+                finished = await run_in_threadpool(queue.finished, pending)
+                for jobId, row in finished.items():
+                    for index, name in pending.pop(jobId):
+                        head = json.dumps({"index": index, "name": name, "id": jobId})[:-1]
+                        if row is None:
+                            yield head+', "status": "failed", "error": "Unknown or expired job"}\n'
+                        elif row[0] == "failed":
+                            yield head+', "status": "failed", "error": '+json.dumps(row[3])+"}\n"
+                        else:
+                            yield head+', "status": "done", "result": '+row[1].decode("utf-8")+"}\n"
+                if pending and time.time() >= deadline:
+                    # The jobs keep running: their results stay available from /jobs/{id}/result
+                    for jobId, entries in pending.items():
+                        for index, name in entries:
+                            yield json.dumps({"index": index, "name": name, "id": jobId, "status": "failed",
+                                              "error": "Not finished after "+str(int(BATCH_TIMEOUT))+"s"})+"\n"
+                    break
+                if pending:
+                    await asyncio.sleep(BATCH_POLL_INTERVAL)
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    def jobStatus(job_id: str):
+        job = queue.status(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+        return job
+
+    def jobResult(job_id: str):
+        row = queue.result(job_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+        status, content, content_encoding, error = row
+        if status == "failed":
+            raise HTTPException(status_code=500, detail=error)
+        if status != "done":
+            raise HTTPException(status_code=409, detail="Job is "+status)
+        headers = {"Content-Encoding": content_encoding} if content_encoding else None
+        return Response(content=content, media_type="application/json", headers=headers)
+
+    app.add_api_route("/jobs", submitJob, methods=["POST"], status_code=202)
+    app.add_api_route("/jobs/{job_id}", jobStatus, methods=["GET"])
+    app.add_api_route("/jobs/{job_id}/result", jobResult, methods=["GET"])
+    app.add_api_route("/batch", submitBatch, methods=["POST"])
+
 # Run the LitServe server
 if __name__ == "__main__":
-    server = ls.LitServer(WhisperHalluAPI(), accelerator="cuda", timeout=120)  # Increased timeout to 120 seconds
+    # "auto" falls back to CPU on hosts without a GPU
+    accelerator = os.environ.get("WHISPERHALLU_ACCELERATOR", "auto")
+    server = ls.LitServer(WhisperHalluAPI(), accelerator=accelerator, timeout=120)  # Increased timeout to 120 seconds
+    # Worker processes report through metric snapshots, merged here
+    server.app.add_api_route("/metrics", lambda: collect(), methods=["GET"])
+    server.app.add_api_route("/models", lambda: collect()["sections"].get("models", {}), methods=["GET"])
+    # For load balancers: 503 until the LitServe workers have warmed up
+    server.app.add_api_route("/ready", readyRoute("whisperhallu"), methods=["GET"])
+    addAdmission(server.app, JobQueue())
+    # Outside admission: a duplicate joining a run adds nothing to the backlog
+    server.app.add_middleware(PredictCoalescing)
+    # Long transcriptions go through the job queue instead of the 120 s /predict timeout; 503 without job workers
+    addJobRoutes(server.app, WhisperHalluAPI(), JobQueue())
+    if JOB_WORKERS > 0:
+        job_device = "cpu" if accelerator == "cpu" or not torch.cuda.is_available() else "cuda:0"
+        multiprocessing.get_context("spawn").Process(target=runJobWorkers, args=(JOB_WORKERS, job_device), daemon=True).start()
     server.run(port=8889)